@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bandwidth scheduler sharing a global rate fairly between users.
+
+Every running download or upload is a flow with its own token bucket. The
+global rate is split evenly between the users that have flows (capped at
+the per-user rate), and a user's share evenly between their flows. Shares
+are recomputed whenever a flow opens or closes. New flows start with a
+burst allowance, so small files go through at full speed even while large
+transfers are running.
+"""
+
+import io
+import os
+import time
+import logging
+import itertools
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Total bytes per second for all transfers (0 means no global cap)
+BANDWIDTH_LIMIT = int(os.environ.get("BANDWIDTH_LIMIT", 0))
+# Bytes per second a single user may use (0 means no per-user cap)
+PER_USER_BANDWIDTH = int(os.environ.get("PER_USER_BANDWIDTH", 0))
+# Bytes every new flow may transfer before it is throttled
+BANDWIDTH_BURST = int(os.environ.get("BANDWIDTH_BURST", 16 * 1024 * 1024))
+# Largest piece a throttled reader hands out at once
+THROTTLE_READ_SIZE = 1024 * 1024
+
+
+class TokenBucket:
+    """Token bucket that lets consumers run into debt and sleep it off"""
+
+    def __init__(self, rate, burst=0):
+        """
+        Initialize the bucket
+
+        Args:
+            rate (float): Tokens (bytes) added per second, 0 for unlimited
+            burst (int): Tokens available right away
+        """
+        self.rate = rate
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        """Change the refill rate, keeping the tokens earned so far"""
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def consume(self, amount):
+        """Take amount tokens, sleeping until the bucket has paid them back"""
+        with self._lock:
+            if not self.rate:
+                return
+            self._refill()
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            # Never save up more than one second's worth past the burst
+            self.tokens = min(self.tokens + (now - self._updated) * self.rate,
+                              max(self.tokens, self.rate))
+        self._updated = now
+
+
+class Flow:
+    """One running transfer, throttled to its share of the bandwidth"""
+
+    def __init__(self, scheduler, flow_id, user_id, kind, bucket):
+        self.scheduler = scheduler
+        self.flow_id = flow_id
+        self.user_id = user_id
+        self.kind = kind
+        self.bucket = bucket
+        self.transferred = 0
+
+    def consume(self, nbytes):
+        """Account for nbytes transferred, blocking while over the share"""
+        if nbytes <= 0:
+            return
+        self.transferred += nbytes
+        self.bucket.consume(nbytes)
+
+    def close(self):
+        self.scheduler.close_flow(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BandwidthScheduler:
+    """Hands out flows and keeps their rates at a fair share"""
+
+    def __init__(self, global_rate=BANDWIDTH_LIMIT, per_user_rate=PER_USER_BANDWIDTH,
+                 burst=BANDWIDTH_BURST):
+        """
+        Initialize the scheduler
+
+        Args:
+            global_rate (int): Bytes per second for all flows, 0 for no cap
+            per_user_rate (int): Bytes per second per user, 0 for no cap
+            burst (int): Bytes a new flow may transfer unthrottled
+        """
+        self.global_rate = global_rate
+        self.per_user_rate = per_user_rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._flows = {}
+        self._ids = itertools.count(1)
+
+    @property
+    def enabled(self):
+        """True if any cap is configured"""
+        return bool(self.global_rate or self.per_user_rate)
+
+    def open_flow(self, user_id, kind='download'):
+        """
+        Start a throttled transfer for a user
+
+        Args:
+            user_id: Owner of the transfer (None for anonymous transfers,
+                which share one slot)
+            kind (str): 'download' or 'upload', for reporting
+
+        Returns:
+            Flow: Call consume() with every chunk and close() when done
+        """
+        with self._lock:
+            flow = Flow(self, next(self._ids), user_id, kind, TokenBucket(0, self.burst))
+            self._flows[flow.flow_id] = flow
+            self._rebalance()
+        return flow
+
+    def close_flow(self, flow):
+        with self._lock:
+            if self._flows.pop(flow.flow_id, None) is not None:
+                self._rebalance()
+
+    def allocation(self):
+        """
+        Return the current rates
+
+        Returns:
+            dict: {'global_rate', 'per_user_rate', 'users': {user_id:
+            {'rate', 'flows': [{'id', 'kind', 'rate', 'transferred'}]}}}
+        """
+        with self._lock:
+            users = defaultdict(lambda: {'rate': 0, 'flows': []})
+            for flow in self._flows.values():
+                user = users[flow.user_id]
+                user['rate'] += flow.bucket.rate
+                user['flows'].append({
+                    'id': flow.flow_id,
+                    'kind': flow.kind,
+                    'rate': flow.bucket.rate,
+                    'transferred': flow.transferred,
+                })
+            return {
+                'global_rate': self.global_rate,
+                'per_user_rate': self.per_user_rate,
+                'users': dict(users),
+            }
+
+    def _rebalance(self):
+        """Split the bandwidth evenly between users, then between their flows"""
+        by_user = defaultdict(list)
+        for flow in self._flows.values():
+            by_user[flow.user_id].append(flow)
+        if not by_user:
+            return
+        user_rate = self.global_rate / len(by_user) if self.global_rate else 0
+        if self.per_user_rate:
+            user_rate = min(user_rate, self.per_user_rate) if user_rate else self.per_user_rate
+        for flows in by_user.values():
+            for flow in flows:
+                flow.bucket.set_rate(user_rate / len(flows))
+
+
+class ThrottledReader:
+    """
+    File object wrapper that throttles reads through a flow
+
+    python-telegram-bot reads an upload in a single read() and then sends
+    it at full speed, so for uploads this paces when each file or part is
+    handed over, i.e. the average rate over a sequence of parts, not the
+    network transfer of one part.
+    """
+
+    def __init__(self, file, flow):
+        self._file = file
+        self._flow = flow
+        self.name = getattr(file, 'name', None)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            # Wait for the tokens piecewise, so no single wait gets long,
+            # then read the rest in one go without an extra copy
+            remaining = self._remaining()
+            if remaining is None:
+                data = self._file.read()
+                remaining = len(data)
+            else:
+                data = None
+            while remaining > 0:
+                piece = min(remaining, THROTTLE_READ_SIZE)
+                self._flow.consume(piece)
+                remaining -= piece
+            return self._file.read() if data is None else data
+        data = self._file.read(min(size, THROTTLE_READ_SIZE))
+        self._flow.consume(len(data))
+        return data
+
+    def _remaining(self):
+        """Bytes left to read, or None if the file cannot tell"""
+        try:
+            position = self._file.tell()
+            end = self._file.seek(0, io.SEEK_END)
+            self._file.seek(position)
+        except (AttributeError, OSError, ValueError):
+            return None
+        return max(0, end - position)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+# Shared scheduler for all downloads and uploads
+bandwidth = BandwidthScheduler()
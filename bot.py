@@ -8,10 +8,14 @@ logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Time the imports below; heavy modules (yt-dlp, requests, Flask) are only
+# loaded when first used
+from startup import ImportProfiler
+_import_profiler = ImportProfiler().start()
+
 import os
 import json
 import sys
-from flask import Flask, request
 
 # Load environment variables from .env file
 from dotenv import load_dotenv
@@ -49,14 +53,19 @@ except ImportError:
 from handlers.start import start_handler, help_handler
 
 # Import URL handler
-from handlers.url_handler import url_handler
+from handlers.url_handler import url_handler, resume_pending_jobs
+
+# Import job directory manager
+from workspace import workspaces
+
+# Import warm yt-dlp pool
+from ydl_pool import start_preload
 
 from handlers.blacklist_handlers import blacklist_handlers
 from handlers.broadcast_handlers import broadcast_handlers
 from handlers.thumbnail_handlers import thumbnail_handlers
 
-# Flask app for webhook
-app = Flask(__name__)
+_import_profiler.stop().log_report()
 
 def create_application():
     """Create and configure the telegram application or updater based on version"""
@@ -114,21 +123,29 @@ def create_application():
         
         return updater
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """Handle incoming webhook updates"""
-    json_data = request.get_json()
+def create_flask_app():
+    """Create the Flask app for webhook mode, the only mode that needs Flask"""
+    from flask import Flask, request
     
-    if PTB_VERSION >= 20:
-        # v20.x style
-        update = Update.de_json(json_data, telegram_app.bot)
-        telegram_app.process_update(update)
-    else:
-        # v13.x style
-        update = Update.de_json(json_data, telegram_app.dispatcher.bot)
-        telegram_app.dispatcher.process_update(update)
+    app = Flask(__name__)
+    
+    @app.route('/webhook', methods=['POST'])
+    def webhook():
+        """Handle incoming webhook updates"""
+        json_data = request.get_json()
+        
+        if PTB_VERSION >= 20:
+            # v20.x style
+            update = Update.de_json(json_data, telegram_app.bot)
+            telegram_app.process_update(update)
+        else:
+            # v13.x style
+            update = Update.de_json(json_data, telegram_app.dispatcher.bot)
+            telegram_app.dispatcher.process_update(update)
+        
+        return 'OK'
     
-    return 'OK'
+    return app
 
 if __name__ == "__main__":
     # create download directory, if not exist
@@ -142,6 +159,13 @@ if __name__ == "__main__":
     # Create telegram application or updater
     telegram_app = create_application()
     
+    # Pick up downloads interrupted by the last restart, then start
+    # reclaiming the directories of abandoned ones
+    resume_pending_jobs(telegram_app.bot)
+    workspaces.start_janitor()
+    # Import yt-dlp's extractors before the first request needs them
+    start_preload()
+    
     if bool(os.environ.get("WEBHOOK", False)):
         # Webhook mode for production
         webhook_url = os.environ.get("WEBHOOK_URL", "")
@@ -157,6 +181,7 @@ if __name__ == "__main__":
         
         # Run Flask app
         logger.info(f"Starting webhook on port {port}")
+        app = create_flask_app()
         app.run(host='0.0.0.0', port=port)
     else:
         # Polling mode for development
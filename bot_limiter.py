@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Flood-aware scheduler for outgoing Bot API calls.
+
+Telegram limits how many messages a bot may send per second, both overall
+and per chat, and answers with RetryAfter when it is flooded. Every call
+goes through one scheduler that spaces calls to stay within both budgets,
+runs uploads before cosmetic progress edits, drops an edit when a newer
+one for the same message is queued, and pauses all calls for as long as a
+RetryAfter asks before retrying.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from datetime import timedelta
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Calls per second for the whole bot
+BOT_GLOBAL_RATE = float(os.environ.get("BOT_GLOBAL_RATE", 25))
+# Calls per second for a single chat
+BOT_CHAT_RATE = float(os.environ.get("BOT_CHAT_RATE", 1))
+# Calls running at the same time (uploads can take minutes)
+BOT_CALL_WORKERS = int(os.environ.get("BOT_CALL_WORKERS", 16))
+# Times a call is retried after RetryAfter before giving up
+BOT_MAX_RETRIES = 5
+
+# Call priorities, lower runs first
+PRIORITY_SEND = 0
+PRIORITY_EDIT = 1
+
+
+class _Call:
+    """One queued Bot API call"""
+
+    def __init__(self, method, kwargs, chat_id, priority, seq, key):
+        self.method = method
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.future = Future()
+        self.retries = 0
+
+
+class BotCallScheduler:
+    """Queue of Bot API calls, released within the flood limits"""
+
+    def __init__(self, global_rate=BOT_GLOBAL_RATE, chat_rate=BOT_CHAT_RATE, workers=BOT_CALL_WORKERS):
+        """
+        Initialize the scheduler
+
+        Args:
+            global_rate (float): Calls per second for the whole bot
+            chat_rate (float): Calls per second for a single chat
+            workers (int): Calls running at the same time
+        """
+        self.global_interval = 1 / global_rate if global_rate else 0
+        self.chat_interval = 1 / chat_rate if chat_rate else 0
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._queue = []
+        # Queued edits by the message they change
+        self._edits = {}
+        self._seq = itertools.count()
+        self._next_global = 0
+        self._next_chat = {}
+        self._paused_until = 0
+        self._executor = None
+        self._dispatcher = None
+        self.dropped = 0
+
+    def submit(self, method, priority=PRIORITY_SEND, key=None, **kwargs):
+        """
+        Queue a Bot API call
+
+        Args:
+            method (callable): Blocking bot method, e.g. bot.send_video
+            priority (int): PRIORITY_SEND or PRIORITY_EDIT
+            key: Calls with the same key supersede each other, only the
+                newest one queued is made (e.g. edits of one message)
+            **kwargs: Arguments of the call; chat_id is also used for the
+                per-chat budget
+
+        Returns:
+            concurrent.futures.Future: Result of the call, None if it was
+            superseded
+        """
+        with self._cond:
+            self._start()
+            call = _Call(method, kwargs, kwargs.get('chat_id'), priority, next(self._seq), key)
+            if key is not None:
+                previous = self._edits.pop(key, None)
+                if previous is not None:
+                    self._queue.remove(previous)
+                    self._drop(previous)
+                self._edits[key] = call
+            self._queue.append(call)
+            self._cond.notify()
+        return call.future
+
+    async def call(self, method, priority=PRIORITY_SEND, key=None, **kwargs):
+        """Queue a Bot API call and wait for its result, see submit()"""
+        return await asyncio.wrap_future(self.submit(method, priority, key, **kwargs))
+
+    async def edit(self, bot, **kwargs):
+        """Edit a message's text; a newer edit of the same message replaces it"""
+        key = ('edit', kwargs.get('chat_id'), kwargs.get('message_id'))
+        return await self.call(bot.edit_message_text, PRIORITY_EDIT, key, **kwargs)
+
+    def stats(self):
+        """Return queued calls by priority and the remaining pause"""
+        with self._cond:
+            return {
+                'queued': sum(1 for c in self._queue if c.priority == PRIORITY_SEND),
+                'queued_edits': sum(1 for c in self._queue if c.priority != PRIORITY_SEND),
+                'dropped_edits': self.dropped,
+                'paused_for': max(0, self._paused_until - time.monotonic()),
+            }
+
+    def _start(self):
+        """Start the dispatcher on first use"""
+        if self._dispatcher is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="bot-call")
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name="bot-calls", daemon=True)
+            self._dispatcher.start()
+
+    def _drop(self, call):
+        self.dropped += 1
+        # The caller may have cancelled it already (e.g. a stopped progress task)
+        if not call.future.done():
+            call.future.set_result(None)
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                call, wait = self._next_call()
+                while call is None:
+                    self._cond.wait(wait)
+                    call, wait = self._next_call()
+                self._queue.remove(call)
+                if call.key is not None and self._edits.get(call.key) is call:
+                    del self._edits[call.key]
+            self._executor.submit(self._invoke, call)
+
+    def _next_call(self):
+        """
+        Pick the most urgent call whose budgets allow it to run now
+
+        Returns:
+            tuple: (call, None) or (None, seconds until one may run)
+        """
+        now = time.monotonic()
+        # Calls given up by their caller never use up a budget
+        for call in [c for c in self._queue if c.future.cancelled()]:
+            self._queue.remove(call)
+            if call.key is not None and self._edits.get(call.key) is call:
+                del self._edits[call.key]
+        if not self._queue:
+            return None, None
+        ready_at = max(self._next_global, self._paused_until)
+        if ready_at > now:
+            return None, ready_at - now
+        best = None
+        wait = None
+        for call in self._queue:
+            chat_ready = self._next_chat.get(call.chat_id, 0)
+            if chat_ready > now:
+                wait = chat_ready - now if wait is None else min(wait, chat_ready - now)
+                continue
+            if best is None or (call.priority, call.seq) < (best.priority, best.seq):
+                best = call
+        if best is not None:
+            self._next_global = now + self.global_interval
+            if best.chat_id is not None:
+                self._next_chat[best.chat_id] = now + self.chat_interval
+            # Forget chats that have been idle for a while
+            if len(self._next_chat) > 1000:
+                self._next_chat = {k: v for k, v in self._next_chat.items() if v > now}
+        return best, wait
+
+    def _invoke(self, call):
+        # A retried call is already running from the caller's point of view
+        if not call.retries and not call.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = call.method(**call.kwargs)
+        except RetryAfter as e:
+            self._retry_later(call, e)
+        except BaseException as e:
+            call.future.set_exception(e)
+        else:
+            call.future.set_result(result)
+
+    def _retry_later(self, call, error):
+        """Pause every call for as long as Telegram asked, then retry call"""
+        delay = error.retry_after
+        if isinstance(delay, timedelta):
+            delay = delay.total_seconds()
+        logger.warning(f"Flood limit hit, pausing bot calls for {delay} seconds")
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            call.retries += 1
+            if call.retries > BOT_MAX_RETRIES:
+                call.future.set_exception(error)
+            elif call.key is not None and call.key in self._edits:
+                # A newer edit of the same message is already queued
+                self.dropped += 1
+                call.future.set_result(None)
+            else:
+                if call.key is not None:
+                    self._edits[call.key] = call
+                self._queue.append(call)
+            self._cond.notify()
+
+
+# Shared scheduler for all of the bot's calls
+bot_calls = BotCallScheduler()
@@ -8,6 +8,13 @@ This script uses Flask to create a simple webhook server for the Telegram bot
 
 import os
 import logging
+import threading
+
+# Time the imports below; heavy modules (yt-dlp, requests) are only loaded
+# when first used, which matters as this runs on every cold start
+from startup import ImportProfiler
+_import_profiler = ImportProfiler().start()
+
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
 
@@ -115,6 +122,35 @@ except ImportError:
         update = Update.de_json(update_json, bot)
         dispatcher.process_update(update)
 
+_import_profiler.stop().log_report()
+
+# Processes here are often short-lived, so yt-dlp's extractors are only
+# preloaded when YTDL_PRELOAD is set explicitly
+YTDL_PRELOAD = os.environ.get("YTDL_PRELOAD", "0") != "0"
+
+_started = False
+_start_lock = threading.Lock()
+
+@app.before_request
+def start_background_work():
+    """Start the per-process background work on the first request, not at import"""
+    global _started
+    if _started:
+        return
+    with _start_lock:
+        if _started:
+            return
+        # Pick up downloads interrupted by the last restart (jobs another
+        # worker process already claimed are skipped), then start
+        # reclaiming the directories of abandoned ones
+        from handlers.url_handler import resume_pending_jobs
+        from workspace import workspaces
+        resume_pending_jobs(bot)
+        workspaces.start_janitor()
+        from ydl_pool import start_preload
+        start_preload(YTDL_PRELOAD)
+        _started = True
+
 # Flask route for webhook
 @app.route(f'/{TOKEN}', methods=['POST'])
 def webhook():
@@ -1,25 +1,144 @@
 import os
+import json
+import atexit
+import logging
+import threading
+from array import array
 
-# In-memory key-value store
+from .backends import open_backend
+
+logger = logging.getLogger(__name__)
+
+# Where the data is kept: sqlite:///<path> or a PostgreSQL DSN
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///bot.db")
+# Seconds between batched writes of changed keys
+DB_FLUSH_INTERVAL = float(os.environ.get("DB_FLUSH_INTERVAL", 1))
+
+# In-memory key-value store, loaded from the backend and written back to it
+# in batches, so set_stuff() never waits for the disk or the network
 DB = {
     "ALLCHATS": {"USERS": []},
     "BLACKLIST": {"USERS": []}
 }
 
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_stop = threading.Event()
+_dirty = set()
+_backend = None
+_opened = False
+
 # Initialize database function
 def init_db():
-    """Initialize the in-memory database"""
-    # Nothing to do for in-memory DB, it's already initialized above
-    # This function exists for compatibility with the bot.py initialization
+    """Open the storage backend and load the stored keys into memory"""
+    global _backend, _opened
+    with _lock:
+        if _opened:
+            return _backend is not None
+        _opened = True
+        try:
+            _backend = open_backend(DATABASE_URL)
+            DB.update(_backend.load_all())
+        except Exception as e:
+            # Never log the URL, it may hold a password
+            logger.error(f"Could not open the database, keeping data in memory only: {e}")
+            _backend = None
+            return False
+    logger.info(f"Database: {_backend}, {len(DB)} keys loaded")
+    threading.Thread(target=_flush_loop, name="db-flush", daemon=True).start()
+    atexit.register(close_db)
     return True
 
 def get_stuff(key):
-    """Get value from in-memory database"""
+    """Get value from the database"""
+    if not _opened:
+        init_db()
     if key not in DB:
         DB[key] = {}
     return DB[key]
 
 def set_stuff(key, value):
-    """Set value in in-memory database"""
+    """Set value in the database; it is written to the backend in the next batch"""
+    if not _opened:
+        init_db()
     DB[key] = value
-    return True
\ No newline at end of file
+    with _lock:
+        _dirty.add(key)
+    return True
+
+def del_stuff(key):
+    """Remove a key from the database; it is deleted from the backend in the next batch"""
+    if not _opened:
+        init_db()
+    DB.pop(key, None)
+    with _lock:
+        _dirty.add(key)
+    return True
+
+def get_keys(prefix=""):
+    """List the stored keys starting with prefix"""
+    if not _opened:
+        init_db()
+    return [key for key in list(DB) if key.startswith(prefix)]
+
+def flush():
+    """
+    Write every key changed or removed since the last flush in one transaction
+
+    Returns:
+        int: Number of keys written or deleted
+    """
+    if _backend is None:
+        return 0
+    with _flush_lock:
+        with _lock:
+            keys = list(_dirty)
+            _dirty.clear()
+        if not keys:
+            return 0
+        items = {}
+        deleted = []
+        retry = set()
+        for key in keys:
+            if key not in DB:
+                deleted.append(key)
+                continue
+            try:
+                items[key] = json.dumps(DB[key], default=_to_json)
+            except RuntimeError:
+                # Changed by another thread while being serialized
+                retry.add(key)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Cannot store database key {key}: {e}")
+        try:
+            if items or deleted:
+                _backend.write_many(items, deleted)
+        except Exception as e:
+            logger.error(f"Database write failed, retrying: {e}")
+            retry.update(items)
+            retry.update(deleted)
+            items = {}
+            deleted = []
+        if retry:
+            with _lock:
+                _dirty.update(retry)
+        return len(items) + len(deleted)
+
+def _to_json(value):
+    # User indexes keep their ids in an array('q')
+    if isinstance(value, array):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _flush_loop():
+    while not _stop.wait(DB_FLUSH_INTERVAL):
+        flush()
+
+def close_db():
+    """Write the outstanding changes and close the backend"""
+    global _backend
+    _stop.set()
+    flush()
+    if _backend is not None:
+        _backend.close()
+        _backend = None
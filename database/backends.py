@@ -0,0 +1,125 @@
+"""
+Storage backends for the key-value store in database/__init__.py.
+
+A backend stores JSON documents by key and only has to load all of them
+and write or delete a batch of them; reads are served from memory.
+open_backend() picks one from a DATABASE_URL:
+
+    sqlite:///relative/file.db    SQLite in WAL mode (the default),
+    sqlite:////absolute/file.db   with four slashes for an absolute path
+    postgresql://user:pw@host/db  PostgreSQL over pooled connections
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Connections kept open to PostgreSQL
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 4))
+
+
+class SQLiteBackend:
+    """Key-value table in an SQLite file"""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets reads run next to the writer, and with synchronous=NORMAL
+        # a commit only waits for fsync at checkpoints
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    def load_all(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM kv").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def write_many(self, items, deleted=()):
+        """Write {key: json text} and delete the deleted keys in one transaction"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO kv (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                items.items()
+            )
+            self._conn.executemany("DELETE FROM kv WHERE key = ?", [(key,) for key in deleted])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __str__(self):
+        return f"SQLite ({self.path})"
+
+
+class PostgresBackend:
+    """Key-value table in PostgreSQL, over a thread-safe connection pool"""
+
+    def __init__(self, dsn, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+        # Optional dependency, only needed when DATABASE_URL points at PostgreSQL
+        import psycopg2.pool
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        self._run("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _run(self, query, params=None, many=False, fetch=False):
+        return self._run_all([(query, params, many)], fetch)
+
+    def _run_all(self, statements, fetch=False):
+        """Run (query, params, many) statements in one transaction"""
+        conn = self._pool.getconn()
+        try:
+            with conn, conn.cursor() as cursor:
+                for query, params, many in statements:
+                    if many:
+                        cursor.executemany(query, params)
+                    else:
+                        cursor.execute(query, params)
+                return cursor.fetchall() if fetch else None
+        finally:
+            self._pool.putconn(conn)
+
+    def load_all(self):
+        rows = self._run("SELECT key, value FROM kv", fetch=True)
+        return {key: json.loads(value) for key, value in rows}
+
+    def write_many(self, items, deleted=()):
+        """Write {key: json text} and delete the deleted keys in one transaction"""
+        self._run_all([
+            ("INSERT INTO kv (key, value) VALUES (%s, %s) "
+             "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value", list(items.items()), True),
+            ("DELETE FROM kv WHERE key = %s", [(key,) for key in deleted], True),
+        ])
+
+    def close(self):
+        self._pool.closeall()
+
+    def __str__(self):
+        return "PostgreSQL"
+
+
+def open_backend(url):
+    """
+    Open the backend a DATABASE_URL names
+
+    Args:
+        url (str): sqlite:///<path>, or a postgres:// or postgresql:// DSN
+
+    Returns:
+        SQLiteBackend or PostgresBackend
+    """
+    if url.startswith(("postgres://", "postgresql://")):
+        return PostgresBackend(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported DATABASE_URL: {url}")
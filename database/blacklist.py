@@ -1,48 +1,17 @@
-from . import get_stuff, set_stuff
-
-AL = get_stuff("BLACKLIST")
-if not AL:
-    set_stuff("BLACKLIST", {"USERS":[]})
+from .user_index import blacklist_index
 
 def add_blacklist(id):
-    mn = get_stuff("BLACKLIST")
-    try:
-      lt = mn["USERS"]
-    except:
-      mn.update({"USERS":[id]})
-      set_stuff("BLACKLIST", mn)
-      return True
-    if not lt:
-      lt = []
-    if id not in lt:
-      lt.append(id)
-    mn.update({"USERS":lt})
-    set_stuff("BLACKLIST", mn)
+    blacklist_index.add(int(id))
 
 def remove_blacklist(id):
-    Bl = get_stuff("BLACKLIST")
-    if not (Bl and Bl["USERS"]):
+    if not len(blacklist_index):
         return "Blacklisted User List is Empty !"
-    if id not in Bl["USERS"]:
+    if not blacklist_index.remove(int(id)):
         return "User Was Not Blacklisted !"
-    mn = Bl["USERS"]
-    mn.remove(id)
-    Bl.update({"USERS":mn})
-    set_stuff("BLACKLIST", Bl)
     return "Removed User from BLACKLIST"
 
 def get_blacklisted():
-    Bl = get_stuff("BLACKLIST")
-    if not Bl:
-        return []
-    return Bl["USERS"]
+    return blacklist_index.to_list()
 
 def check_blacklist(id):
-    std = get_stuff("BLACKLIST")
-    try:
-        MNT = std["USERS"]
-    except:
-        return False
-    if MNT and id in MNT:
-      return True
-    return False
+    return int(id) in blacklist_index
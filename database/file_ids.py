@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from . import get_stuff, set_stuff, del_stuff, get_keys
+from utils import canonicalize_url
+
+# Index of files already uploaded to Telegram, so repeated requests can be
+# re-sent by file_id instead of being downloaded and uploaded again.
+#
+# Every upload is stored under its own key, named after its first file_id,
+# so caching one upload writes one small record:
+#
+# "FILE_ID:<file_id>" = {"parts": [{"file_id": ..., "kind": "video" | "document"}],
+#                        "hash": ..., "stored": <unix time>,
+#                        "keys": ["URL|<canonical url>|<format_id>|<file_type>",
+#                                 "HASH|<content hash>|<file_type>"]}
+#
+# In memory the URL and hash keys map to the file_id, and the entries are
+# kept in least recently used order, at most FILE_IDS_MAX of them.
+
+# Most uploads remembered
+FILE_IDS_MAX = int(os.environ.get("FILE_IDS_MAX", 5000))
+
+ENTRY_PREFIX = "FILE_ID:"
+
+_lock = threading.Lock()
+# "URL|..." / "HASH|..." -> file_id of the entry
+_lookup = None
+# file_id -> entry, least recently used first
+_entries = OrderedDict()
+
+def _url_key(url, format_id, file_type):
+    return f"URL|{canonicalize_url(url)}|{format_id}|{file_type}"
+
+def _hash_key(content_hash, file_type):
+    return f"HASH|{content_hash}|{file_type}"
+
+def _load():
+    """Build the in-memory index on first use"""
+    global _lookup
+    if _lookup is not None:
+        return
+    _lookup = {}
+    stored = [(key[len(ENTRY_PREFIX):], get_stuff(key)) for key in get_keys(ENTRY_PREFIX)]
+    for file_id, entry in sorted(stored, key=lambda item: item[1].get("stored", 0)):
+        _entries[file_id] = entry
+        for key in entry.get("keys", []):
+            _lookup[key] = file_id
+
+def _get(key):
+    _load()
+    file_id = _lookup.get(key)
+    if file_id is None:
+        return None
+    _entries.move_to_end(file_id)
+    return _entries[file_id]
+
+def _add(keys, parts, content_hash):
+    if not parts or not parts[0].get("file_id"):
+        return
+    file_id = parts[0]["file_id"]
+    entry = _entries.pop(file_id, None) or {"parts": parts, "hash": content_hash, "keys": []}
+    entry["stored"] = time.time()
+    for key in keys:
+        previous = _lookup.get(key)
+        if previous is not None and previous != file_id:
+            _unlink(previous, key)
+        if key not in entry["keys"]:
+            entry["keys"].append(key)
+        _lookup[key] = file_id
+    _entries[file_id] = entry
+    set_stuff(ENTRY_PREFIX + file_id, entry)
+    while len(_entries) > FILE_IDS_MAX:
+        _remove(next(iter(_entries)))
+
+def _unlink(file_id, key):
+    """Point key away from an entry, dropping the entry once nothing points at it"""
+    entry = _entries.get(file_id)
+    if entry is None:
+        return
+    if key in entry["keys"]:
+        entry["keys"].remove(key)
+    if entry["keys"]:
+        set_stuff(ENTRY_PREFIX + file_id, entry)
+    else:
+        _remove(file_id)
+
+def _remove(file_id):
+    entry = _entries.pop(file_id, None)
+    if entry is None:
+        return
+    for key in entry["keys"]:
+        if _lookup.get(key) == file_id:
+            del _lookup[key]
+    del_stuff(ENTRY_PREFIX + file_id)
+
+def get_cached_upload(url, format_id, file_type):
+    """Return the cached upload entry for a URL and format, or None"""
+    with _lock:
+        return _get(_url_key(url, format_id, file_type))
+
+def get_cached_by_hash(content_hash, file_type):
+    """Return the cached upload entry for a file content hash, or None"""
+    if not content_hash:
+        return None
+    with _lock:
+        return _get(_hash_key(content_hash, file_type))
+
+def cache_upload(parts, file_type, url=None, format_id=None, content_hash=None):
+    """
+    Remember the Telegram file_ids of an upload
+
+    Args:
+        parts (list): [{"file_id": ..., "kind": "video" | "document"}, ...]
+        file_type (str): 'video' or 'audio' as selected by the user
+        url (str, optional): Source URL, indexed together with format_id
+        format_id (str, optional): Downloaded yt-dlp format
+        content_hash (str, optional): Hash of the uploaded file content
+    """
+    keys = []
+    if url:
+        keys.append(_url_key(url, format_id, file_type))
+    if content_hash:
+        keys.append(_hash_key(content_hash, file_type))
+    if not keys:
+        return
+    with _lock:
+        _load()
+        _add(keys, parts, content_hash)
+
+def invalidate_upload(entry):
+    """Drop a cache entry and every index key that points at it (e.g. after a failed send)"""
+    parts = entry.get("parts") or [{}]
+    with _lock:
+        _load()
+        _remove(parts[0].get("file_id"))
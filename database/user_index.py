@@ -0,0 +1,75 @@
+from array import array
+from bisect import bisect_left
+import threading
+
+from . import get_stuff, set_stuff
+
+# Membership indexes over the user lists stored as {"USERS": [...]} under
+# ALLCHATS and BLACKLIST. The list is kept in place as a sorted array of
+# 64-bit ids (8 bytes per user), so a lookup is a binary search, and the
+# key is only marked for writing when a user is actually added or removed.
+
+
+class UserIndex:
+    """Sorted set of user ids stored under one database key"""
+
+    def __init__(self, key):
+        self.key = key
+        self._lock = threading.Lock()
+        self._value = None
+        self._ids = array('q')
+
+    def _load(self):
+        # Rebuilt whenever the stored value was replaced behind our back
+        value = get_stuff(self.key)
+        if value is not self._value or value.get("USERS") is not self._ids:
+            ids = set()
+            for user_id in value.get("USERS") or []:
+                try:
+                    ids.add(int(user_id))
+                except (TypeError, ValueError):
+                    pass
+            value["USERS"] = array('q', sorted(ids))
+            self._value, self._ids = value, value["USERS"]
+        return self._ids
+
+    def __contains__(self, user_id):
+        with self._lock:
+            ids = self._load()
+            i = bisect_left(ids, user_id)
+            return i < len(ids) and ids[i] == user_id
+
+    def add(self, user_id):
+        """Add a user; returns False if it was already there"""
+        with self._lock:
+            ids = self._load()
+            i = bisect_left(ids, user_id)
+            if i < len(ids) and ids[i] == user_id:
+                return False
+            ids.insert(i, user_id)
+        set_stuff(self.key, self._value)
+        return True
+
+    def remove(self, user_id):
+        """Remove a user; returns False if it was not there"""
+        with self._lock:
+            ids = self._load()
+            i = bisect_left(ids, user_id)
+            if i == len(ids) or ids[i] != user_id:
+                return False
+            ids.pop(i)
+        set_stuff(self.key, self._value)
+        return True
+
+    def __len__(self):
+        with self._lock:
+            return len(self._load())
+
+    def to_list(self):
+        """Copy of the ids, safe to iterate while users are being added"""
+        with self._lock:
+            return self._load().tolist()
+
+
+chat_index = UserIndex("ALLCHATS")
+blacklist_index = UserIndex("BLACKLIST")
@@ -1,41 +1,14 @@
-from . import DB, get_stuff
+from .user_index import chat_index
 
-AL = DB.get("ALLCHATS")
-if not AL:
-    DB.set("ALLCHATS", "{'USERS':[]}")
-
-def add_chat(id: str):
-    CCH = get_stuff("ALLCHATS")
-    if not CCH:
-        CCH.update({"USERS":[id]})
-        DB.set("ALLCHATS", str(CCH))
-        return
-    if CCH["USERS"] and id in CCH["USERS"]:
-      return
-    Ul = CCH["USERS"]
-    if not Ul:
-      Ul = []
-    Ul.append(id)
-    CCH.update({"USERS":Ul})
-    DB.set("ALLCHATS", str(CCH))
+def add_chat(id):
+    chat_index.add(int(id))
 
 
 def get_all_chats():
-    CCH = get_stuff("ALLCHATS")
-    if not (CCH and CCH["USERS"]):
-        return []
-    return CCH["USERS"]
+    return chat_index.to_list()
 
 
 def remove_chat(id):
-    CCH = get_stuff("ALLCHATS")
-    if not CCH:
+    if not chat_index.remove(int(id)):
         return
-    if CCH["USERS"] and id not in CCH["USERS"]:
-      return
-    li = CCH["USERS"]
-    if id in li:
-      li.remove(id)
-    CCH.update({"USERS":li})
-    DB.set("ALLCHATS", str(CCH))
     return True
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Disk space admission control for download jobs.
+
+Every job reserves its estimated size before it starts. A job only starts
+if the free space, minus what the running jobs are still going to write,
+can hold its reservation; otherwise it waits in the queue until a running
+job finishes and releases its share.
+"""
+
+import os
+import time
+import shutil
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Free space that is never handed out to jobs
+DISK_RESERVE_MARGIN = int(os.environ.get("DISK_RESERVE_MARGIN", 256 * 1024 * 1024))
+# Reservation for jobs whose size cannot be estimated
+DEFAULT_JOB_SIZE = int(os.environ.get("DEFAULT_JOB_SIZE", 512 * 1024 * 1024))
+# Seconds the measured disk usage of the job directories is reused
+DISK_USAGE_INTERVAL = float(os.environ.get("DISK_USAGE_INTERVAL", 5))
+
+
+class DiskLedger:
+    """
+    Reservations of disk space under one download location.
+
+    A reservation shrinks as its job writes to its directory, so space that
+    is already used on disk is not counted twice. The directories are
+    measured in a background thread every usage_interval seconds at most,
+    so an admission check never walks the disk itself.
+    """
+
+    def __init__(self, path, margin=DISK_RESERVE_MARGIN, default_size=DEFAULT_JOB_SIZE,
+                 usage_interval=DISK_USAGE_INTERVAL):
+        """
+        Initialize the ledger
+
+        Args:
+            path (str): Download location the jobs write to
+            margin (int): Bytes of free space that are never reserved
+            default_size (int): Reservation for jobs without an estimate
+            usage_interval (float): Seconds a measured disk usage is reused
+        """
+        self.path = path
+        self.margin = margin
+        self.default_size = default_size
+        self.usage_interval = usage_interval
+        self._lock = threading.Lock()
+        # job_id -> [reserved bytes, job directory or None]
+        self._reservations = {}
+        # job_id -> bytes its directory held when last measured
+        self._usage = {}
+        self._measured_at = 0.0
+        self._measuring = False
+
+    def free_bytes(self):
+        """Free space on the file system holding the download location"""
+        path = os.path.abspath(self.path)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return shutil.disk_usage(path).free
+
+    def try_reserve(self, job):
+        """
+        Reserve space for a job if it fits
+
+        The size is read from job.data['disk_reservation']. A job is always
+        admitted when nothing else holds a reservation, so an oversized job
+        fails on its own instead of waiting forever.
+
+        Returns:
+            bool: True if the job may start
+        """
+        size = job.data.get('disk_reservation') or self.default_size
+        self._refresh_usage()
+        with self._lock:
+            available = self.free_bytes() - self._outstanding() - self.margin
+            if size > available and self._reservations:
+                return False
+            if size > available:
+                logger.warning(f"Job {job.job_id} needs {size} bytes, only {available} available")
+            self._reservations[job.job_id] = [size, job.data.get('download_dir')]
+        logger.info(f"Reserved {size} bytes for job {job.job_id}")
+        return True
+
+    def attach(self, job_id, download_dir):
+        """Tell the ledger where a job writes, so its usage is accounted for"""
+        with self._lock:
+            if job_id in self._reservations:
+                self._reservations[job_id][1] = download_dir
+
+    def release(self, job):
+        """Drop the reservation of a finished or cancelled job"""
+        with self._lock:
+            self._reservations.pop(job.job_id, None)
+            self._usage.pop(job.job_id, None)
+
+    def stats(self):
+        """Return free, reserved and still-to-be-written byte counts"""
+        self._refresh_usage()
+        with self._lock:
+            free = self.free_bytes()
+            outstanding = self._outstanding()
+            return {
+                'free': free,
+                'reserved': sum(size for size, _ in self._reservations.values()),
+                'outstanding': outstanding,
+                'available': max(0, free - outstanding - self.margin),
+                'jobs': len(self._reservations),
+            }
+
+    def _outstanding(self):
+        """Bytes the running jobs are still expected to write, as last measured"""
+        return sum(
+            max(0, size - self._usage.get(job_id, 0))
+            for job_id, (size, _) in self._reservations.items()
+        )
+
+    def _refresh_usage(self):
+        """Measure the job directories in the background if the last measure is stale"""
+        with self._lock:
+            if self._measuring or time.monotonic() - self._measured_at < self.usage_interval:
+                return
+            self._measuring = True
+            directories = {job_id: download_dir for job_id, (_, download_dir) in self._reservations.items()}
+        threading.Thread(target=self._measure, args=(directories,), name="disk-usage", daemon=True).start()
+
+    def _measure(self, directories):
+        usage = {}
+        try:
+            usage = {job_id: _disk_usage(download_dir) for job_id, download_dir in directories.items()}
+        finally:
+            with self._lock:
+                # Skip jobs released meanwhile
+                self._usage.update((job_id, used) for job_id, used in usage.items() if job_id in self._reservations)
+                self._measured_at = time.monotonic()
+                self._measuring = False
+
+
+def _disk_usage(path):
+    """Allocated size of all files under path"""
+    if not path or not os.path.isdir(path):
+        return 0
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            total += getattr(st, 'st_blocks', 0) * 512 or st.st_size
+    return total
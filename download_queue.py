@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Download job queue backed by a bounded pool of asyncio workers.
+
+Update handlers only enqueue jobs here and return immediately; the actual
+download/split/upload work runs on a dedicated event loop thread, so a
+format click no longer ties up a dispatcher worker for minutes.
+"""
+
+import os
+import time
+import uuid
+import logging
+import asyncio
+import threading
+from collections import Counter
+
+from disk_ledger import DiskLedger
+
+logger = logging.getLogger(__name__)
+
+# Number of jobs that may run at the same time (global concurrency limit)
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 2))
+# Number of jobs a single user may have running at the same time
+PER_USER_JOBS = int(os.environ.get("PER_USER_JOBS", 1))
+# Maximum number of jobs waiting in the queue
+MAX_QUEUED_JOBS = int(os.environ.get("MAX_QUEUED_JOBS", 100))
+# Seconds between admission checks while jobs wait for disk space
+ADMISSION_RECHECK = 10
+
+# Job states
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+def new_job_id():
+    """Return a fresh, short job id"""
+    return uuid.uuid4().hex[:12]
+
+
+class DownloadJob:
+    """A single queued unit of work owned by a user"""
+
+    def __init__(self, job_id, user_id, runner, data=None):
+        self.job_id = job_id
+        self.user_id = user_id
+        # Coroutine function called as runner(job) by a worker
+        self.runner = runner
+        # Free-form payload for the runner (chat id, format id, ...)
+        self.data = data or {}
+        self.state = PENDING
+        self.task = None
+        self.cancel_requested = False
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Queue position last announced to on_position
+        self.position = None
+
+
+class DownloadQueue:
+    """
+    FIFO job queue with a fixed worker pool and per-user concurrency limits.
+
+    Workers run on a private event loop in a daemon thread. All public
+    methods are thread-safe and may be called from handler threads.
+    """
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, per_user_limit=PER_USER_JOBS,
+                 max_pending=MAX_QUEUED_JOBS, admission=None, on_position=None, on_discard=None):
+        """
+        Initialize the queue
+
+        Args:
+            workers (int): Number of jobs allowed to run concurrently
+            per_user_limit (int): Number of running jobs allowed per user
+            max_pending (int): Maximum number of jobs waiting to run
+            admission (optional): Resource gate with try_reserve(job) and
+                release(job), e.g. a DiskLedger; jobs it refuses keep waiting
+            on_position (callable, optional): Called as on_position(job,
+                position) on the queue loop when a job starts waiting and
+                whenever it moves up; must not block
+            on_discard (callable, optional): Called as on_discard(job) for a
+                job dropped without ever running: cancelled while waiting,
+                or refused by submit because the queue is full
+        """
+        self.workers = max(1, workers)
+        self.per_user_limit = max(1, per_user_limit)
+        self.max_pending = max_pending
+        self.admission = admission
+        self.on_position = on_position
+        self.on_discard = on_discard
+        self.loop = None
+        self._thread = None
+        self._wakeup = None
+        self._lock = threading.Lock()
+        self._pending = []
+        self._running = {}
+        self._user_running = Counter()
+
+    def start(self):
+        """Start the event loop thread and the worker pool (idempotent)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            started = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run_loop, args=(started,),
+                name="download-queue", daemon=True
+            )
+            self._thread.start()
+        started.wait()
+        logger.info(f"Download queue started with {self.workers} workers")
+
+    def _run_loop(self, started):
+        asyncio.set_event_loop(self.loop)
+        self._wakeup = asyncio.Event()
+        for i in range(self.workers):
+            self.loop.create_task(self._worker(i))
+        self.loop.call_soon(started.set)
+        self.loop.run_forever()
+
+    def submit(self, user_id, runner, data=None, job_id=None):
+        """
+        Add a job to the queue
+
+        Args:
+            user_id (int): Owner of the job
+            runner (callable): Coroutine function called with the job
+            data (dict, optional): Payload made available as job.data
+            job_id (str, optional): Explicit job id, generated if omitted
+
+        Returns:
+            DownloadJob: The queued job
+
+        Raises:
+            QueueFullError: If max_pending jobs are already waiting
+        """
+        self.start()
+        job = DownloadJob(job_id or new_job_id(), user_id, runner, data)
+        with self._lock:
+            full = len(self._pending) >= self.max_pending
+            if not full:
+                self._pending.append(job)
+        if full:
+            self._discard(job)
+            raise QueueFullError(f"Queue is full ({self.max_pending} jobs waiting)")
+        # The first position is announced from the loop too, so it is never
+        # reported after the job has already started
+        self.loop.call_soon_threadsafe(self._announce_positions)
+        self._notify()
+        return job
+
+    def position(self, job_id):
+        """
+        Get the position of a job in the queue
+
+        Returns:
+            int: 1-based position among waiting jobs, 0 if the job is
+            running, or None if the job is unknown/finished
+        """
+        with self._lock:
+            if job_id in self._running:
+                return 0
+            for i, job in enumerate(self._pending):
+                if job.job_id == job_id:
+                    return i + 1
+        return None
+
+    def get(self, job_id):
+        """Return a pending or running job by id, or None"""
+        with self._lock:
+            if job_id in self._running:
+                return self._running[job_id]
+            for job in self._pending:
+                if job.job_id == job_id:
+                    return job
+        return None
+
+    def cancel(self, job_id):
+        """
+        Cancel a pending or running job
+
+        Returns:
+            bool: True if the job was found and cancelled
+        """
+        waiting = False
+        with self._lock:
+            for job in self._pending:
+                if job.job_id == job_id:
+                    self._pending.remove(job)
+                    job.state = CANCELLED
+                    job.finished_at = time.time()
+                    waiting = True
+                    break
+            else:
+                job = self._running.get(job_id)
+                if job is None:
+                    return False
+                job.cancel_requested = True
+        if waiting:
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self._announce_positions)
+            self._discard(job)
+            return True
+        if job.task is not None:
+            self.loop.call_soon_threadsafe(job.task.cancel)
+        return True
+
+    def run_coroutine(self, coro):
+        """Schedule a coroutine on the queue loop from any thread"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stats(self):
+        """Return a snapshot of queue occupancy"""
+        with self._lock:
+            stats = {
+                'workers': self.workers,
+                'running': len(self._running),
+                'pending': len(self._pending),
+                'per_user_running': dict(self._user_running),
+            }
+        if self.admission is not None:
+            stats['disk'] = self.admission.stats()
+        return stats
+
+    def _notify(self):
+        """Wake idle workers (safe to call from any thread)"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _next_runnable(self):
+        """
+        Pop the oldest pending job whose owner is under the per-user limit
+        and that the admission gate lets through
+
+        A job refused for lack of disk space does not hold up smaller jobs
+        queued behind it.
+        """
+        with self._lock:
+            for job in self._pending:
+                if self._user_running[job.user_id] < self.per_user_limit:
+                    if self.admission is not None and not self.admission.try_reserve(job):
+                        continue
+                    self._pending.remove(job)
+                    job.state = RUNNING
+                    self._running[job.job_id] = job
+                    self._user_running[job.user_id] += 1
+                    break
+            else:
+                return None
+        self._announce_positions()
+        return job
+
+    def _discard(self, job):
+        """Let on_discard clean up after a job that never ran"""
+        if self.on_discard is None:
+            return
+        try:
+            self.on_discard(job)
+        except Exception as e:
+            logger.warning(f"Could not clean up after job {job.job_id}: {e}")
+
+    def _announce_positions(self):
+        """Report the position of every new waiting job and of those that moved up"""
+        if self.on_position is None:
+            return
+        with self._lock:
+            moved = [(job, i + 1) for i, job in enumerate(self._pending) if job.position != i + 1]
+            for job, position in moved:
+                job.position = position
+        for job, position in moved:
+            try:
+                self.on_position(job, position)
+            except Exception as e:
+                logger.warning(f"Could not report the queue position of job {job.job_id}: {e}")
+
+    async def _worker(self, index):
+        while True:
+            job = self._next_runnable()
+            if job is None:
+                # No awaits between the check above and clear(), so a
+                # concurrent submit cannot be lost
+                self._wakeup.clear()
+                if self._pending and self.admission is not None:
+                    # Space may be freed outside the queue, check again later
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), ADMISSION_RECHECK)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._wakeup.wait()
+                continue
+            await self._run(job)
+
+    async def _run(self, job):
+        job.started_at = time.time()
+        job.task = self.loop.create_task(job.runner(job))
+        if job.cancel_requested:
+            job.task.cancel()
+        try:
+            await job.task
+            job.state = DONE
+        except asyncio.CancelledError:
+            job.state = CANCELLED
+            logger.info(f"Job {job.job_id} cancelled")
+        except Exception as e:
+            job.state = FAILED
+            job.error = e
+            logger.error(f"Job {job.job_id} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+            if self.admission is not None:
+                self.admission.release(job)
+            with self._lock:
+                self._running.pop(job.job_id, None)
+                self._user_running[job.user_id] -= 1
+                if self._user_running[job.user_id] <= 0:
+                    del self._user_running[job.user_id]
+            # A per-user slot was freed, so a waiting job may now be runnable
+            self._wakeup.set()
+
+
+# Shared queue used by the handlers, admitting jobs by free disk space
+disk_ledger = DiskLedger("./DOWNLOADS")
+download_queue = DownloadQueue(admission=disk_ledger)
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pool of egress routes (proxies and local source addresses) with per-domain
+health tracking.
+
+Every extraction and download picks the healthiest route for the site it
+talks to, weighted by how many jobs already use that route, so jobs spread
+across routes. Failures and throttling (HTTP 403/429 and the like) lower a
+route's score for that site and take it out of rotation for a cool-down
+that doubles with every further failure, so jobs route around a throttled
+or blocked path, and a throttled job is retried once on another route.
+"""
+
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from urllib.parse import urlsplit
+
+from startup import lazy_import
+
+# Loaded on first use
+requests = lazy_import("requests")
+
+logger = logging.getLogger(__name__)
+
+# Proxy URLs to spread jobs across, separated by spaces or commas
+EGRESS_PROXIES = os.environ.get("EGRESS_PROXIES", "")
+# Local addresses to connect from, separated by spaces or commas
+EGRESS_SOURCE_ADDRESSES = os.environ.get("EGRESS_SOURCE_ADDRESSES", "")
+# Seconds a route is avoided for a site after its first failure
+EGRESS_COOLDOWN = int(os.environ.get("EGRESS_COOLDOWN", 60))
+# Longest cool-down after repeated failures
+EGRESS_MAX_COOLDOWN = int(os.environ.get("EGRESS_MAX_COOLDOWN", 30 * 60))
+# Weight of the latest outcome in a route's success score
+SCORE_SMOOTHING = 0.3
+
+# Second-level labels sites register under in country domains (co.uk,
+# com.au, ne.jp, ...)
+_COUNTRY_SECOND_LEVEL = {
+    'ac', 'co', 'com', 'edu', 'go', 'gob', 'gov', 'gv', 'ltd', 'me', 'mil', 'ne', 'net', 'nic',
+    'or', 'org', 'plc', 'sch',
+}
+
+# Errors that mean the site is throttling or blocking the route
+_THROTTLE_PATTERN = re.compile(
+    r"HTTP Error (403|429|503)|Too Many Requests|rate.?limit|Sign in to confirm|confirm you.re not a bot",
+    re.IGNORECASE
+)
+
+
+class Route:
+    """One way out: through a proxy, or directly from a local address"""
+
+    def __init__(self, proxy=None, source_address=None):
+        self.proxy = proxy or None
+        self.source_address = source_address or None
+
+    @property
+    def name(self):
+        return self.proxy or f"direct from {self.source_address or 'default address'}"
+
+    def ytdl_options(self):
+        """yt-dlp options sending its requests over this route"""
+        options = {}
+        if self.proxy:
+            options['proxy'] = self.proxy
+        if self.source_address:
+            options['source_address'] = self.source_address
+        return options
+
+    def session(self):
+        """A requests session sending its requests over this route"""
+        session = requests.Session()
+        # The route alone decides the way out, not HTTP(S)_PROXY
+        session.trust_env = False
+        if self.proxy:
+            session.proxies = {'http': self.proxy, 'https': self.proxy}
+        if self.source_address:
+            adapter = _source_address_adapter(self.source_address)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        return session
+
+    def __repr__(self):
+        return f"Route({self.name})"
+
+
+_adapter_class = None
+
+
+def _source_address_adapter(source_address):
+    """
+    Transport adapter binding outgoing connections to a local address
+
+    The class is defined on first use, so requests is not loaded before a
+    session is needed.
+    """
+    global _adapter_class
+    if _adapter_class is None:
+        class SourceAddressAdapter(requests.adapters.HTTPAdapter):
+            def __init__(self, source_address, **kwargs):
+                self._source_address = (source_address, 0)
+                super().__init__(**kwargs)
+
+            def init_poolmanager(self, *args, **kwargs):
+                kwargs['source_address'] = self._source_address
+                super().init_poolmanager(*args, **kwargs)
+
+            def proxy_manager_for(self, proxy, **proxy_kwargs):
+                proxy_kwargs['source_address'] = self._source_address
+                return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+        _adapter_class = SourceAddressAdapter
+    return _adapter_class(source_address)
+
+
+class _Health:
+    """Track record of one route with one site"""
+
+    def __init__(self):
+        self.score = 1.0
+        self.throughput = None
+        self.failures = 0
+        self.cooldown_until = 0
+
+
+class Lease:
+    """A route in use by one job; report the outcome with succeed() or fail()"""
+
+    def __init__(self, pool, route, domain):
+        self.pool = pool
+        self.route = route
+        self.domain = domain
+        self.started = time.monotonic()
+        self._done = False
+
+    def succeed(self, nbytes=0):
+        self._finish(True, nbytes=nbytes)
+
+    def fail(self, throttled=False):
+        self._finish(False, throttled=throttled)
+
+    def close(self):
+        """Give the route back without judging it, e.g. on cancellation"""
+        self._finish(None)
+
+    def _finish(self, ok, nbytes=0, throttled=False):
+        if self._done:
+            return
+        self._done = True
+        self.pool._release(self, ok, nbytes, time.monotonic() - self.started, throttled)
+
+
+class EgressPool:
+    """Routes with per-site health scores"""
+
+    def __init__(self, routes, cooldown=EGRESS_COOLDOWN, max_cooldown=EGRESS_MAX_COOLDOWN):
+        """
+        Initialize the pool
+
+        Args:
+            routes (list): Route objects to spread jobs across
+            cooldown (int): Seconds a route is avoided after a failure
+            max_cooldown (int): Upper bound of the doubling cool-down
+        """
+        self.routes = list(routes)
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        # (route, domain) -> _Health
+        self._health = {}
+        self._in_use = {route: 0 for route in self.routes}
+
+    def acquire(self, url, exclude=(), prefer=None):
+        """
+        Lease the best route for a URL
+
+        Routes cooling down for the URL's site are skipped unless all of
+        them are, and then the one that recovers first is used.
+
+        Args:
+            url (str): URL about to be fetched
+            exclude (iterable): Routes not to use, e.g. ones already tried
+            prefer (str, optional): Name of the route to use if it is ready
+
+        Returns:
+            Lease: The chosen route; report the outcome on it
+        """
+        domain = _domain(url)
+        now = time.monotonic()
+        with self._lock:
+            candidates = [r for r in self.routes if r not in exclude] or self.routes
+            ready = [r for r in candidates if self._health_of(r, domain).cooldown_until <= now]
+            preferred = [r for r in ready if r.name == prefer]
+            if preferred:
+                route = preferred[0]
+            elif ready:
+                best_throughput = max((self._health_of(r, domain).throughput or 0) for r in ready)
+                weights = {r: self._weight(r, domain, best_throughput) for r in ready}
+                top = max(weights.values())
+                route = random.choice([r for r in ready if weights[r] == top])
+            else:
+                route = min(candidates, key=lambda r: self._health_of(r, domain).cooldown_until)
+            self._in_use[route] += 1
+        return Lease(self, route, domain)
+
+    async def run(self, url, func, measure=None, prefer=None):
+        """
+        Run a coroutine over the best route, on another route if throttled
+
+        Args:
+            url (str): URL the coroutine fetches
+            func (callable): Called with the Route, returns an awaitable
+            measure (callable, optional): Returns the bytes transferred
+                from func's result, for the throughput score
+            prefer (str, optional): Name of the route to try first
+
+        Returns:
+            The result of func
+        """
+        tried = set()
+        while True:
+            lease = self.acquire(url, exclude=tried, prefer=prefer)
+            try:
+                result = await func(lease.route)
+            except asyncio.CancelledError:
+                lease.close()
+                raise
+            except Exception as e:
+                throttled = is_throttled(e)
+                lease.fail(throttled)
+                tried.add(lease.route)
+                if throttled and len(tried) < len(self.routes):
+                    logger.warning(f"{lease.route.name} is throttled by {lease.domain}, switching route")
+                    continue
+                raise
+            lease.succeed(measure(result) if measure else 0)
+            return result
+
+    def stats(self):
+        """Return the state of every route, by site"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                route.name: {
+                    'in_use': self._in_use[route],
+                    'sites': {
+                        domain: {
+                            'score': round(health.score, 2),
+                            'throughput': health.throughput,
+                            'cooling_for': max(0, health.cooldown_until - now),
+                        }
+                        for (r, domain), health in self._health.items() if r is route
+                    },
+                }
+                for route in self.routes
+            }
+
+    def _health_of(self, route, domain):
+        health = self._health.get((route, domain))
+        if health is None:
+            health = self._health[(route, domain)] = _Health()
+        return health
+
+    def _weight(self, route, domain, best_throughput):
+        """Success score, scaled down for slow routes and shared with the jobs using it"""
+        health = self._health_of(route, domain)
+        weight = health.score
+        if best_throughput and health.throughput is not None:
+            weight *= max(0.1, health.throughput / best_throughput)
+        return weight / (1 + self._in_use[route])
+
+    def _release(self, lease, ok, nbytes, elapsed, throttled):
+        with self._lock:
+            self._in_use[lease.route] -= 1
+            if ok is None:
+                return
+            health = self._health_of(lease.route, lease.domain)
+            health.score += SCORE_SMOOTHING * ((1.0 if ok else 0.0) - health.score)
+            if ok:
+                health.failures = 0
+                health.cooldown_until = 0
+                if nbytes and elapsed > 0:
+                    rate = nbytes / elapsed
+                    health.throughput = rate if health.throughput is None else \
+                        health.throughput + SCORE_SMOOTHING * (rate - health.throughput)
+                return
+            health.failures += 1
+            if throttled or health.failures > 1:
+                cooldown = min(self.max_cooldown, self.cooldown * 2 ** (health.failures - 1))
+                health.cooldown_until = time.monotonic() + cooldown
+                logger.info(f"Avoiding {lease.route.name} for {lease.domain} for {cooldown} seconds")
+
+
+def is_throttled(error):
+    """Check whether an exception means the site throttled or blocked us"""
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) in (403, 429, 503):
+        return True
+    return bool(_THROTTLE_PATTERN.search(str(error)))
+
+
+def _domain(url):
+    host = urlsplit(url).hostname or ''
+    if re.fullmatch(r'[\d.]+|.*:.*', host):
+        # IP address
+        return host
+    # Group subdomains of a site (www., m., rr3---sn-...) together, keeping
+    # the site's own label under country suffixes such as co.uk or com.au
+    parts = host.split('.')
+    keep = 3 if len(parts) > 2 and len(parts[-1]) == 2 and parts[-2] in _COUNTRY_SECOND_LEVEL else 2
+    return '.'.join(parts[-keep:])
+
+
+def _split(value):
+    return [item for item in re.split(r'[\s,]+', value or '') if item]
+
+
+def _config_proxy():
+    """The HTTP_PROXY setting of the bot's config"""
+    try:
+        if bool(os.environ.get("WEBHOOK", False)):
+            from sample_config import Config
+        else:
+            from config import Config
+    except ImportError:
+        return ""
+    return getattr(Config, 'HTTP_PROXY', "") or ""
+
+
+def build_routes(proxies=EGRESS_PROXIES, source_addresses=EGRESS_SOURCE_ADDRESSES):
+    """
+    Build the routes from the configuration
+
+    Without any configured route everything goes out directly over IPv4,
+    as before.
+
+    Returns:
+        list: Route objects
+    """
+    routes = [Route(proxy=proxy) for proxy in dict.fromkeys(_split(proxies) + _split(_config_proxy()))]
+    routes += [Route(source_address=address) for address in dict.fromkeys(_split(source_addresses))]
+    return routes or [Route(source_address='0.0.0.0')]
+
+
+# Shared pool for all of the bot's downloads
+egress = EgressPool(build_routes())
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Typed index over the formats of one yt-dlp extraction.
+
+yt-dlp reports format fields as whatever the site gave it: missing, None,
+strings or numbers. The index parses every format once into numeric
+height, fps, bitrate and size, keeps the video and audio formats in
+best-first order, and picks the best format that still fits under the
+upload limit, so a download does not have to be split into parts.
+"""
+
+import os
+import re
+import logging
+import concurrent.futures
+
+from utils import safe_float, safe_int, format_file_size, estimate_format_size
+
+# Estimated sizes (from bitrates) must fit under the limit with this factor
+# to spare, as variable bitrate media can come out larger
+ESTIMATE_HEADROOM = 1.15
+# Formats without a size whose Content-Length is probed, best first
+SIZE_PROBE_LIMIT = int(os.environ.get("SIZE_PROBE_LIMIT", 16))
+# Seconds all probes of one extraction may take together
+SIZE_PROBE_TIMEOUT = float(os.environ.get("SIZE_PROBE_TIMEOUT", 4))
+SIZE_PROBE_CONCURRENCY = 8
+
+logger = logging.getLogger(__name__)
+
+
+class FormatEntry:
+    """One yt-dlp format with typed fields"""
+
+    def __init__(self, fmt, duration=None):
+        """
+        Parse a yt-dlp format dict
+
+        Args:
+            fmt (dict): Format from the info dict's 'formats'
+            duration (float, optional): Media duration in seconds, used to
+                estimate the size from the bitrate
+        """
+        self.format_id = str(fmt.get('format_id'))
+        self.ext = fmt.get('ext') or ''
+        self.protocol = fmt.get('protocol') or ''
+        self.format_note = fmt.get('format_note') or ''
+        self.vcodec = fmt.get('vcodec') or 'none'
+        self.acodec = fmt.get('acodec') or 'none'
+        self.has_video = self.vcodec != 'none'
+        self.has_audio = self.acodec != 'none'
+        self.width = safe_int(fmt.get('width'))
+        self.height = safe_int(fmt.get('height')) or _parse_height(fmt)
+        self.fps = safe_float(fmt.get('fps'))
+        # Total bitrate in kbit/s; audio-only formats often only have abr
+        self.tbr = safe_float(fmt.get('tbr')) or safe_float(fmt.get('vbr')) + safe_float(fmt.get('abr'))
+        self.resolution = fmt.get('resolution') or (
+            f"{self.width}x{self.height}" if self.width and self.height else
+            f"{self.height}p" if self.height else 'N/A'
+        )
+
+        # Exact size if the site reported one, otherwise an estimate
+        self.size = estimate_format_size(fmt, duration)
+        self.size_exact = safe_int(fmt.get('filesize')) > 0
+
+    @property
+    def quality(self):
+        """Sort key, higher is better"""
+        return (self.height, self.fps, self.tbr)
+
+    def description(self):
+        """Button label for the format, estimated sizes marked with ~"""
+        size = format_file_size(self.size)
+        if self.size and not self.size_exact:
+            size = '~' + size
+        if self.has_video:
+            return f"{self.resolution} ({self.format_note}) [{self.ext}] {size}"
+        return f"Audio {self.format_note} [{self.ext}] {size}"
+
+    def to_dict(self):
+        """Plain dict for the handler, all numbers as numbers"""
+        return {
+            'format_id': self.format_id,
+            'ext': self.ext,
+            'resolution': self.resolution if self.has_video else 'Audio only',
+            'height': self.height,
+            'fps': self.fps,
+            'tbr': self.tbr,
+            'vcodec': self.vcodec,
+            'acodec': self.acodec,
+            'filesize': self.size if self.size_exact else 0,
+            'size_estimate': self.size,
+            'size_exact': self.size_exact,
+            'description': self.description(),
+            'is_video': self.has_video,
+        }
+
+
+class FormatIndex:
+    """Formats of one extraction, with best-first orderings"""
+
+    def __init__(self, formats, duration=None):
+        """
+        Build the index
+
+        Args:
+            formats (list): The info dict's 'formats'
+            duration (float, optional): Media duration in seconds
+        """
+        entries = [FormatEntry(f, duration) for f in formats or [] if f.get('format_id')]
+        # Formats with neither video nor audio (storyboards, ...) are of no use
+        entries = [e for e in entries if e.has_video or e.has_audio]
+        self.by_id = {e.format_id: e for e in entries}
+        self.video = sorted((e for e in entries if e.has_video), key=lambda e: e.quality, reverse=True)
+        self.audio = sorted((e for e in entries if not e.has_video), key=lambda e: e.tbr, reverse=True)
+
+    def best_fitting(self, limit):
+        """
+        Pick the best video download whose size is known to fit under limit
+
+        A video-only format counts with the largest audio format that
+        still fits next to it, as yt-dlp merges the two. Estimated sizes
+        need ESTIMATE_HEADROOM to spare, and formats of unknown size are
+        never picked, as they might need splitting after all.
+
+        Args:
+            limit (int): Upload size limit in bytes
+
+        Returns:
+            dict: {'format_id' (a yt-dlp format selector), 'size',
+            'size_exact', 'description'}, or None if nothing is known to fit
+        """
+        def fits(entries):
+            size = sum(e.size for e in entries)
+            if all(e.size_exact for e in entries):
+                return size <= limit
+            return size * ESTIMATE_HEADROOM <= limit
+
+        sized_audio = [a for a in self.audio if a.size]
+        for video in self.video:
+            if not video.size:
+                continue
+            if video.has_audio:
+                picked = [video] if fits([video]) else None
+            else:
+                audio = next((a for a in sized_audio if fits([video, a])), None)
+                picked = [video, audio] if audio is not None else None
+            if picked is None:
+                continue
+            size = sum(e.size for e in picked)
+            exact = all(e.size_exact for e in picked)
+            return {
+                'format_id': '+'.join(e.format_id for e in picked),
+                'size': size,
+                'size_exact': exact,
+                'description': f"{video.resolution}{'' if video.has_audio else ' + audio'} [{video.ext}] "
+                               f"{'' if exact else '~'}{format_file_size(size)}",
+            }
+        return None
+
+    def to_list(self):
+        """Video formats then audio formats, best first, as plain dicts"""
+        return [e.to_dict() for e in self.video + self.audio]
+
+
+def probe_sizes(formats, session, limit=SIZE_PROBE_LIMIT, timeout=SIZE_PROBE_TIMEOUT):
+    """
+    Fill in the exact size of plain HTTP formats that lack one
+
+    Sends concurrent HEAD requests and stores a Content-Length as the
+    format's 'filesize'. Probes still running after timeout seconds are
+    given up. Every probed format is marked, so cached extractions are not
+    probed again.
+
+    Args:
+        formats (list): The info dict's 'formats', updated in place
+        session (requests.Session): Session to probe with, on the route
+            the formats were extracted over
+        limit (int): Most formats to probe
+        timeout (float): Seconds all probes may take together
+
+    Returns:
+        int: Number of sizes filled in
+    """
+    candidates = [
+        f for f in formats
+        if not safe_int(f.get('filesize')) and not f.get('_size_probed')
+        and f.get('protocol') in ('http', 'https') and f.get('url')
+    ]
+    candidates.sort(key=lambda f: FormatEntry(f).quality, reverse=True)
+    candidates = candidates[:limit]
+    if not candidates:
+        return 0
+
+    executor = concurrent.futures.ThreadPoolExecutor(
+        min(SIZE_PROBE_CONCURRENCY, len(candidates)), thread_name_prefix="size-probe"
+    )
+    try:
+        futures = {executor.submit(_content_length, session, f, timeout): f for f in candidates}
+        done, _ = concurrent.futures.wait(futures, timeout=timeout)
+    finally:
+        executor.shutdown(wait=False)
+    filled = 0
+    for future in done:
+        fmt = futures[future]
+        fmt['_size_probed'] = True
+        size = future.result()
+        if size:
+            fmt['filesize'] = size
+            filled += 1
+    logger.info(f"Probed the size of {len(done)} formats, {filled} found")
+    return filled
+
+
+def _content_length(session, fmt, timeout):
+    """Size from a HEAD request, or from a one-byte range request if HEAD is refused"""
+    headers = fmt.get('http_headers') or {}
+    try:
+        response = session.head(fmt['url'], headers=headers, timeout=timeout, allow_redirects=True)
+        response.close()
+        if response.ok and 'gzip' not in response.headers.get('Content-Encoding', ''):
+            size = safe_int(response.headers.get('Content-Length'))
+            if size:
+                return size
+        response = session.get(fmt['url'], headers=dict(headers, Range='bytes=0-0'),
+                               timeout=timeout, stream=True)
+        response.close()
+    except Exception as e:
+        logger.debug(f"Size probe of format {fmt.get('format_id')} failed: {e}")
+        return 0
+    if response.status_code == 200 and 'gzip' not in response.headers.get('Content-Encoding', ''):
+        # Range ignored, the whole file would have been sent
+        return safe_int(response.headers.get('Content-Length'))
+    # Content-Range: bytes 0-0/12345
+    match = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+    return int(match.group(1)) if response.status_code == 206 and match else 0
+
+
+def _parse_height(fmt):
+    """Height from a '1280x720' resolution or a '720p' note"""
+    match = re.search(r'\d+x(\d+)', str(fmt.get('resolution') or ''))
+    if match:
+        return int(match.group(1))
+    match = re.search(r'(\d{3,4})p', str(fmt.get('format_note') or ''))
+    return int(match.group(1)) if match else 0
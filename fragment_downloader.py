@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parallel fragment downloader for HLS (m3u8) playlists.
+
+Fragments are fetched on a pool of connections and appended to the output
+strictly in playlist order as soon as the next one is available. Only a
+bounded reorder window of fragments is held in memory at any time.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import concurrent.futures
+from urllib.parse import urljoin
+
+from startup import lazy_import
+from segmented_downloader import DEFAULT_HEADERS, DownloadCancelled
+
+# Loaded on first use
+requests = lazy_import("requests")
+
+logger = logging.getLogger(__name__)
+
+# Number of fragments downloaded in parallel
+HLS_CONCURRENCY = int(os.environ.get("HLS_CONCURRENCY", 8))
+# Attempts per fragment before the download fails
+FRAGMENT_RETRIES = int(os.environ.get("FRAGMENT_RETRIES", 10))
+# How many fragments past the next unwritten one may be in flight or buffered
+REORDER_WINDOW = int(os.environ.get("REORDER_WINDOW", 32))
+
+
+def _aes_cbc_decrypt():
+    """yt-dlp's AES-128-CBC decryption, imported on first use (None without yt-dlp)"""
+    try:
+        from yt_dlp.aes import aes_cbc_decrypt_bytes
+    except ImportError:
+        return None
+    return aes_cbc_decrypt_bytes
+
+
+class UnsupportedPlaylist(Exception):
+    """Raised for playlists this engine does not handle (live, SAMPLE-AES, byte ranges)"""
+
+
+class Fragment:
+    """A single media segment of a playlist"""
+
+    def __init__(self, index, url, duration, key=None, iv=None):
+        self.index = index
+        self.url = url
+        self.duration = duration
+        # (method, key_url) of the EXT-X-KEY in effect, or None
+        self.key = key
+        self.iv = iv
+
+
+def _parse_attributes(line):
+    """Parse an m3u8 attribute list: KEY=VALUE,KEY="VALUE",..."""
+    attrs = {}
+    for key, value in re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', line.split(':', 1)[1]):
+        attrs[key] = value.strip('"')
+    return attrs
+
+
+def parse_playlist(text, base_url):
+    """
+    Parse an m3u8 playlist
+
+    Args:
+        text (str): Playlist content
+        base_url (str): URL the playlist was loaded from
+
+    Returns:
+        dict: {'variants': [(bandwidth, url), ...]} for a master playlist or
+        {'fragments': [Fragment, ...], 'init': url or None} for a media playlist
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or lines[0] != '#EXTM3U':
+        raise UnsupportedPlaylist("Not an m3u8 playlist")
+
+    if any(line.startswith('#EXT-X-STREAM-INF') for line in lines):
+        for line in lines:
+            if line.startswith('#EXT-X-MEDIA:') and 'URI=' in line \
+                    and _parse_attributes(line).get('TYPE') == 'AUDIO':
+                raise UnsupportedPlaylist("Separate audio renditions are not supported")
+        variants = []
+        for i, line in enumerate(lines):
+            if line.startswith('#EXT-X-STREAM-INF') and i + 1 < len(lines):
+                bandwidth = int(_parse_attributes(line).get('BANDWIDTH', 0) or 0)
+                variants.append((bandwidth, urljoin(base_url, lines[i + 1])))
+        return {'variants': variants}
+
+    if '#EXT-X-ENDLIST' not in lines:
+        raise UnsupportedPlaylist("Live playlists are not supported")
+
+    fragments = []
+    init = None
+    key = None
+    explicit_iv = None
+    sequence = 0
+    duration = 0.0
+    for line in lines:
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-BYTERANGE'):
+            raise UnsupportedPlaylist("Byte-range playlists are not supported")
+        elif line.startswith('#EXT-X-MAP'):
+            attrs = _parse_attributes(line)
+            if 'BYTERANGE' in attrs:
+                raise UnsupportedPlaylist("Byte-range playlists are not supported")
+            init = urljoin(base_url, attrs['URI'])
+        elif line.startswith('#EXT-X-KEY'):
+            attrs = _parse_attributes(line)
+            method = attrs.get('METHOD', 'NONE')
+            if method == 'NONE':
+                key = None
+            elif method == 'AES-128' and _aes_cbc_decrypt() is not None:
+                key = (method, urljoin(base_url, attrs['URI']))
+            else:
+                raise UnsupportedPlaylist(f"Encryption {method} is not supported")
+            explicit_iv = bytes.fromhex(attrs['IV'][2:]) if attrs.get('IV') else None
+        elif line.startswith('#EXTINF'):
+            duration = float(line.split(':', 1)[1].split(',')[0] or 0)
+        elif not line.startswith('#'):
+            iv = explicit_iv or (sequence + len(fragments)).to_bytes(16, 'big')
+            fragments.append(Fragment(len(fragments), urljoin(base_url, line), duration, key, iv))
+            duration = 0.0
+    return {'fragments': fragments, 'init': init}
+
+
+class HLSDownloader:
+    """
+    Download an HLS playlist with fragment-level concurrency and retry.
+
+    Progress is reported through yt-dlp style hooks, including the
+    'fragment_index' and 'fragment_count' fields yt-dlp itself provides.
+    """
+
+    def __init__(self, concurrency=HLS_CONCURRENCY, retries=FRAGMENT_RETRIES,
+                 window=REORDER_WINDOW, timeout=30, headers=None,
+                 progress_hooks=None, cancel_event=None, session=None):
+        """
+        Initialize the downloader
+
+        Args:
+            concurrency (int): Number of fragments fetched in parallel
+            retries (int): Attempts per fragment before giving up
+            window (int): Maximum fragments in flight or buffered ahead of the writer
+            timeout (float): Connect/read timeout per request in seconds
+            headers (dict, optional): Extra request headers
+            progress_hooks (list, optional): yt-dlp style progress callables
+            cancel_event (threading.Event, optional): Aborts the download when set
+            session (requests.Session, optional): Session to send the requests
+                with, e.g. one going through a proxy
+        """
+        self.concurrency = max(1, concurrency)
+        self.retries = max(1, retries)
+        self.window = max(self.concurrency, window)
+        self.timeout = timeout
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self.progress_hooks = progress_hooks or []
+        self.cancel_event = cancel_event or threading.Event()
+        # Set internally when one fragment fails, to stop the others
+        self._abort = threading.Event()
+        self._session = session or requests.Session()
+        self._keys = {}
+        self._keys_lock = threading.Lock()
+
+    def load(self, url):
+        """
+        Resolve a playlist URL to its media playlist
+
+        Master playlists are resolved to the highest bandwidth variant.
+
+        Returns:
+            dict: {'url', 'fragments', 'init'}
+        """
+        for _ in range(3):
+            response = self._session.get(url, headers=self.headers, timeout=self.timeout)
+            response.raise_for_status()
+            playlist = parse_playlist(response.text, response.url)
+            if 'variants' not in playlist:
+                playlist['url'] = response.url
+                return playlist
+            if not playlist['variants']:
+                raise UnsupportedPlaylist("Master playlist has no variants")
+            url = max(playlist['variants'])[1]
+        raise UnsupportedPlaylist("Too many nested master playlists")
+
+    def download(self, url, dest_path, playlist=None, resume=None, checkpoint=None):
+        """
+        Download all fragments of a playlist into dest_path
+
+        Args:
+            url (str): Playlist URL
+            dest_path (str): Final path of the file
+            playlist (dict, optional): Result of load() if already available
+            resume (dict, optional): Progress saved by a previous checkpoint;
+                the .part file is cut back to the last saved fragment and
+                the download continues from there
+            checkpoint (callable, optional): Called as checkpoint(progress)
+                with JSON-serializable progress as fragments are appended
+
+        Returns:
+            str: dest_path
+        """
+        playlist = playlist or self.load(url)
+        fragments = playlist['fragments']
+        part_path = dest_path + '.part'
+        started_at = time.time()
+        written = 0
+        next_index = 0
+        self._abort.clear()
+
+        if resume and resume.get('kind') == 'hls' and resume.get('fragment_count') == len(fragments) \
+                and os.path.exists(part_path) and os.path.getsize(part_path) >= resume['bytes_written']:
+            written = resume['bytes_written']
+            next_index = resume['fragments_done']
+            logger.info(f"Resuming {part_path} at fragment {next_index}/{len(fragments)}")
+        # Bytes from an earlier run are left out of the speed
+        resumed = written
+
+        def save_progress(force=False):
+            if checkpoint is not None:
+                checkpoint({
+                    'kind': 'hls',
+                    'fragment_count': len(fragments),
+                    'fragments_done': next_index,
+                    'bytes_written': written,
+                }, force)
+
+        with open(part_path, 'r+b' if next_index else 'wb') as out:
+            if next_index:
+                # Drop anything written after the last checkpoint
+                out.truncate(written)
+                out.seek(written)
+            elif playlist.get('init'):
+                out.write(self._fetch(playlist['init']))
+                written = out.tell()
+
+            buffered = {}
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.concurrency, thread_name_prefix="fragment"
+            ) as pool:
+                pending = {}
+                submitted = next_index
+                try:
+                    while next_index < len(fragments):
+                        # Keep the pool busy without running past the reorder window
+                        while submitted < len(fragments) and submitted < next_index + self.window \
+                                and len(pending) < self.concurrency:
+                            fragment = fragments[submitted]
+                            pending[pool.submit(self._fetch_fragment, fragment)] = fragment.index
+                            submitted += 1
+
+                        done, _ = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            buffered[pending.pop(future)] = future.result()
+
+                        # Append every fragment that is now next in order
+                        while next_index in buffered:
+                            data = buffered.pop(next_index)
+                            out.write(data)
+                            written += len(data)
+                            next_index += 1
+                            self._report(part_path, written, next_index, len(fragments), started_at, resumed)
+                        out.flush()
+                        save_progress()
+                except BaseException:
+                    self._abort.set()
+                    for future in pending:
+                        future.cancel()
+                    raise
+
+        os.replace(part_path, dest_path)
+        self._report(dest_path, written, len(fragments), len(fragments), started_at, resumed, 'finished')
+        return dest_path
+
+    def _fetch(self, url):
+        """GET a URL with retries and return its body"""
+        for attempt in range(1, self.retries + 1):
+            if self.cancel_event.is_set() or self._abort.is_set():
+                raise DownloadCancelled("Download cancelled")
+            try:
+                response = self._session.get(url, headers=self.headers, timeout=self.timeout)
+                response.raise_for_status()
+                return response.content
+            except requests.RequestException as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Fragment request failed (attempt {attempt}): {e}")
+                time.sleep(min(2 ** attempt, 30))
+
+    def _fetch_fragment(self, fragment):
+        data = self._fetch(fragment.url)
+        if fragment.key:
+            data = _aes_cbc_decrypt()(data, self._key(fragment.key[1]), fragment.iv)
+            # Strip PKCS#7 padding
+            data = data[:-data[-1]] if data else data
+        return data
+
+    def _key(self, key_url):
+        with self._keys_lock:
+            if key_url not in self._keys:
+                self._keys[key_url] = self._fetch(key_url)
+            return self._keys[key_url]
+
+    def _report(self, filename, written, done, count, started_at, resumed=0, status='downloading'):
+        elapsed = max(time.time() - started_at, 1e-6)
+        speed = (written - resumed) / elapsed
+        estimate = int(written / done * count) if done else None
+        d = {
+            'status': status,
+            'filename': filename,
+            'downloaded_bytes': written,
+            'total_bytes_estimate': estimate,
+            'fragment_index': done,
+            'fragment_count': count,
+            'elapsed': elapsed,
+            'speed': speed,
+            'eta': int((estimate - written) / speed) if estimate and speed else None,
+        }
+        if status == 'finished':
+            d['total_bytes'] = written
+        for hook in self.progress_hooks:
+            hook(d)
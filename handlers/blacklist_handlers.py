@@ -12,7 +12,7 @@ except ImportError:
     PTB_VERSION = 13
 
 # Import database functions
-from database import get_stuff, set_stuff
+from database.user_index import blacklist_index
 
 # Import add_blacklist from url_handler
 from handlers.url_handler import add_blacklist
@@ -22,20 +22,13 @@ ADMIN_USERS = [-1001517978805, 1023936257, 1845875276, 1298181668]
 
 # Simple remove blacklist function
 def remove_blacklist(user_id):
-    blacklist = get_stuff("BLACKLIST")
-    if "USERS" not in blacklist or user_id not in blacklist["USERS"]:
+    if not blacklist_index.remove(user_id):
         return "User not found in blacklist!"
-    
-    blacklist["USERS"].remove(user_id)
-    set_stuff("BLACKLIST", blacklist)
     return f"User {user_id} removed from blacklist!"
 
 # Simple get blacklisted function
 def get_blacklisted():
-    blacklist = get_stuff("BLACKLIST")
-    if "USERS" not in blacklist:
-        return []
-    return blacklist["USERS"]
+    return blacklist_index.to_list()
 
 def black_user_handler(update, context):
     """Handle /black command - blacklist a user"""
@@ -13,17 +13,21 @@ except ImportError:
     PTB_VERSION = 13
 
 # Import database functions
-from database import get_stuff
+from database.user_index import chat_index
+
+from download_queue import download_queue
+from bandwidth import bandwidth
+from bot_limiter import bot_calls
+from egress import egress
+from session_store import sessions
+from utils import format_file_size
 
 # Admin user IDs (from original code)
 ADMIN_USERS = [-1001517978805, 1023936257, 1845875276, 1298181668]
 
 # Simple get all chats function
 def get_all_chats():
-    chats = get_stuff("ALLCHATS")
-    if "USERS" not in chats:
-        return []
-    return chats["USERS"]
+    return chat_index.to_list()
 
 def broadcast_handler(update, context):
     """Handle /broadcast command - send message to all users"""
@@ -125,18 +129,49 @@ def stats_handler(update, context):
     if user_id not in ADMIN_USERS and update.effective_chat.id not in ADMIN_USERS:
         return
     
-    # Get all chats
-    all_chats = get_all_chats()
+    # Queue occupancy and disk reservations
+    queue = download_queue.stats()
+    disk = queue['disk']
+    text = (
+        f"Total users: {len(chat_index)}\n"
+        f"Jobs: {queue['running']} running, {queue['pending']} queued\n"
+        f"Disk: {format_file_size(disk['free'], '0 KB')} free, "
+        f"{format_file_size(disk['reserved'], '0 KB')} reserved "
+        f"({format_file_size(disk['outstanding'], '0 KB')} still to download)"
+    )
+    if bandwidth.enabled:
+        allocation = bandwidth.allocation()
+        flows = sum(len(user['flows']) for user in allocation['users'].values())
+        text += (
+            f"\nBandwidth: {format_file_size(allocation['global_rate'], 'unlimited')}/s total, "
+            f"{flows} transfer(s) across {len(allocation['users'])} user(s)"
+        )
+    calls = bot_calls.stats()
+    text += (
+        f"\nBot calls: {calls['queued']} queued, {calls['queued_edits']} edits queued, "
+        f"{calls['dropped_edits']} edits skipped"
+    )
+    if calls['paused_for']:
+        text += f", paused {calls['paused_for']:.0f}s for flood control"
+    if len(egress.routes) > 1:
+        routes = egress.stats()
+        cooling = sum(1 for route in routes.values() if any(site['cooling_for'] for site in route['sites'].values()))
+        text += f"\nEgress routes: {len(routes)}, {cooling} avoided by some site"
+    open_sessions = sessions.stats()
+    text += (
+        f"\nFormat selections: {open_sessions['sessions']} open for {open_sessions['users']} user(s), "
+        f"{format_file_size(open_sessions['bytes'], '0 KB')}"
+    )
     
     # Send stats message
     if PTB_VERSION >= 20:
         # v20.x style (async)
         async def async_reply():
-            await update.message.reply_text(f"Total users: {len(all_chats)}")
+            await update.message.reply_text(text)
         return async_reply()
     else:
         # v13.x style (sync)
-        return update.message.reply_text(f"Total users: {len(all_chats)}")
+        return update.message.reply_text(text)
 
 # Export handlers list
 broadcast_handlers = [
@@ -6,7 +6,7 @@ import sys
 from translation import Translation
 
 # Import database functions
-from database import get_stuff, set_stuff
+from database.user_index import chat_index, blacklist_index
 
 # Detect python-telegram-bot version
 try:
@@ -19,19 +19,11 @@ except ImportError:
 
 # Simple blacklist check function
 def check_blacklist(user_id):
-    blacklist = get_stuff("BLACKLIST")
-    if "USERS" in blacklist and user_id in blacklist["USERS"]:
-        return True
-    return False
+    return user_id in blacklist_index
 
-# Simple add chat function
+# Simple add chat function, only writes when the user is new
 def add_chat(user_id):
-    chats = get_stuff("ALLCHATS")
-    if "USERS" not in chats:
-        chats["USERS"] = []
-    if user_id not in chats["USERS"]:
-        chats["USERS"].append(user_id)
-    set_stuff("ALLCHATS", chats)
+    chat_index.add(user_id)
 
 def start_handler(update, context):
     """Handle /start command"""
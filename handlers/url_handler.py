@@ -6,6 +6,8 @@ import tempfile
 import shutil
 import json
 import time
+import logging
+import functools
 import threading
 from pathlib import Path
 
@@ -27,26 +29,47 @@ from translation import Translation
 from handlers.start import check_blacklist, add_chat
 
 # Import database functions
-from database import get_stuff, set_stuff
+from database.user_index import blacklist_index
 
 # Import URL processor
-from url_processor import URLProcessor
+from url_processor import URLProcessor, DownloadWatch, MAX_FILE_SIZE, PLAYLIST_CONCURRENCY, CANCEL_GRACE, video_split_available
+
+# Import uploaded file_id index
+from database.file_ids import get_cached_upload, get_cached_by_hash, cache_upload, invalidate_upload
+
+# Import utility functions
+from utils import file_content_hash
+
+# Import persistent job state
+from job_state import JobState
+
+# Import job directory manager
+from workspace import workspaces
+
+# Import bandwidth scheduler
+from bandwidth import bandwidth, ThrottledReader
+
+# Import Bot API call scheduler
+from bot_limiter import bot_calls
+
+# Import download job queue
+from download_queue import download_queue, disk_ledger, new_job_id, QueueFullError
+from disk_ledger import DEFAULT_JOB_SIZE
+
+# Import format selection sessions
+from session_store import sessions, compact_formats_info, button_format_id
 
 # Simple add blacklist function
 def add_blacklist(user_id):
-    blacklist = get_stuff("BLACKLIST")
-    if "USERS" not in blacklist:
-        blacklist["USERS"] = []
-    if user_id not in blacklist["USERS"]:
-        blacklist["USERS"].append(user_id)
-    set_stuff("BLACKLIST", blacklist)
-
-# Store user data (URL, format selection, etc.)
-user_data = {}
+    blacklist_index.add(user_id)
 
 # Store active downloads/uploads for cancellation
 active_tasks = {}
 
+# Job fields persisted in job.json so a job can be resumed after a restart
+JOB_RECORD_FIELDS = ('chat_id', 'message_id', 'url', 'custom_caption', 'title', 'format_id', 'file_type',
+                     'disk_reservation')
+
 def url_handler(update, context):
     """Handle URL messages - main functionality"""
     # Check if this is a callback query (button press)
@@ -111,32 +134,30 @@ def url_handler(update, context):
             url = url.strip()
             custom_caption = custom_caption.strip()
         
-        # Store user data
-        user_data[user_id] = {
-            'url': url,
-            'custom_caption': custom_caption,
-            'processing_msg_id': processing_msg.message_id,
-            'chat_id': update.effective_chat.id
-        }
-        
         # Fetch available formats
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         formats_info = loop.run_until_complete(processor.get_available_formats(url))
         loop.close()
         
-        # Store formats in user data
-        user_data[user_id]['formats_info'] = formats_info
+        # Open a session for the buttons, keeping only what a button press needs
+        session = dict(compact_formats_info(formats_info), url=url, custom_caption=custom_caption)
+        session_id = sessions.create(user_id, session)
         
-        # Debug: Print available formats
-        print(f"DEBUG: Total formats available: {len(formats_info.get('formats', []))}")
-        for i, fmt in enumerate(formats_info.get('formats', [])):
-            print(f"DEBUG: Format {i}: {fmt.get('format_id')} - Video: {fmt.get('is_video', False)} - Size: {fmt.get('filesize', 'N/A')}")
+        logging.debug(f"Total formats available: {len(formats_info.get('formats', []))}")
         
         # Create format selection buttons (2 per row)
         keyboard = []
         row = []
         
+        # Offer the best format that can be sent without splitting first
+        best_fit = formats_info.get('best_fit')
+        if best_fit:
+            keyboard.append([InlineKeyboardButton(
+                f"⭐ Best without splitting: {best_fit['description']}",
+                callback_data=f"fmt_{session_id}_*_video"
+            )])
+        
         # Add video formats - show all video formats
         video_formats = [f for f in formats_info['formats'] if f.get('is_video', False)]
         filtered_video_formats = []
@@ -163,7 +184,7 @@ def url_handler(update, context):
             # Create button with format info
             btn = InlineKeyboardButton(
                 f"🎬 {desc}", 
-                callback_data=f"fmt_{user_id}_{format_id}_video"
+                callback_data=f"fmt_{session_id}_{button_format_id(session, format_id)}_video"
             )
             row.append(btn)
             
@@ -198,7 +219,7 @@ def url_handler(update, context):
             # Create button with format info
             btn = InlineKeyboardButton(
                 f"🎵 {desc}", 
-                callback_data=f"fmt_{user_id}_{format_id}_audio"
+                callback_data=f"fmt_{session_id}_{button_format_id(session, format_id)}_audio"
             )
             row.append(btn)
             
@@ -207,6 +228,18 @@ def url_handler(update, context):
                 keyboard.append(row)
                 row = []
         
+        # Offer the whole playlist when the link is one
+        if formats_info.get('is_playlist'):
+            count = formats_info.get('playlist_count', 0)
+            keyboard.append([InlineKeyboardButton(
+                f"📃 Whole playlist ({count}) - Video",
+                callback_data=f"playlist_{session_id}_video"
+            )])
+            keyboard.append([InlineKeyboardButton(
+                f"📃 Whole playlist ({count}) - Audio",
+                callback_data=f"playlist_{session_id}_audio"
+            )])
+        
         # Create reply markup
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -289,26 +322,17 @@ def handle_callback_query(update, context):
             if callback_user_id != user_id:
                 return query.answer("You are not authorized to cancel this download.")
             
-            # Find the task
-            if task_id in active_tasks:
-                task_info = active_tasks[task_id]
-                download_task = task_info['task']
+            # Cancel the queued or running job
+            if task_id in active_tasks and download_queue.cancel(task_id):
+                # Update message
+                query.edit_message_text(
+                    "<b>❌ Download cancelled by user.</b>",
+                    parse_mode='HTML'
+                )
                 
-                # Cancel the task
-                if not download_task.done():
-                    download_task.cancel()
-                    
-                    # Update message
-                    query.edit_message_text(
-                        "<b>❌ Download cancelled by user.</b>",
-                        parse_mode='HTML'
-                    )
-                    
-                    # Clean up
-                    if user_id in user_data:
-                        del user_data[user_id]
-                    del active_tasks[task_id]
-                    return
+                # Clean up
+                active_tasks.pop(task_id, None)
+                return
             
             query.edit_message_text(
                 "<b>⚠️ Could not cancel download. It may have already completed or been cancelled.</b>",
@@ -349,275 +373,711 @@ def handle_callback_query(update, context):
         # Format selection callback
         parts = data.split('_')
         if len(parts) >= 4:
-            callback_user_id = int(parts[1])
-            format_id = parts[2]
-            file_type = parts[3]  # 'video' or 'audio'
+            session_id = parts[1]
+            format_id = '_'.join(parts[2:-1])  # Format ids may contain '_'
+            file_type = parts[-1]  # 'video' or 'audio'
+            
+            # Get the session the buttons belong to
+            session = sessions.get(session_id)
+            if session is None:
+                return query.edit_message_text(
+                    "Session expired. Please send the URL again.",
+                    parse_mode='HTML'
+                )
             
             # Check if this is the user who initiated the request
-            if callback_user_id != user_id:
+            session_user_id, user_info = session
+            if session_user_id != user_id:
                 return query.edit_message_text(
                     "You are not authorized to use these buttons.",
                     parse_mode='HTML'
                 )
+            # Long format ids and the best fit selector come as short keys
+            format_id = user_info['aliases'].get(format_id, format_id)
             
-            # Get user data
-            if user_id not in user_data:
+            # Disk space the job needs: the download, plus a copy of it when
+            # it has to be cut into playable parts
+            disk_reservation = user_info['sizes'].get(format_id, 0)
+            if file_type == 'video' and disk_reservation > MAX_FILE_SIZE and video_split_available():
+                disk_reservation *= 2
+            
+            # Hand the job over to the download queue and return at once
+            try:
+                _submit_job(user_id, _run_download_job, {
+                    'bot': context.bot,
+                    'chat_id': update.effective_chat.id,
+                    'message_id': query.message.message_id,
+                    'url': user_info['url'],
+                    'custom_caption': user_info['custom_caption'],
+                    'title': user_info['title'],
+                    'format_id': format_id,
+                    'file_type': file_type,
+                    'disk_reservation': disk_reservation,
+                })
+            except QueueFullError:
+                return query.edit_message_text(
+                    "<b>⚠️ The bot is busy right now. Please try again in a few minutes.</b>",
+                    parse_mode='HTML'
+                )
+            
+            # Close the session, the job carries everything it needs; its
+            # position in the queue is shown through the keyed status edits
+            sessions.pop(session_id)
+    
+    elif data.startswith('playlist_'):
+        # Whole playlist callback
+        parts = data.split('_')
+        if len(parts) >= 3:
+            session_id = parts[1]
+            file_type = parts[2]  # 'video' or 'audio'
+            
+            # Get the session the buttons belong to
+            session = sessions.get(session_id)
+            if session is None:
                 return query.edit_message_text(
                     "Session expired. Please send the URL again.",
                     parse_mode='HTML'
                 )
             
-            user_info = user_data[user_id]
-            url = user_info['url']
-            custom_caption = user_info['custom_caption']
-            formats_info = user_info.get('formats_info', {})
+            # Check if this is the user who initiated the request
+            session_user_id, user_info = session
+            if session_user_id != user_id:
+                return query.edit_message_text(
+                    "You are not authorized to use these buttons.",
+                    parse_mode='HTML'
+                )
             
-            # Update message to show download progress
-            query.edit_message_text(
-                f"<b>Downloading:</b> {formats_info.get('title', 'Video')}\n\n" +
-                f"<b>Format:</b> {format_id} ({file_type})\n\n" +
-                "<i>This may take a while depending on file size...</i>",
-                parse_mode='HTML'
+            # Entry formats differ per video, so pick the best of each; like
+            # the single video path, merge separate video and audio streams
+            # rather than settle for a pre-merged (often low resolution) one
+            format_id = 'bestvideo*+bestaudio/best' if file_type == 'video' else 'bestaudio'
+            try:
+                _submit_job(user_id, _run_playlist_job, {
+                    'bot': context.bot,
+                    'chat_id': update.effective_chat.id,
+                    'message_id': query.message.message_id,
+                    'url': user_info['url'],
+                    'custom_caption': user_info['custom_caption'],
+                    'title': user_info['title'],
+                    'format_id': format_id,
+                    'file_type': file_type,
+                    # Entries download side by side, and a finished one stays
+                    # on disk until it is uploaded
+                    'disk_reservation': DEFAULT_JOB_SIZE * max(1, min(PLAYLIST_CONCURRENCY + 1,
+                                                                       user_info['playlist_count'])),
+                    'playlist_count': user_info['playlist_count'],
+                })
+            except QueueFullError:
+                return query.edit_message_text(
+                    "<b>⚠️ The bot is busy right now. Please try again in a few minutes.</b>",
+                    parse_mode='HTML'
+                )
+            
+            sessions.pop(session_id)
+
+def _submit_job(user_id, runner, data, job_id=None):
+    """
+    Queue a job and track it for cancellation
+
+    The job is tracked before it is submitted, as it may start, and even
+    finish, before submit returns. A refused job is untracked again by
+    _discard_job.
+
+    Raises:
+        QueueFullError: If the queue is full
+    """
+    job_id = job_id or new_job_id()
+    task = {
+        'user_id': user_id,
+        'chat_id': data['chat_id'],
+        'message_id': data['message_id']
+    }
+    active_tasks[job_id] = task
+    task['job'] = download_queue.submit(user_id, runner, data, job_id=job_id)
+    return task['job']
+
+def _queued_text(job, position):
+    """Status text of a job waiting in the download queue"""
+    data = job.data
+    if job.runner is _run_playlist_job:
+        text = (f"<b>Queued playlist:</b> {data['title']}\n\n" +
+                f"<b>Entries:</b> {data['playlist_count']} ({data['file_type']})\n\n")
+    else:
+        text = (f"<b>Queued:</b> {data['title']}\n\n" +
+                f"<b>Format:</b> {data['format_id']} ({data['file_type']})\n\n")
+    return text + (f"<i>Position in queue: {position}</i>" if position else "<i>Starting...</i>")
+
+def _queued_markup(job):
+    cancel_button = InlineKeyboardButton(
+        "❌ Cancel Download", 
+        callback_data=f"cancel_{job.user_id}_{job.job_id}"
+    )
+    return InlineKeyboardMarkup([[cancel_button]])
+
+def _show_queue_position(job, position):
+    """
+    Update a waiting job's status message when the queue advances
+
+    Runs on the queue loop. The edit goes through the keyed edit of
+    bot_calls, so a job that moves up several places at once sends only its
+    newest position, and the job's own first status edit supersedes it.
+    """
+    async def edit():
+        try:
+            await bot_calls.edit(
+                job.data['bot'],
+                chat_id=job.data['chat_id'],
+                message_id=job.data['message_id'],
+                text=_queued_text(job, position),
+                parse_mode='HTML',
+                reply_markup=_queued_markup(job)
+            )
+        except Exception as e:
+            logging.debug(f"Could not update the queue position of job {job.job_id}: {e}")
+    asyncio.ensure_future(edit())
+
+def _discard_job(job):
+    """
+    Clean up after a job that never ran: cancelled while waiting, or refused
+    because the queue is full
+
+    A resumed job already holds its directory, which would otherwise stay
+    leased and come back on the next restart.
+    """
+    active_tasks.pop(job.job_id, None)
+    download_dir = job.data.get('download_dir')
+    if download_dir:
+        JobState(download_dir).remove()
+        workspaces.release(download_dir)
+
+download_queue.on_position = _show_queue_position
+download_queue.on_discard = _discard_job
+
+async def _run_sync(func, *args, **kwargs):
+    """Run a blocking helper in the default executor"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+async def _bot_call(method, **kwargs):
+    """Run a blocking Bot API method within the flood limits, without blocking the queue loop"""
+    return await bot_calls.call(method, **kwargs)
+
+async def _upload_while_downloading(processor, watch, bot, chat_id, caption, file_type, user_id=None,
+                                    resume=None):
+    """
+    Upload the parts of a large file as soon as they are downloaded
+    
+    Args:
+        resume (dict, optional): A cached send that failed partway, see
+            _delivered_parts
+    
+    Returns:
+        dict: {'filename', 'parts'} if every part of the file was sent,
+        otherwise None and the file is uploaded after the download
+    """
+    if file_type == 'video' and video_split_available():
+        # Byte slices are not playable, wait for split_video() instead
+        return None
+    
+    # Wait until the downloader knows whether, and how much, to stream
+    while not (watch.finished or watch.failed or (watch.streamable and watch.total)):
+        await asyncio.sleep(1)
+    if not watch.streamable or watch.failed or not watch.total or watch.total <= MAX_FILE_SIZE:
+        return None
+    
+    parts = []
+    count = None
+    async for part in processor.stream_split(watch):
+        count = part['count']
+        delivered = _delivered_parts(resume, count)
+        if part['index'] < len(delivered):
+            part['window'].close()
+            parts.append(delivered[part['index']])
+            continue
+        part_caption = f"{caption} (Part {part['index']+1}/{count})"
+        with part['window'] as window:
+            message = await _send_file(bot, chat_id, window, part_caption, file_type, watch.filename, user_id)
+        parts.append(_sent_file_ref(message))
+    
+    if watch.failed or len(parts) != count:
+        return None
+    return {'filename': watch.filename, 'parts': parts}
+
+async def _show_progress(job_id, edit, header, reply_markup=None, interval=3):
+    """Keep a message up to date with a job's progress until cancelled"""
+    await edit(header + "\n\n<i>Downloading... Please wait.</i>\n\n⏳ Progress will update every few seconds",
+               reply_markup)
+    async for snapshot in URLProcessor.progress.subscribe(job_id, interval):
+        if snapshot.get('status') != 'downloading':
+            continue
+        text = header + f"\n\n<i>Downloaded: {snapshot['percent']:.1f}%</i>"
+        if snapshot.get('fragment_count'):
+            text += f"\n<i>Fragment: {snapshot.get('fragment_index') or 0}/{snapshot['fragment_count']}</i>"
+        if snapshot['speed'] > 0:
+            text += f"\n<i>Speed: {snapshot['speed'] / 1024 / 1024:.1f} MB/s</i>"
+        if snapshot['eta'] > 0:
+            text += f"\n<i>ETA: {snapshot['eta']} seconds</i>"
+        await edit(text, reply_markup)
+
+async def _run_download_job(job):
+    """Download, split and upload a queued format selection"""
+    data = job.data
+    bot = data['bot']
+    chat_id = data['chat_id']
+    message_id = data['message_id']
+    format_id = data['format_id']
+    file_type = data['file_type']
+    title = data['title']
+    task_id = job.job_id
+    # A resumed job owns its directory and state from the start, so the
+    # cleanup below also runs when it ends early (e.g. on a cache hit)
+    download_dir = data.get('download_dir')
+    job_state = JobState.load(download_dir) if download_dir else None
+    
+    async def edit(text, reply_markup=None):
+        try:
+            # Progress edits yield to uploads, and only the newest queued one is sent
+            await bot_calls.edit(
+                bot,
+                chat_id=chat_id,
+                message_id=message_id,
+                text=text,
+                parse_mode='HTML',
+                reply_markup=reply_markup
             )
+        except Exception as e:
+            logging.error(f"Error updating message: {e}")
+    
+    # Create cancel button
+    cancel_button = InlineKeyboardButton(
+        "❌ Cancel Download", 
+        callback_data=f"cancel_{job.user_id}_{task_id}"
+    )
+    cancel_markup = InlineKeyboardMarkup([[cancel_button]])
+    
+    # Update message to show download progress
+    await edit(
+        f"<b>{'Resuming' if data.get('download_dir') else 'Downloading'}:</b> {title}\n\n" +
+        f"<b>Format:</b> {format_id} ({file_type})\n\n" +
+        "<i>This may take a while depending on file size...</i>",
+        cancel_markup
+    )
+    
+    try:
+        # Re-send a previous upload of the same URL and format by file_id
+        cached = get_cached_upload(data['url'], format_id, file_type)
+        resume = None
+        if cached:
+            sent = await _send_cached(bot, chat_id, cached, data['custom_caption'] or title)
+            if sent == len(cached['parts']):
+                await edit("<b>✅ Successfully processed URL!</b>\n\n<i>Sent from cache.</i>")
+                return
+            # Parts already delivered are not sent again
+            resume = {'parts': cached['parts'], 'sent': sent}
+        
+        # Initialize URL processor
+        processor = URLProcessor()
+        
+        # Create a unique download directory, or reuse the one of a resumed job
+        if download_dir:
+            workspaces.adopt(download_dir)
+        else:
+            download_dir = workspaces.create(task_id)
+        disk_ledger.attach(task_id, download_dir)
+        
+        # Persist the job so it can be resumed after a restart
+        job_state = job_state or JobState(download_dir)
+        record = {key: data.get(key) for key in JOB_RECORD_FIELDS}
+        job_state.update(job_id=task_id, user_id=job.user_id, download_dir=download_dir,
+                         pid=os.getpid(), **record)
+        
+        # Start download in background
+        watch = DownloadWatch()
+        download_task = asyncio.ensure_future(
+            processor.download(data['url'], download_dir, data['custom_caption'], format_id, job_state, watch,
+                               user_id=job.user_id, job_id=task_id)
+        )
+        # Upload parts of a large file while the rest is still downloading
+        stream_task = asyncio.ensure_future(_upload_while_downloading(
+            processor, watch, bot, chat_id, data['custom_caption'] or title, file_type, job.user_id, resume
+        ))
+        
+        # Show progress while downloading, at most every 3 seconds to avoid flooding
+        progress_task = asyncio.ensure_future(_show_progress(
+            task_id, edit, f"<b>Downloading:</b> {title}\n\n<b>Format:</b> {format_id} ({file_type})",
+            cancel_markup
+        ))
+        try:
+            while not download_task.done():
+                pending = {download_task} if stream_task.done() else {download_task, stream_task}
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if stream_task.done() and stream_task.exception():
+                    # A part failed to upload, the download is of no use
+                    raise stream_task.exception()
+        except (asyncio.CancelledError, Exception):
+            # Let the download stop writing before the cleanup below removes
+            # its directory
+            download_task.cancel()
+            stream_task.cancel()
+            await asyncio.wait({download_task, stream_task}, timeout=CANCEL_GRACE)
+            raise
+        finally:
+            progress_task.cancel()
+        
+        try:
+            result = download_task.result()
+        except Exception as e:
+            # Task failed
+            stream_task.cancel()
+            await edit(f"<b>❌ Error during download:</b> {str(e)}")
+            return
+        
+        # Let the streaming upload send its last part
+        streamed = await stream_task
+        
+        if not result or not result.get('files'):
+            await edit("<b>❌ Failed to download file.</b>")
+            return
+        
+        # Upload each file
+        uploaded_files = []  # Track files for cleanup
+        for file_info in result['files']:
+            file_path = file_info['file_path']
+            caption = file_info['caption']
+            
+            if streamed and os.path.abspath(streamed['filename']) == os.path.abspath(file_path):
+                # Already uploaded part by part during the download
+                if all(streamed['parts']):
+                    content_hash = await _run_sync(file_content_hash, file_path)
+                    cache_upload(streamed['parts'], file_type, url=data['url'], format_id=format_id,
+                                 content_hash=content_hash)
+                uploaded_files.append(file_path)
+                continue
+            
+            # Update processing message
+            await edit(f"<b>Uploading:</b> {os.path.basename(file_path)}\n\n<i>Please wait...</i>")
             
+            await _upload_file(
+                processor, bot, chat_id, file_info, file_type, job.user_id,
+                url=data['url'] if len(result['files']) == 1 else None,
+                format_id=format_id,
+                resume=resume if len(result['files']) == 1 else None
+            )
+            
+            # Add file to cleanup list
+            uploaded_files.append(file_path)
+        
+        # Clean up downloaded files after successful upload
+        for file_path in uploaded_files:
             try:
-                # Initialize URL processor
-                processor = URLProcessor()
-                
-                # Create a unique download directory
-                download_dir = os.path.join(
-                    "./DOWNLOADS", 
-                    f"{int(time.time())}"
-                )
-                os.makedirs(download_dir, exist_ok=True)
-                
-                # Download with selected format
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                
-                # Start download in background
-                download_task = loop.create_task(
-                    processor._download_with_ytdlp(url, download_dir, custom_caption, format_id)
-                )
-                
-                # Store task for possible cancellation
-                task_id = f"task_{user_id}_{int(time.time())}"
-                active_tasks[task_id] = {
-                    'task': download_task,
-                    'loop': loop,
-                    'status': 'downloading',
-                    'user_id': user_id,
-                    'chat_id': update.effective_chat.id,
-                    'message_id': query.message.message_id
-                }
-                
-                # Update progress while downloading
-                last_update = time.time()
-                while not download_task.done():
-                    # Only update UI every 3 seconds to avoid flooding
-                    if time.time() - last_update > 3:
-                        try:
-                            # Get current progress from logs
-                            progress_text = "<b>Downloading:</b> {}".format(formats_info.get('title', 'Video'))
-                            progress_text += "\n\n<b>Format:</b> {} ({})".format(format_id, file_type)
-                            
-                            # Get progress from processor if available
-                            if hasattr(processor, 'download_progress') and processor.download_progress:
-                                for filename, progress in processor.download_progress.items():
-                                    percent = progress.get('percent', 0)
-                                    speed = progress.get('speed', 0)
-                                    eta = progress.get('eta', 0)
-                                    
-                                    # Format progress information
-                                    progress_text += f"\n\n<i>Downloaded: {percent:.1f}%</i>"
-                                    if speed > 0:
-                                        speed_text = f"{speed / 1024 / 1024:.1f} MB/s"
-                                        progress_text += f"\n<i>Speed: {speed_text}</i>"
-                                    if eta > 0:
-                                        progress_text += f"\n<i>ETA: {eta} seconds</i>"
-                            else:
-                                progress_text += "\n\n<i>Downloading... Please wait.</i>"
-                                progress_text += "\n\n⏳ Progress will update every few seconds"
-                            
-                            # Create cancel button
-                            cancel_button = InlineKeyboardButton(
-                                "❌ Cancel Download", 
-                                callback_data=f"cancel_{user_id}_{task_id}"
-                            )
-                            keyboard = [[cancel_button]]
-                            reply_markup = InlineKeyboardMarkup(keyboard)
-                            
-                            # Update message with current progress and cancel button
-                            query.edit_message_text(
-                                progress_text,
-                                parse_mode='HTML',
-                                reply_markup=reply_markup
-                            )
-                            last_update = time.time()
-                        except Exception as e:
-                            logging.error(f"Error updating progress: {e}")
-                    
-                    # Sleep briefly to avoid CPU hogging
-                    loop.run_until_complete(asyncio.sleep(0.5))
-                
-                # Clean up task tracking
-                if task_id in active_tasks:
-                    del active_tasks[task_id]
-                
-                # Get download result (if not cancelled)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                    logging.info(f"Deleted uploaded file: {file_path}")
+            except Exception as e:
+                logging.warning(f"Failed to delete file {file_path}: {e}")
+        
+        # Final success message
+        await edit(
+            f"<b>✅ Successfully processed URL!</b>\n\n{len(result['files'])} file(s) uploaded.\n<i>Files cleaned up to save space.</i>"
+        )
+        
+    except asyncio.CancelledError:
+        await edit("<b>❌ Download cancelled by user.</b>")
+        raise
+    except Exception as e:
+        # Handle errors
+        await edit(f"<b>❌ Error processing URL:</b> {str(e)}")
+    finally:
+        # Clean up task tracking
+        active_tasks.pop(task_id, None)
+        if job_state is not None:
+            job_state.remove()
+        # Whatever the outcome, nothing in the job directory is needed anymore
+        workspaces.release(download_dir)
+
+async def _run_playlist_job(job):
+    """Download a playlist and upload every entry as soon as it is done"""
+    data = job.data
+    bot = data['bot']
+    chat_id = data['chat_id']
+    message_id = data['message_id']
+    format_id = data['format_id']
+    file_type = data['file_type']
+    title = data['title']
+    task_id = job.job_id
+    download_dir = None
+    entries = None
+    
+    async def edit(text, reply_markup=None):
+        try:
+            # Progress edits yield to uploads, and only the newest queued one is sent
+            await bot_calls.edit(
+                bot,
+                chat_id=chat_id,
+                message_id=message_id,
+                text=text,
+                parse_mode='HTML',
+                reply_markup=reply_markup
+            )
+        except Exception as e:
+            logging.error(f"Error updating message: {e}")
+    
+    cancel_button = InlineKeyboardButton(
+        "❌ Cancel Download", 
+        callback_data=f"cancel_{job.user_id}_{task_id}"
+    )
+    cancel_markup = InlineKeyboardMarkup([[cancel_button]])
+    
+    await edit(f"<b>Downloading playlist:</b> {title}\n\n<i>Fetching entries...</i>", cancel_markup)
+    
+    try:
+        processor = URLProcessor()
+        download_dir = workspaces.create(task_id)
+        disk_ledger.attach(task_id, download_dir)
+        done = 0
+        failed = 0
+        count = 0
+        entries = processor.download_playlist(
+            data['url'], download_dir, data['custom_caption'], format_id, user_id=job.user_id
+        )
+        async for entry in entries:
+            count = entry['count']
+            if 'error' in entry:
+                failed += 1
+            else:
+                # Upload this entry while the next ones keep downloading
                 try:
-                    if not download_task.cancelled():
-                        result = download_task.result()
-                    else:
-                        # Task was cancelled
-                        loop.close()
-                        return
-                except asyncio.CancelledError:
-                    # Task was cancelled
-                    loop.close()
-                    return
+                    for file_info in entry['files']:
+                        await _upload_file(
+                            processor, bot, chat_id, file_info, file_type, job.user_id,
+                            url=entry['url'], format_id=format_id
+                        )
+                        os.remove(file_info['file_path'])
+                    done += 1
                 except Exception as e:
-                    # Task failed
-                    query.edit_message_text(
-                        f"<b>❌ Error during download:</b> {str(e)}",
-                        parse_mode='HTML'
-                    )
-                    loop.close()
-                    return
-                
-                loop.close()
-                
-                if not result or not result.get('files'):
-                    return query.edit_message_text(
-                        "<b>❌ Failed to download file.</b>",
-                        parse_mode='HTML'
-                    )
-                
-                # Upload each file
-                uploaded_files = []  # Track files for cleanup
-                for file_info in result['files']:
-                    file_path = file_info['file_path']
-                    caption = file_info['caption']
-                    
-                    # Update processing message
-                    query.edit_message_text(
-                        f"<b>Uploading:</b> {os.path.basename(file_path)}\n\n<i>Please wait...</i>",
-                        parse_mode='HTML'
-                    )
-                    
-                    # Check if file needs splitting
-                    if file_info['needs_splitting']:
-                        # Run async function in sync context
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                        chunks = loop.run_until_complete(processor.split_large_file(file_path))
-                        loop.close()
-                        
-                        # Upload each chunk
-                        chunk_files = []  # Track chunk files for cleanup
-                        for i, chunk_path in enumerate(chunks):
-                            chunk_caption = f"{caption} (Part {i+1}/{len(chunks)})"
-                            
-                            # Send file based on type
-                            if file_type == 'video' and file_path.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.flv')):
-                                with open(chunk_path, 'rb') as file:
-                                    context.bot.send_video(
-                                        chat_id=update.effective_chat.id,
-                                        video=file,
-                                        caption=chunk_caption,
-                                        parse_mode='HTML',
-                                        supports_streaming=True
-                                    )
-                            else:
-                                with open(chunk_path, 'rb') as file:
-                                    context.bot.send_document(
-                                        chat_id=update.effective_chat.id,
-                                        document=file,
-                                        caption=chunk_caption,
-                                        parse_mode='HTML'
-                                    )
-                            
-                            # Add chunk to cleanup list
-                            chunk_files.append(chunk_path)
-                        
-                        # Clean up chunk files after upload
-                        for chunk_path in chunk_files:
-                            try:
-                                if os.path.exists(chunk_path):
-                                    os.remove(chunk_path)
-                                    print(f"Deleted chunk file: {chunk_path}")
-                            except Exception as e:
-                                print(f"Failed to delete chunk file {chunk_path}: {e}")
-                        
-                        # Clean up split directory if empty
-                        try:
-                            split_dir = os.path.dirname(chunk_files[0]) if chunk_files else None
-                            if split_dir and os.path.exists(split_dir) and not os.listdir(split_dir):
-                                os.rmdir(split_dir)
-                                print(f"Deleted empty split directory: {split_dir}")
-                        except Exception as e:
-                            print(f"Failed to delete split directory: {e}")
-                    else:
-                        # Send file based on type
-                        if file_type == 'video' and file_path.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.flv')):
-                            with open(file_path, 'rb') as file:
-                                context.bot.send_video(
-                                    chat_id=update.effective_chat.id,
-                                    video=file,
-                                    caption=caption,
-                                    parse_mode='HTML',
-                                    supports_streaming=True
-                                )
-                        else:
-                            with open(file_path, 'rb') as file:
-                                context.bot.send_document(
-                                    chat_id=update.effective_chat.id,
-                                    document=file,
-                                    caption=caption,
-                                    parse_mode='HTML'
-                                )
-                    
-                    # Add file to cleanup list
-                    uploaded_files.append(file_path)
-                
-                # Clean up downloaded files after successful upload
-                for file_path in uploaded_files:
-                    try:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                            print(f"Deleted uploaded file: {file_path}")
-                    except Exception as e:
-                        print(f"Failed to delete file {file_path}: {e}")
-                
-                # Clean up download directories if empty
-                download_dirs = set()
-                for file_path in uploaded_files:
-                    download_dir = os.path.dirname(file_path)
-                    if download_dir:
-                        download_dirs.add(download_dir)
-                
-                for download_dir in download_dirs:
-                    try:
-                        if os.path.exists(download_dir) and not os.listdir(download_dir):
-                            os.rmdir(download_dir)
-                            print(f"Deleted empty download directory: {download_dir}")
-                    except Exception as e:
-                        print(f"Failed to delete directory {download_dir}: {e}")
-                
-                # Final success message
-                query.edit_message_text(
-                    f"<b>✅ Successfully processed URL!</b>\n\n{len(result['files'])} file(s) uploaded.\n<i>Files cleaned up to save space.</i>",
+                    logging.error(f"Failed to upload playlist entry {entry['id']}: {e}")
+                    failed += 1
+            
+            await edit(
+                f"<b>Downloading playlist:</b> {title}\n\n" +
+                f"<i>{done + failed}/{count} entries processed, {failed} failed</i>",
+                cancel_markup
+            )
+        
+        if not count:
+            await edit("<b>❌ The playlist has no entries.</b>")
+            return
+        await edit(
+            f"<b>✅ Playlist processed!</b>\n\n{done} of {count} entries uploaded." +
+            (f"\n<i>{failed} entries could not be downloaded.</i>" if failed else "")
+        )
+    
+    except asyncio.CancelledError:
+        await edit("<b>❌ Download cancelled by user.</b>")
+        raise
+    except Exception as e:
+        await edit(f"<b>❌ Error processing playlist:</b> {str(e)}")
+    finally:
+        # Stop the entries still downloading before removing their files
+        if entries is not None:
+            await entries.aclose()
+        active_tasks.pop(task_id, None)
+        workspaces.release(download_dir)
+
+async def _upload_file(processor, bot, chat_id, file_info, file_type, user_id, url=None, format_id=None,
+                       resume=None):
+    """
+    Upload one downloaded file, split into parts if it is too large
+    
+    The file is re-sent by file_id if identical content was uploaded
+    before, and its file_ids are remembered for the next time.
+    
+    Args:
+        processor (URLProcessor): Processor that downloaded the file
+        file_info (dict): File entry of a download result
+        url (str, optional): URL the file_ids are cached under
+        format_id (str, optional): Format the file_ids are cached under
+        resume (dict, optional): A cached send of this file that failed
+            partway, see _delivered_parts
+    """
+    file_path = file_info['file_path']
+    caption = file_info['caption']
+    
+    # Identical content may already be on Telegram under another URL
+    content_hash = await _run_sync(file_content_hash, file_path)
+    cached = get_cached_by_hash(content_hash, file_type)
+    if cached:
+        sent = await _send_cached(bot, chat_id, cached, caption)
+        if sent == len(cached['parts']):
+            return
+        if sent:
+            resume = {'parts': cached['parts'], 'sent': sent}
+    
+    sent_parts = []
+    # Check if file needs splitting
+    video_parts = None
+    if file_info['needs_splitting'] and file_type == 'video':
+        video_parts = await processor.split_video(file_path)
+    
+    if video_parts:
+        # Upload playable parts cut on keyframes
+        delivered = _delivered_parts(resume, len(video_parts))
+        sent_parts.extend(delivered)
+        try:
+            for i, part_path in enumerate(video_parts[len(delivered):], len(delivered)):
+                chunk_caption = f"{caption} (Part {i+1}/{len(video_parts)})"
+                message = await _send_file(bot, chat_id, part_path, chunk_caption, file_type, user_id=user_id)
+                sent_parts.append(_sent_file_ref(message))
+                os.remove(part_path)
+        finally:
+            shutil.rmtree(os.path.dirname(video_parts[0]), ignore_errors=True)
+    elif file_info['needs_splitting']:
+        # Upload each part straight from its offset in the file
+        windows = processor.split_windows(file_path)
+        delivered = _delivered_parts(resume, len(windows))
+        sent_parts.extend(delivered)
+        try:
+            for i, window in enumerate(windows[len(delivered):], len(delivered)):
+                chunk_caption = f"{caption} (Part {i+1}/{len(windows)})"
+                message = await _send_file(bot, chat_id, window, chunk_caption, file_type, file_path, user_id)
+                sent_parts.append(_sent_file_ref(message))
+        finally:
+            for window in windows:
+                window.close()
+    else:
+        message = await _send_file(bot, chat_id, file_path, caption, file_type, user_id=user_id)
+        sent_parts.append(_sent_file_ref(message))
+    
+    # Remember the file_ids so repeated requests skip download and upload
+    if all(sent_parts):
+        cache_upload(sent_parts, file_type, url=url, format_id=format_id, content_hash=content_hash)
+
+def resume_pending_jobs(bot, download_location="./DOWNLOADS"):
+    """
+    Re-queue download jobs that were interrupted by a restart
+    
+    Args:
+        bot: Bot used to report progress and upload the files
+        download_location (str): Directory holding the job directories
+        
+    Returns:
+        int: Number of resumed jobs
+    """
+    resumed = 0
+    for job_state in JobState.find_all(download_location):
+        record = job_state.data
+        if 'job_id' not in record or not job_state.claim():
+            continue
+        data = {key: record.get(key) for key in JOB_RECORD_FIELDS}
+        data['bot'] = bot
+        data['download_dir'] = job_state.download_dir
+        # Keep the janitor away from the directory while the job waits
+        workspaces.adopt(job_state.download_dir)
+        try:
+            _submit_job(record['user_id'], _run_download_job, data, job_id=record['job_id'])
+        except QueueFullError:
+            # The refused job was discarded, along with its directory
+            break
+        resumed += 1
+    if resumed:
+        logging.info(f"Resumed {resumed} interrupted download(s)")
+    return resumed
+
+def _sent_file_ref(message):
+    """Extract the reusable file_id from a sent video/document message"""
+    if getattr(message, 'video', None):
+        return {'file_id': message.video.file_id, 'kind': 'video'}
+    if getattr(message, 'document', None):
+        return {'file_id': message.document.file_id, 'kind': 'document'}
+    return None
+
+async def _send_cached(bot, chat_id, entry, caption):
+    """
+    Re-send a previously uploaded file by its Telegram file_id
+    
+    Returns:
+        int: Number of parts sent, from the first; fewer than all means the
+        cache entry was stale (it is invalidated so the caller falls back to
+        a fresh upload of the remaining parts)
+    """
+    parts = entry['parts']
+    i = 0
+    try:
+        for i, part in enumerate(parts):
+            part_caption = caption if len(parts) == 1 else f"{caption} (Part {i+1}/{len(parts)})"
+            if part['kind'] == 'video':
+                await _bot_call(
+                    bot.send_video,
+                    chat_id=chat_id,
+                    video=part['file_id'],
+                    caption=part_caption,
+                    parse_mode='HTML',
+                    supports_streaming=True
+                )
+            else:
+                await _bot_call(
+                    bot.send_document,
+                    chat_id=chat_id,
+                    document=part['file_id'],
+                    caption=part_caption,
                     parse_mode='HTML'
                 )
-                
-                # Clean up user data
-                if user_id in user_data:
-                    del user_data[user_id]
-                
-            except Exception as e:
-                # Handle errors
-                query.edit_message_text(
-                    f"<b>❌ Error processing URL:</b> {str(e)}",
+        return len(parts)
+    except Exception as e:
+        logging.warning(f"Cached file_id send failed at part {i+1}/{len(parts)}, invalidating: {e}")
+        invalidate_upload(entry)
+        return i
+
+def _delivered_parts(resume, count):
+    """
+    Parts of a count-part upload that a failed cached send already delivered
+    
+    Args:
+        resume (dict): {'parts', 'sent'}: the cached parts and how many of
+            them were sent before the send failed
+        count (int): Number of parts of the fresh upload
+    
+    Returns:
+        list: The file refs of the delivered parts, from the first; empty
+        if the fresh upload is split differently
+    """
+    if not resume or len(resume['parts']) != count:
+        return []
+    return resume['parts'][:resume['sent']]
+
+async def _send_file(bot, chat_id, path, caption, file_type, source_path=None, user_id=None):
+    """
+    Upload a file as a video or a document depending on the selected type
+    
+    path may also be an open file object, e.g. a FileWindow over one part
+    of a larger file; source_path then supplies the original file name.
+    Reads are throttled to user_id's share of the upload bandwidth.
+    """
+    source_path = source_path or getattr(path, 'name', path)
+    file = path if hasattr(path, 'read') else open(path, 'rb')
+    flow = bandwidth.open_flow(user_id, 'upload') if bandwidth.enabled else None
+    if flow is not None:
+        file = ThrottledReader(file, flow)
+    # Send file based on type
+    try:
+        with file:
+            if file_type == 'video' and source_path.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.flv')):
+                return await _bot_call(
+                    bot.send_video,
+                    chat_id=chat_id,
+                    video=file,
+                    caption=caption,
+                    parse_mode='HTML',
+                    supports_streaming=True
+                )
+            else:
+                return await _bot_call(
+                    bot.send_document,
+                    chat_id=chat_id,
+                    document=file,
+                    caption=caption,
                     parse_mode='HTML'
                 )
-                return
+    finally:
+        if flow is not None:
+            flow.close()
\ No newline at end of file
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk state of download jobs, used to resume them after a restart.
+
+Each job keeps a small JSON file in its download directory with the request
+(URL, format, chat, ...) and the downloader's progress (completed byte
+ranges or fragments), written atomically so a crash never leaves it torn.
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = "job.json"
+# Locked by the process that owns the job; the lock goes away with it
+CLAIM_FILENAME = ".claim"
+
+# Open claim files of this process by job directory
+_claims = {}
+_claims_lock = threading.Lock()
+# Minimum seconds between two progress checkpoints of the same job
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", 2))
+
+
+class JobState:
+    """Persistent state of a single download job"""
+
+    def __init__(self, download_dir, data=None):
+        """
+        Initialize the state
+
+        Args:
+            download_dir (str): The job's download directory
+            data (dict, optional): JSON-serializable job fields
+        """
+        self.download_dir = download_dir
+        self.path = os.path.join(download_dir, STATE_FILENAME)
+        self.data = data or {}
+        self._lock = threading.Lock()
+        self._last_checkpoint = 0.0
+
+    @classmethod
+    def load(cls, download_dir):
+        """Load the state of a download directory, or None if it has none"""
+        path = os.path.join(download_dir, STATE_FILENAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(download_dir, json.load(f))
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            logger.warning(f"Ignoring unreadable job state {path}: {e}")
+            return None
+
+    @classmethod
+    def find_all(cls, download_location):
+        """Return the states of all job directories under download_location"""
+        states = []
+        if not os.path.isdir(download_location):
+            return states
+        for name in sorted(os.listdir(download_location)):
+            download_dir = os.path.join(download_location, name)
+            if os.path.isdir(download_dir):
+                state = cls.load(download_dir)
+                if state is not None:
+                    states.append(state)
+        return states
+
+    @property
+    def progress(self):
+        """Downloader progress recorded by the last checkpoint"""
+        return self.data.get('progress') or {}
+
+    def claim(self):
+        """
+        Take ownership of the job for this process
+
+        Ownership is an exclusive lock on the claim file, so two processes
+        resuming at the same time cannot both get the job. It is kept until
+        the job's state is removed or the process ends.
+
+        Returns:
+            bool: False if another process already owns the job
+        """
+        key = os.path.abspath(self.download_dir)
+        with _claims_lock:
+            if key in _claims:
+                return True
+            fd = os.open(os.path.join(self.download_dir, CLAIM_FILENAME), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            _claims[key] = fd
+        self.update(pid=os.getpid())
+        return True
+
+    def save(self):
+        """Write the state atomically"""
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f)
+            os.replace(tmp_path, self.path)
+
+    def update(self, **fields):
+        """Set fields and save"""
+        self.data.update(fields)
+        self.save()
+
+    def checkpoint(self, progress, force=False):
+        """
+        Record downloader progress, at most once per CHECKPOINT_INTERVAL
+
+        Args:
+            progress (dict): JSON-serializable progress of the downloader
+            force (bool): Save even if the last checkpoint is recent
+        """
+        now = time.time()
+        if not force and now - self._last_checkpoint < CHECKPOINT_INTERVAL:
+            return
+        self._last_checkpoint = now
+        self.data['progress'] = progress
+        try:
+            self.save()
+        except OSError as e:
+            logger.warning(f"Could not checkpoint job state: {e}")
+
+    def remove(self):
+        """Delete the state file (the job is finished or abandoned)"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        with _claims_lock:
+            fd = _claims.pop(os.path.abspath(self.download_dir), None)
+        if fd is not None:
+            os.close(fd)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
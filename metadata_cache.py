@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+In-process cache for yt-dlp extraction results
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from utils import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of cached extractions and how long they stay valid (seconds)
+METADATA_CACHE_SIZE = int(os.environ.get("METADATA_CACHE_SIZE", 256))
+METADATA_CACHE_TTL = int(os.environ.get("METADATA_CACHE_TTL", 600))
+
+
+class MetadataCache:
+    """
+    Thread-safe LRU cache with a size cap and per-entry TTL.
+
+    Keys are canonicalized URLs, so youtu.be links, tracking parameters and
+    the like all resolve to the same entry.
+    """
+
+    def __init__(self, maxsize=METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL):
+        """
+        Initialize the cache
+
+        Args:
+            maxsize (int): Maximum number of entries kept
+            ttl (float): Seconds an entry stays valid
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, url):
+        """
+        Look up a URL
+
+        Returns:
+            The cached value, or None on a miss or an expired entry
+        """
+        key = canonicalize_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, url, value, ttl=None):
+        """Store a value for a URL, evicting the least recently used entries"""
+        if self.maxsize <= 0:
+            return
+        key = canonicalize_url(url)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, url):
+        """Drop the entry for a URL if present"""
+        with self._lock:
+            self._entries.pop(canonicalize_url(url), None)
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return hit/miss counters and occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            }
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Publish/subscribe channels for download progress.
+
+Downloaders publish yt-dlp style progress dicts into a per-job channel from
+their worker threads, as often as they like. Subscribers receive coalesced
+snapshots with smoothed speed and ETA, at most one per interval and only
+when something changed, which keeps progress display cheap.
+"""
+
+import math
+import time
+import asyncio
+import logging
+import threading
+
+from utils import safe_float, safe_int
+
+logger = logging.getLogger(__name__)
+
+# Time constant (seconds) of the exponential moving average of the speed
+SPEED_SMOOTHING = 5.0
+
+
+class ProgressChannel:
+    """Latest progress of one job, updated from any thread"""
+
+    def __init__(self, key):
+        self.key = key
+        self.closed = False
+        self.version = 0
+        self._lock = threading.Lock()
+        self._files = {}
+        self._speed = None
+        self._last_bytes = None
+        self._last_time = None
+        self._started_at = time.time()
+        self._latest = {}
+
+    def publish(self, d):
+        """Record a yt-dlp style progress dict"""
+        now = time.time()
+        with self._lock:
+            filename = d.get('filename') or ''
+            self._files[filename] = {
+                'downloaded': safe_int(d.get('downloaded_bytes')),
+                'total': safe_int(d.get('total_bytes') or d.get('total_bytes_estimate')),
+            }
+            downloaded = sum(f['downloaded'] for f in self._files.values())
+            total = sum(f['total'] for f in self._files.values())
+
+            # Smooth the speed over SPEED_SMOOTHING seconds, weighting each
+            # sample by the time it covers
+            if self._last_time is not None and now > self._last_time:
+                dt = now - self._last_time
+                instant = max(0, downloaded - self._last_bytes) / dt
+                alpha = 1 - math.exp(-dt / SPEED_SMOOTHING)
+                self._speed = instant if self._speed is None else self._speed + alpha * (instant - self._speed)
+            elif self._speed is None and safe_float(d.get('speed')) > 0:
+                self._speed = safe_float(d.get('speed'))
+            self._last_bytes = downloaded
+            self._last_time = now
+
+            speed = self._speed or 0
+            self._latest = {
+                'status': d.get('status'),
+                'filename': filename,
+                'downloaded': downloaded,
+                'total': total,
+                'percent': downloaded / total * 100 if total > 0 else 0,
+                'speed': speed,
+                'eta': int((total - downloaded) / speed) if total > downloaded and speed > 0 else 0,
+                'fragment_index': d.get('fragment_index'),
+                'fragment_count': d.get('fragment_count'),
+                'elapsed': now - self._started_at,
+            }
+            self.version += 1
+
+    def snapshot(self):
+        """Return a copy of the latest progress"""
+        with self._lock:
+            return dict(self._latest)
+
+    def close(self):
+        self.closed = True
+
+
+class ProgressBus:
+    """Registry of progress channels by job"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def channel(self, key):
+        """Get or create the channel of a job"""
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None or channel.closed:
+                channel = self._channels[key] = ProgressChannel(key)
+            return channel
+
+    def publish(self, key, d):
+        self.channel(key).publish(d)
+
+    def close(self, key):
+        """End a job's channel, which also ends its subscriptions"""
+        with self._lock:
+            channel = self._channels.pop(key, None)
+        if channel is not None:
+            channel.close()
+
+    async def subscribe(self, key, interval=3.0):
+        """
+        Iterate over coalesced snapshots of a job's progress
+
+        Subscribing never opens a channel: if the job has none (it already
+        finished), the subscription ends at once.
+
+        Args:
+            key: Job the progress belongs to
+            interval (float): Minimum seconds between two snapshots
+
+        Yields:
+            dict: Progress snapshot, only when it changed since the last one
+        """
+        with self._lock:
+            channel = self._channels.get(key)
+        if channel is None:
+            return
+        seen = 0
+        while True:
+            if channel.version != seen:
+                seen = channel.version
+                yield channel.snapshot()
+            if channel.closed:
+                return
+            await asyncio.sleep(interval)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-connection downloader for direct file links.
+
+Splits the file into byte ranges fetched over parallel HTTP Range requests
+and written in place into a preallocated file. Servers without Range
+support fall back to a single streamed request.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import concurrent.futures
+from urllib.parse import urlsplit, unquote
+
+from startup import lazy_import
+
+# Loaded on first use
+requests = lazy_import("requests")
+
+logger = logging.getLogger(__name__)
+
+# Number of parallel connections per download
+SEGMENT_CONNECTIONS = int(os.environ.get("SEGMENT_CONNECTIONS", 8))
+# Files smaller than this are not split into segments
+MIN_SEGMENT_SIZE = int(os.environ.get("MIN_SEGMENT_SIZE", 4 * 1024 * 1024))
+# Files are cut into ranges no larger than this, fetched roughly front to
+# back, so the completed prefix of the file grows steadily
+MAX_SEGMENT_SIZE = int(os.environ.get("MAX_SEGMENT_SIZE", 64 * 1024 * 1024))
+# Attempts per segment before the download fails
+SEGMENT_RETRIES = int(os.environ.get("SEGMENT_RETRIES", 5))
+# Read size for streamed responses
+STREAM_CHUNK_SIZE = 256 * 1024
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                  '(KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+}
+
+
+class DownloadCancelled(Exception):
+    """Raised inside the downloader when the cancel event is set"""
+
+
+class SegmentedDownloader:
+    """
+    Download a single URL over several parallel Range connections.
+
+    Progress is reported through yt-dlp style hooks, i.e. callables receiving
+    dicts with 'status', 'filename', 'downloaded_bytes', 'total_bytes',
+    'speed' and 'eta', so the same hook can serve both downloaders. The extra
+    'contiguous_bytes' field is the length of the completed prefix of the file.
+    """
+
+    def __init__(self, connections=SEGMENT_CONNECTIONS, min_segment_size=MIN_SEGMENT_SIZE,
+                 retries=SEGMENT_RETRIES, timeout=30, headers=None,
+                 progress_hooks=None, cancel_event=None, session=None):
+        """
+        Initialize the downloader
+
+        Args:
+            connections (int): Maximum number of parallel connections
+            min_segment_size (int): Smallest byte range given to a connection
+            retries (int): Attempts per segment before giving up
+            timeout (float): Connect/read timeout per request in seconds
+            headers (dict, optional): Extra request headers
+            progress_hooks (list, optional): yt-dlp style progress callables
+            cancel_event (threading.Event, optional): Aborts the download when set
+            session (requests.Session, optional): Session to send the requests
+                with, e.g. one going through a proxy
+        """
+        self.connections = max(1, connections)
+        self.min_segment_size = max(1, min_segment_size)
+        self.retries = max(1, retries)
+        self.timeout = timeout
+        self.headers = dict(DEFAULT_HEADERS, **(headers or {}))
+        self.progress_hooks = progress_hooks or []
+        self.cancel_event = cancel_event or threading.Event()
+        # Set internally when one segment fails, to stop its siblings
+        self._abort = threading.Event()
+        self._session = session or requests.Session()
+        self._lock = threading.Lock()
+        self._downloaded = 0
+        # Bytes already on disk from an earlier run, left out of the speed
+        self._resumed = 0
+        self._started_at = None
+        self._checkpoint = None
+
+    def probe(self, url):
+        """
+        Find out size, Range support and file name of a URL
+
+        Returns:
+            dict: {'url', 'size', 'accept_ranges', 'filename', 'content_type'}
+        """
+        response = self._session.get(
+            url, headers=dict(self.headers, Range='bytes=0-0'),
+            stream=True, timeout=self.timeout, allow_redirects=True
+        )
+        try:
+            response.raise_for_status()
+            size = None
+            accept_ranges = response.status_code == 206
+            if accept_ranges:
+                # Content-Range: bytes 0-0/12345
+                match = re.search(r'/(\d+)$', response.headers.get('Content-Range', ''))
+                size = int(match.group(1)) if match else None
+                accept_ranges = size is not None
+            elif response.headers.get('Content-Length'):
+                size = int(response.headers['Content-Length'])
+            return {
+                'url': response.url,
+                'size': size,
+                'accept_ranges': accept_ranges,
+                'filename': _filename_from_response(response),
+                'content_type': response.headers.get('Content-Type', ''),
+            }
+        finally:
+            response.close()
+
+    def download(self, url, dest_path, probe=None, resume=None, checkpoint=None):
+        """
+        Download url to dest_path
+
+        The data is written to dest_path + '.part' and renamed on success.
+
+        Args:
+            url (str): URL to download
+            dest_path (str): Final path of the file
+            probe (dict, optional): Result of probe() if already available
+            resume (dict, optional): Progress saved by a previous checkpoint;
+                completed byte ranges of the .part file are not fetched again
+            checkpoint (callable, optional): Called as checkpoint(progress)
+                with JSON-serializable progress while segments complete
+
+        Returns:
+            str: dest_path
+        """
+        probe = probe or self.probe(url)
+        url = probe['url']
+        size = probe['size']
+        part_path = dest_path + '.part'
+        self._downloaded = 0
+        self._resumed = 0
+        self._started_at = time.time()
+        self._abort.clear()
+        self._checkpoint = checkpoint
+
+        if probe['accept_ranges'] and size and size >= 2 * self.min_segment_size:
+            segments = self._resume_segments(resume, part_path, size)
+            if segments is None:
+                segments = self._plan_segments(size)
+                with open(part_path, 'wb') as f:
+                    _preallocate(f.fileno(), size)
+            else:
+                logger.info(f"Resuming {part_path} at {self._downloaded}/{size} bytes")
+            logger.info(f"Downloading {url} in {len(segments)} segments")
+            self._download_segments(url, part_path, size, segments)
+        else:
+            logger.info(f"Downloading {url} over a single connection")
+            self._download_stream(url, part_path, size)
+
+        os.replace(part_path, dest_path)
+        self._report('finished', dest_path, size or self._downloaded)
+        return dest_path
+
+    def _plan_segments(self, size):
+        """Split [0, size) into ordered [start, end, offset] ranges"""
+        step = max(self.min_segment_size, min(-(-size // self.connections), MAX_SEGMENT_SIZE))
+        return [[start, min(start + step, size) - 1, start] for start in range(0, size, step)]
+
+    def _resume_segments(self, resume, part_path, size):
+        """Return the saved segments if they belong to this .part file, else None"""
+        if not resume or resume.get('kind') != 'segmented' or resume.get('size') != size:
+            return None
+        if not os.path.exists(part_path) or os.path.getsize(part_path) != size:
+            return None
+        segments = [list(segment) for segment in resume.get('segments') or []]
+        if not segments:
+            return None
+        self._downloaded = self._resumed = sum(offset - start for start, end, offset in segments)
+        return segments
+
+    def _save_progress(self, size, segments, force=False):
+        if self._checkpoint is None:
+            return
+        with self._lock:
+            snapshot = [list(segment) for segment in segments]
+        self._checkpoint({'kind': 'segmented', 'size': size, 'segments': snapshot}, force)
+
+    def _download_segments(self, url, part_path, size, segments):
+        fd = os.open(part_path, os.O_WRONLY)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(self.connections, len(segments)), thread_name_prefix="segment"
+            ) as pool:
+                futures = [
+                    pool.submit(self._fetch_segment, url, fd, part_path, segment, size, segments)
+                    for segment in segments if segment[2] <= segment[1]
+                ]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        future.result()
+                except BaseException:
+                    # Stop the remaining segments before propagating
+                    self._abort.set()
+                    raise
+                finally:
+                    self._save_progress(size, segments, force=True)
+        finally:
+            os.close(fd)
+
+    def _fetch_segment(self, url, fd, part_path, segment, total, segments):
+        """Fetch segment [start, end] into fd, resuming from the last written offset on retry"""
+        start, end, offset = segment
+        for attempt in range(1, self.retries + 1):
+            try:
+                headers = dict(self.headers, Range=f'bytes={offset}-{end}')
+                with self._session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code != 206:
+                        raise IOError(f"Server ignored Range request (HTTP {response.status_code})")
+                    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                        self._check_cancelled()
+                        chunk = chunk[:end + 1 - offset]
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                        with self._lock:
+                            segment[2] = offset
+                        self._advance(len(chunk), part_path, total, segments)
+                        self._save_progress(total, segments)
+                        if offset > end:
+                            break
+                if offset > end:
+                    return
+                raise IOError(f"Segment {start}-{end} ended early at {offset}")
+            except DownloadCancelled:
+                raise
+            except (requests.RequestException, IOError) as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Segment {start}-{end} failed (attempt {attempt}): {e}")
+                time.sleep(min(2 ** attempt, 30))
+
+    def _download_stream(self, url, part_path, size):
+        """Plain single-connection download, restarting from zero on retry"""
+        for attempt in range(1, self.retries + 1):
+            try:
+                with self._session.get(url, headers=self.headers, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    with open(part_path, 'wb') as f:
+                        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                            self._check_cancelled()
+                            f.write(chunk)
+                            self._advance(len(chunk), part_path, size)
+                return
+            except DownloadCancelled:
+                raise
+            except (requests.RequestException, IOError) as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Download failed (attempt {attempt}): {e}")
+                with self._lock:
+                    self._downloaded = 0
+                time.sleep(min(2 ** attempt, 30))
+
+    def _check_cancelled(self):
+        if self.cancel_event.is_set() or self._abort.is_set():
+            raise DownloadCancelled("Download cancelled")
+
+    def _advance(self, nbytes, filename, total, segments=None):
+        with self._lock:
+            self._downloaded += nbytes
+            downloaded = self._downloaded
+            if segments is None:
+                # Single stream: everything written so far is contiguous
+                contiguous = downloaded
+            else:
+                # Ranges are contiguous, so the prefix ends at the write
+                # offset of the first unfinished range
+                contiguous = next((offset for start, end, offset in segments if offset <= end), total)
+        self._report('downloading', filename, total, downloaded, contiguous)
+
+    def _report(self, status, filename, total, downloaded=None, contiguous=None):
+        downloaded = total if downloaded is None else downloaded
+        elapsed = max(time.time() - (self._started_at or time.time()), 1e-6)
+        speed = max(downloaded - self._resumed, 0) / elapsed
+        d = {
+            'status': status,
+            'filename': filename,
+            'downloaded_bytes': downloaded,
+            'contiguous_bytes': downloaded if contiguous is None else contiguous,
+            'total_bytes': total,
+            'elapsed': elapsed,
+            'speed': speed,
+            'eta': int((total - downloaded) / speed) if total and speed else None,
+        }
+        for hook in self.progress_hooks:
+            hook(d)
+
+
+def _preallocate(fd, size):
+    """Reserve size bytes for fd (falls back to a sparse file where unsupported)"""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+def _filename_from_response(response):
+    """Guess a file name from Content-Disposition or the final URL path"""
+    disposition = response.headers.get('Content-Disposition', '')
+    match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", disposition, re.I) or \
+        re.search(r'filename="?([^";]+)"?', disposition, re.I)
+    if match:
+        name = unquote(match.group(1).strip())
+    else:
+        name = unquote(os.path.basename(urlsplit(response.url).path))
+    name = re.sub(r'[\\/*?:"<>|\x00-\x1f]', '_', name).strip(' .')
+    return name or 'download'
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bounded store for format selection sessions.
+
+Every URL a user sends opens a session that the format buttons refer to by
+a short id in their callback_data, so a user can have several selections
+open at once. Sessions hold only the few fields a button press needs, not
+the whole format list, and are dropped when idle for longer than the TTL,
+when the store is full (least recently used first), or when a user opens
+more than SESSIONS_PER_USER of them.
+"""
+
+import os
+import sys
+import time
+import secrets
+import logging
+import threading
+from collections import OrderedDict
+
+from utils import safe_int
+
+logger = logging.getLogger(__name__)
+
+# Seconds a session stays usable after it was last touched
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 3600))
+# Most sessions kept in total, and per user
+SESSION_MAX = int(os.environ.get("SESSION_MAX", 2000))
+SESSIONS_PER_USER = int(os.environ.get("SESSIONS_PER_USER", 5))
+# Longest format id put in callback_data as is: 64 bytes minus
+# "fmt_<session id>_" and "_video"
+CALLBACK_FORMAT_ID_MAX = 64 - len("fmt_12345678_") - len("_video")
+
+
+def compact_formats_info(formats_info):
+    """
+    Project the result of get_available_formats onto what a button press needs
+
+    Telegram rejects a keyboard whose callback_data exceeds 64 bytes, so the
+    best fit selector (two joined format ids) and overly long format ids are
+    given short aliases for the buttons to carry instead.
+
+    Args:
+        formats_info (dict): Result of URLProcessor.get_available_formats
+
+    Returns:
+        dict: {'title', 'playlist_count', 'sizes', 'aliases'}, where sizes
+        maps every format_id a button can select (including the best fit
+        selector) to its known or estimated size in bytes, and aliases maps
+        a short button key ('*' for the best fit, '~<n>' for long ids) to
+        the format_id
+    """
+    sizes = {
+        str(f['format_id']): safe_int(f.get('size_estimate'))
+        for f in formats_info.get('formats', []) if f.get('format_id')
+    }
+    aliases = {
+        f"~{i}": format_id
+        for i, format_id in enumerate(f for f in sizes if len(f.encode()) > CALLBACK_FORMAT_ID_MAX)
+    }
+    best_fit = formats_info.get('best_fit')
+    if best_fit:
+        sizes[best_fit['format_id']] = safe_int(best_fit.get('size'))
+        aliases['*'] = best_fit['format_id']
+    return {
+        'title': formats_info.get('title', 'Video'),
+        'playlist_count': formats_info.get('playlist_count', 0),
+        'sizes': sizes,
+        'aliases': aliases,
+    }
+
+
+def button_format_id(session, format_id):
+    """The key a button carries for format_id: its alias, or the id itself"""
+    return next((key for key, value in session['aliases'].items() if value == format_id and key != '*'), format_id)
+
+
+def _deep_size(obj):
+    """Approximate bytes held by a session: dicts, lists and scalars"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(k) + _deep_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_deep_size(item) for item in obj)
+    return size
+
+
+class SessionStore:
+    """
+    Thread-safe LRU of sessions with an idle TTL and a per-user cap.
+
+    Every access refreshes a session's expiry and moves it to the end, so
+    the entries are ordered by expiry and expired ones are always at the
+    front.
+    """
+
+    def __init__(self, maxsize=SESSION_MAX, ttl=SESSION_TTL, per_user=SESSIONS_PER_USER):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.per_user = per_user
+        self._lock = threading.Lock()
+        # session_id -> (expires_at, user_id, size, data)
+        self._entries = OrderedDict()
+        # user_id -> session ids, oldest first
+        self._by_user = {}
+        self.bytes = 0
+        self.created = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def create(self, user_id, data):
+        """
+        Open a session
+
+        Args:
+            user_id (int): Telegram user the session belongs to
+            data (dict): Compact session data, e.g. url, caption and the
+                projection from compact_formats_info
+
+        Returns:
+            str: Session id, 8 hex characters, safe to put in callback_data
+        """
+        size = _deep_size(data)
+        with self._lock:
+            self._purge_expired()
+            session_id = secrets.token_hex(4)
+            while session_id in self._entries:
+                session_id = secrets.token_hex(4)
+            self._entries[session_id] = (time.time() + self.ttl, user_id, size, data)
+            self._by_user.setdefault(user_id, []).append(session_id)
+            self.bytes += size
+            self.created += 1
+            while len(self._by_user[user_id]) > self.per_user:
+                self._remove(self._by_user[user_id][0])
+                self.evictions += 1
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return session_id
+
+    def get(self, session_id):
+        """
+        Look up a live session and refresh its TTL
+
+        Returns:
+            tuple: (user_id, data), or None if it expired or never existed
+        """
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            expires_at, user_id, size, data = entry
+            self._entries[session_id] = (time.time() + self.ttl, user_id, size, data)
+            self._entries.move_to_end(session_id)
+            return user_id, data
+
+    def pop(self, session_id):
+        """Close a session once its selection was made"""
+        with self._lock:
+            if session_id in self._entries:
+                self._remove(session_id)
+
+    def _remove(self, session_id):
+        _, user_id, size, _ = self._entries.pop(session_id)
+        self.bytes -= size
+        sessions = self._by_user[user_id]
+        sessions.remove(session_id)
+        if not sessions:
+            del self._by_user[user_id]
+
+    def _purge_expired(self):
+        now = time.time()
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if entry[0] > now:
+                break
+            self._remove(session_id)
+            self.expired += 1
+
+    def stats(self):
+        """Return occupancy, approximate memory use and eviction counters"""
+        with self._lock:
+            self._purge_expired()
+            return {
+                'sessions': len(self._entries),
+                'users': len(self._by_user),
+                'maxsize': self.maxsize,
+                'bytes': self.bytes,
+                'created': self.created,
+                'expired': self.expired,
+                'evictions': self.evictions,
+            }
+
+
+# Shared store for the format selection buttons
+sessions = SessionStore()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup cost helpers: lazy module imports and an import-time profiler.
+
+Heavy third-party modules (yt-dlp, requests) are registered with
+lazy_import() and only executed when one of their attributes is first
+used, so a process that only answers a /start never pays for them. The
+entry points run their imports under an ImportProfiler, which logs the
+startup time and, when the startup goes over its budget or STARTUP_PROFILE
+is set, the modules that took longest to import.
+
+This module must only import the standard library.
+"""
+
+import os
+import sys
+import time
+import logging
+import builtins
+import threading
+import importlib
+import importlib.util
+
+logger = logging.getLogger(__name__)
+
+# Seconds the startup may take before the slowest imports are logged
+STARTUP_BUDGET = float(os.environ.get("STARTUP_BUDGET", 1.5))
+# Always log the per-module import times
+STARTUP_PROFILE = bool(os.environ.get("STARTUP_PROFILE", False))
+
+
+# Serializes the first load of lazily imported modules across threads
+_lazy_lock = threading.Lock()
+
+
+class _LazyModule:
+    """Stand-in that imports the real module on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            # importlib.util.LazyLoader is not thread-safe: threads racing
+            # on the first access could see a half-initialized module
+            with _lazy_lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded yet"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Import a module on first attribute access instead of now
+
+    The first access imports the module under a lock, so threads touching
+    it at the same time all wait for the complete module.
+
+    Args:
+        name (str): Absolute module name, e.g. "yt_dlp"
+
+    Returns:
+        module: The module if it was imported before, otherwise a stand-in
+        that loads it; None if it is not installed
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if importlib.util.find_spec(name) is None:
+        return None
+    return _LazyModule(name)
+
+
+class ImportProfiler:
+    """Measure the startup, and how long every module imported during it takes"""
+
+    def __init__(self):
+        # module -> [seconds including its own imports, seconds excluding them]
+        self.timings = {}
+        self.elapsed = 0
+        self._stack = []
+        self._thread = None
+        self._original_import = None
+        self._started = None
+
+    def start(self):
+        self._thread = threading.get_ident()
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+        self._started = time.perf_counter()
+        return self
+
+    def stop(self):
+        self.elapsed = time.perf_counter() - self._started
+        builtins.__import__ = self._original_import
+        return self
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module_name = name
+        if level and globals:
+            package = globals.get('__package__') or ''
+            module_name = importlib.util.resolve_name('.' * level + name, package) if name else package
+        if module_name in sys.modules or threading.get_ident() != self._thread:
+            return self._original_import(name, globals, locals, fromlist, level)
+        started = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            timing = self.timings.setdefault(module_name, [0.0, 0.0])
+            timing[0] += elapsed
+            timing[1] += elapsed - nested
+
+    def report(self, limit=15):
+        """
+        Format the slowest imports
+
+        Returns:
+            str: One line per module: total ms, self ms and its name
+        """
+        slowest = sorted(self.timings.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        lines = [f"Startup took {self.elapsed * 1000:.0f} ms, slowest imports (total / self ms):"]
+        lines += [f"{total * 1000:8.1f} {own * 1000:8.1f}  {name}" for name, (total, own) in slowest]
+        return "\n".join(lines)
+
+    def log_report(self, budget=STARTUP_BUDGET):
+        """Log the startup time, with the slowest modules if over budget"""
+        if STARTUP_PROFILE or self.elapsed > budget:
+            if self.elapsed > budget:
+                logger.warning(f"Startup took {self.elapsed:.2f}s, over the {budget}s budget")
+            logger.info(self.report())
+        else:
+            logger.info(f"Startup took {self.elapsed:.2f}s")
@@ -0,0 +1,144 @@
+"""
+Shared fixtures: a local HTTP server the download engines can be run
+against, and a forwarding HTTP proxy for the egress routes.
+"""
+
+import os
+import re
+import sys
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+
+# The bot's modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class LocalServer:
+    """
+    Serve in-memory files, with or without Range support
+
+    Every request is recorded as (method, path, Range header) in requests.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests.append(('GET', self.path, self.headers.get('Range')))
+                entry = server.files.get(self.path)
+                if entry is None:
+                    self.send_error(404)
+                    return
+                body, ranges, delay = entry
+                time.sleep(delay)
+                match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range') or '')
+                if ranges and match:
+                    start = int(match.group(1))
+                    end = int(match.group(2)) if match.group(2) else len(body) - 1
+                    end = min(end, len(body) - 1)
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+                    body = body[start:end + 1]
+                else:
+                    self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def add(self, path, body, ranges=True, delay=0):
+        """Serve body at path, answering Range requests only if ranges is set, after delay seconds"""
+        self.files[path] = (body if isinstance(body, bytes) else body.encode(), ranges, delay)
+        return self.base_url + path
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    local = LocalServer()
+    yield local
+    local.close()
+
+
+class ForwardingProxy:
+    """
+    Plain HTTP forwarding proxy
+
+    Every proxied request is recorded as its absolute URL in requests.
+    """
+
+    def __init__(self):
+        self.requests = []
+        # Straight to the target, whatever HTTP(S)_PROXY says
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                proxy.requests.append(self.path)
+                request = urllib.request.Request(self.path)
+                if self.headers.get('Range'):
+                    request.add_header('Range', self.headers['Range'])
+                try:
+                    response = opener.open(request, timeout=5)
+                except urllib.error.HTTPError as e:
+                    response = e
+                body = response.read()
+                self.send_response(response.status)
+                for name in ('Content-Range', 'Content-Type'):
+                    if response.headers.get(name):
+                        self.send_header(name, response.headers[name])
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def proxy():
+    local = ForwardingProxy()
+    yield local
+    local.close()
+
+
+@pytest.fixture
+def refused_proxy_url():
+    """URL of a proxy that refuses connections: a port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+import requests
+
+from egress import EgressPool, Route, _domain
+
+URL = "https://www.example.com/video"
+
+
+def _pool(count=3, **kwargs):
+    # Proxy stand-ins: acquire() and run() never connect by themselves
+    routes = [Route(proxy=f"http://proxy{i}.test:8080") for i in range(count)]
+    return EgressPool(routes, cooldown=60, max_cooldown=600, **kwargs), routes
+
+
+class Throttled(Exception):
+    def __init__(self):
+        super().__init__("HTTP Error 429: Too Many Requests")
+
+
+def test_prefer_and_exclude():
+    pool, routes = _pool()
+    lease = pool.acquire(URL, prefer=routes[2].name)
+    assert lease.route is routes[2]
+    lease.close()
+
+    lease = pool.acquire(URL, exclude={routes[0], routes[1]})
+    assert lease.route is routes[2]
+    lease.close()
+
+    # Excluding everything still hands out a route
+    lease = pool.acquire(URL, exclude=set(routes))
+    assert lease.route in routes
+    lease.close()
+
+
+def test_throttled_route_cools_down_for_its_site_only():
+    pool, routes = _pool(2)
+    lease = pool.acquire(URL, prefer=routes[0].name)
+    lease.fail(throttled=True)
+
+    # Avoided for the site, even when preferred
+    for _ in range(10):
+        lease = pool.acquire("https://cdn.example.com/x", prefer=routes[0].name)
+        assert lease.route is routes[1]
+        lease.close()
+    # Other sites are unaffected
+    lease = pool.acquire("https://other.test/", prefer=routes[0].name)
+    assert lease.route is routes[0]
+    lease.close()
+
+    stats = pool.stats()
+    assert stats[routes[0].name]['sites']['example.com']['cooling_for'] > 0
+
+
+def test_cooldown_doubles_and_recovers_first_route_when_all_cool():
+    pool, routes = _pool(2)
+    for route in routes:
+        pool.acquire(URL, prefer=route.name).fail(throttled=True)
+    # routes[0] fails again, so it cools down for longer
+    pool.acquire(URL, exclude={routes[1]}).fail(throttled=True)
+    health = pool._health
+    assert health[(routes[0], 'example.com')].cooldown_until > health[(routes[1], 'example.com')].cooldown_until
+
+    lease = pool.acquire(URL)
+    assert lease.route is routes[1]
+    lease.close()
+
+
+def test_plain_failure_cools_down_from_the_second_one():
+    pool, routes = _pool(2)
+    pool.acquire(URL, prefer=routes[0].name).fail()
+    assert pool.acquire(URL, prefer=routes[0].name).route is routes[0]
+
+
+def test_run_retries_throttled_call_on_another_route():
+    pool, routes = _pool(2)
+    tried = []
+
+    async def fetch(route):
+        tried.append(route)
+        if len(tried) == 1:
+            raise Throttled()
+        return b"data"
+
+    result = asyncio.run(pool.run(URL, fetch, measure=len, prefer=routes[0].name))
+    assert result == b"data"
+    assert tried == [routes[0], routes[1]]
+    assert all(info['in_use'] == 0 for info in pool.stats().values())
+
+
+def test_run_gives_up_when_every_route_is_throttled():
+    pool, routes = _pool(2)
+    tried = []
+
+    async def fetch(route):
+        tried.append(route)
+        raise Throttled()
+
+    with pytest.raises(Throttled):
+        asyncio.run(pool.run(URL, fetch))
+    assert sorted(tried, key=routes.index) == routes
+
+
+def test_run_does_not_retry_other_errors():
+    pool, routes = _pool(2)
+    tried = []
+
+    async def fetch(route):
+        tried.append(route)
+        raise ValueError("not a throttle")
+
+    with pytest.raises(ValueError):
+        asyncio.run(pool.run(URL, fetch))
+    assert len(tried) == 1
+
+
+def test_session_goes_through_the_proxy(server, proxy):
+    url = server.add('/video.mp4', b'data')
+    route = Route(proxy=proxy.url)
+
+    assert route.session().get(url, timeout=5).content == b'data'
+    assert proxy.requests == [url]
+
+
+def test_refused_route_is_marked_unhealthy(server, proxy, refused_proxy_url):
+    url = server.add('/video.mp4', b'data')
+    refused, working = Route(proxy=refused_proxy_url), Route(proxy=proxy.url)
+    pool = EgressPool([refused, working], cooldown=60, max_cooldown=600)
+
+    async def fetch(route):
+        return route.session().get(url, timeout=5).content
+
+    # A refused connection is no throttle, so it is not retried elsewhere,
+    # but it lowers the route's score and a repeated one cools it down
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            asyncio.run(pool.run(url, fetch, prefer=refused.name))
+    site = pool.stats()[refused.name]['sites']['127.0.0.1']
+    assert site['score'] < 0.5 and site['cooling_for'] > 0
+
+    # Even when asked for, the refused route is now avoided
+    assert asyncio.run(pool.run(url, fetch, measure=len, prefer=refused.name)) == b'data'
+    assert proxy.requests == [url]
+    assert pool.stats()[working.name]['sites']['127.0.0.1']['score'] == 1.0
+
+
+@pytest.mark.parametrize("url, domain", [
+    ("https://www.youtube.com/watch?v=x", "youtube.com"),
+    ("https://rr3---sn-abc.googlevideo.com/videoplayback", "googlevideo.com"),
+    ("https://www.bbc.co.uk/iplayer", "bbc.co.uk"),
+    ("https://media.abc.net.au/a.mp4", "abc.net.au"),
+    ("https://m.vk.com/video", "vk.com"),
+    ("https://www.spiegel.de/video", "spiegel.de"),
+    ("http://127.0.0.1:8765/a.mp4", "127.0.0.1"),
+])
+def test_domain_groups_subdomains_of_a_site(url, domain):
+    assert _domain(url) == domain
@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+from fragment_downloader import HLSDownloader
+
+KEY = bytes(range(16))
+
+
+def _fragments(count=5):
+    return [bytes([i]) * (1000 + 37 * i) for i in range(count)]
+
+
+def _media_playlist(server, fragments, prefix='', delays=None):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4']
+    for i, data in enumerate(fragments):
+        server.add(f'{prefix}/seg{i}.ts', data, delay=(delays or {}).get(i, 0))
+        lines += ['#EXTINF:4.0,', f'seg{i}.ts']
+    lines.append('#EXT-X-ENDLIST')
+    return server.add(f'{prefix}/media.m3u8', '\n'.join(lines))
+
+
+def _fragment_requests(server):
+    return [path for method, path, r in server.requests if path.endswith('.ts')]
+
+
+def test_plain_fragments(server, tmp_path):
+    fragments = _fragments()
+    url = _media_playlist(server, fragments)
+    hooks = []
+    dest = str(tmp_path / 'out.ts')
+
+    HLSDownloader(concurrency=3, window=3, retries=1, timeout=5, progress_hooks=[hooks.append]).download(url, dest)
+
+    with open(dest, 'rb') as f:
+        assert f.read() == b''.join(fragments)
+    assert not os.path.exists(dest + '.part')
+    assert hooks[-1]['status'] == 'finished'
+    assert hooks[-1]['downloaded_bytes'] == sum(map(len, fragments))
+
+
+def test_fragments_finishing_out_of_order_stay_within_the_window(server, tmp_path):
+    fragments = _fragments(8)
+    # The first fragment arrives last among those in flight
+    url = _media_playlist(server, fragments, delays={0: 0.3})
+    requested_at_first_write = []
+
+    def hook(d):
+        if d['status'] == 'downloading' and not requested_at_first_write:
+            requested_at_first_write.append(len(_fragment_requests(server)))
+
+    dest = str(tmp_path / 'out.ts')
+    HLSDownloader(concurrency=3, window=3, retries=1, timeout=5, progress_hooks=[hook]).download(url, dest)
+
+    with open(dest, 'rb') as f:
+        assert f.read() == b''.join(fragments)
+    # Nothing past the window was fetched while the first fragment was missing
+    assert requested_at_first_write == [3]
+
+
+def test_resume_from_checkpoint(server, tmp_path):
+    fragments = _fragments()
+    url = _media_playlist(server, fragments)
+    dest = str(tmp_path / 'out.ts')
+
+    # A previous run appended two fragments and part of a third after its
+    # last checkpoint
+    done = b''.join(fragments[:2])
+    with open(dest + '.part', 'wb') as f:
+        f.write(done + fragments[2][:100])
+    resume = {'kind': 'hls', 'fragment_count': len(fragments), 'fragments_done': 2, 'bytes_written': len(done)}
+
+    hooks = []
+    checkpoints = []
+    HLSDownloader(concurrency=2, window=2, retries=1, timeout=5, progress_hooks=[hooks.append]).download(
+        url, dest, resume=resume, checkpoint=lambda progress, force=False: checkpoints.append(progress))
+
+    with open(dest, 'rb') as f:
+        assert f.read() == b''.join(fragments)
+    assert sorted(_fragment_requests(server)) == ['/seg2.ts', '/seg3.ts', '/seg4.ts']
+    assert checkpoints[-1]['fragments_done'] == len(fragments)
+    # The speed only counts the bytes fetched in this run
+    d = hooks[-1]
+    assert d['speed'] * d['elapsed'] == pytest.approx(sum(map(len, fragments)) - len(done))
+
+
+def test_master_playlist_to_aes_media_playlist(server, tmp_path):
+    aes = pytest.importorskip("yt_dlp.aes")
+
+    def encrypt(data, iv):
+        # PKCS#7 padding, as HLS segments are encrypted with
+        pad = 16 - len(data) % 16
+        return aes.aes_cbc_encrypt_bytes(data + bytes([pad]) * pad, KEY, iv)
+
+    fragments = _fragments()
+    sequence = 10
+    explicit_iv = bytes(range(100, 116))
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:4', f'#EXT-X-MEDIA-SEQUENCE:{sequence}',
+             '#EXT-X-KEY:METHOD=AES-128,URI="key.bin"']
+    for i, data in enumerate(fragments):
+        if i == 3:
+            # From here on the IV is given explicitly instead of the sequence number
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="key.bin",IV=0x{explicit_iv.hex()}')
+        iv = explicit_iv if i >= 3 else (sequence + i).to_bytes(16, 'big')
+        server.add(f'/hi/seg{i}.ts', encrypt(data, iv))
+        lines += ['#EXTINF:4.0,', f'seg{i}.ts']
+    lines.append('#EXT-X-ENDLIST')
+    server.add('/hi/media.m3u8', '\n'.join(lines))
+    server.add('/hi/key.bin', KEY)
+    # The low variant must not be picked
+    server.add('/lo/media.m3u8', '#EXTM3U\n#EXTINF:4.0,\nseg0.ts\n#EXT-X-ENDLIST\n')
+    master = server.add('/master.m3u8', '\n'.join([
+        '#EXTM3U',
+        '#EXT-X-STREAM-INF:BANDWIDTH=500000', 'lo/media.m3u8',
+        '#EXT-X-STREAM-INF:BANDWIDTH=2000000', 'hi/media.m3u8',
+    ]))
+
+    hooks = []
+    downloader = HLSDownloader(concurrency=3, window=3, retries=1, timeout=5, progress_hooks=[hooks.append])
+    playlist = downloader.load(master)
+    assert playlist['url'].endswith('/hi/media.m3u8')
+    assert len(playlist['fragments']) == len(fragments)
+
+    dest = str(tmp_path / 'out.ts')
+    downloader.download(master, dest, playlist)
+
+    with open(dest, 'rb') as f:
+        assert f.read() == b''.join(fragments)
+    assert hooks[-1]['status'] == 'finished'
+    assert hooks[-1]['fragment_index'] == len(fragments)
+    # The key is fetched once for all fragments
+    assert sum(1 for method, path, r in server.requests if path == '/hi/key.bin') == 1
@@ -0,0 +1,31 @@
+import asyncio
+
+from progress_bus import ProgressBus
+
+
+async def _collect(bus, key):
+    return [snapshot async for snapshot in bus.subscribe(key, interval=0.01)]
+
+
+def test_subscription_ends_with_the_channel():
+    bus = ProgressBus()
+    channel = bus.channel('job')
+    channel.publish({'status': 'downloading', 'filename': 'a', 'downloaded_bytes': 50, 'total_bytes': 100})
+
+    async def run():
+        task = asyncio.ensure_future(_collect(bus, 'job'))
+        await asyncio.sleep(0.05)
+        bus.close('job')
+        return await task
+
+    snapshots = asyncio.run(run())
+    assert snapshots[0]['percent'] == 50
+
+
+def test_late_subscriber_does_not_reopen_a_closed_channel():
+    bus = ProgressBus()
+    bus.channel('job')
+    bus.close('job')
+
+    assert asyncio.run(_collect(bus, 'job')) == []
+    assert bus._channels == {}
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+
+from segmented_downloader import SegmentedDownloader
+
+SIZE = 1024 * 1024 + 123
+
+
+def _payload(size=SIZE):
+    return bytes(i * 7 % 251 for i in range(size))
+
+
+def _downloader(**kwargs):
+    return SegmentedDownloader(connections=4, min_segment_size=64 * 1024, retries=1, timeout=5, **kwargs)
+
+
+def test_segmented_download_with_ranges(server, tmp_path):
+    body = _payload()
+    url = server.add('/ranged.bin', body)
+    hooks = []
+    dest = str(tmp_path / 'out.bin')
+
+    downloader = _downloader(progress_hooks=[hooks.append])
+    probe = downloader.probe(url)
+    assert probe['accept_ranges'] and probe['size'] == SIZE
+    assert downloader.download(url, dest, probe) == dest
+
+    with open(dest, 'rb') as f:
+        assert f.read() == body
+    assert not os.path.exists(dest + '.part')
+    # Several connections were used
+    ranged = [r for method, path, r in server.requests if r and r != 'bytes=0-0']
+    assert len(ranged) > 1
+    assert hooks[-1]['status'] == 'finished' and hooks[-1]['downloaded_bytes'] == SIZE
+
+
+def test_download_without_range_support(server, tmp_path):
+    body = _payload()
+    url = server.add('/plain.bin', body, ranges=False)
+    dest = str(tmp_path / 'out.bin')
+
+    downloader = _downloader()
+    probe = downloader.probe(url)
+    assert not probe['accept_ranges'] and probe['size'] == SIZE
+    downloader.download(url, dest, probe)
+
+    with open(dest, 'rb') as f:
+        assert f.read() == body
+
+
+def test_resume_from_checkpoint(server, tmp_path):
+    body = _payload()
+    url = server.add('/resume.bin', body)
+    dest = str(tmp_path / 'out.bin')
+
+    # A previous run finished the first segment and half of the second
+    downloader = _downloader()
+    segments = downloader._plan_segments(SIZE)
+    assert len(segments) > 2
+    first, second = segments[0], segments[1]
+    first[2] = first[1] + 1
+    second[2] = second[0] + (second[1] - second[0]) // 2
+    part = bytearray(SIZE)
+    part[first[0]:first[2]] = body[first[0]:first[2]]
+    part[second[0]:second[2]] = body[second[0]:second[2]]
+    with open(dest + '.part', 'wb') as f:
+        f.write(part)
+    resume = {'kind': 'segmented', 'size': SIZE, 'segments': segments}
+
+    checkpoints = []
+    hooks = []
+    server.requests.clear()
+    downloader = _downloader(progress_hooks=[hooks.append])
+    downloader.download(url, dest, resume=resume, checkpoint=lambda progress, force=False: checkpoints.append(progress))
+
+    with open(dest, 'rb') as f:
+        assert f.read() == body
+    requested = [r for method, path, r in server.requests if r and r != 'bytes=0-0']
+    # The finished segment was not fetched again, the half one continued
+    assert not any(r.startswith(f'bytes={first[0]}-') for r in requested)
+    assert f'bytes={second[2]}-{second[1]}' in requested
+    # The last checkpoint has every segment complete
+    assert all(offset == end + 1 for start, end, offset in checkpoints[-1]['segments'])
+    # The speed only counts the bytes fetched in this run
+    resumed = first[2] - first[0] + second[2] - second[0]
+    d = hooks[-1]
+    assert d['speed'] * d['elapsed'] == pytest.approx(SIZE - resumed)
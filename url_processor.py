@@ -2,16 +2,39 @@
 # -*- coding: utf-8 -*-
 # Standalone URL processor module
 
+import io
 import os
 import re
 import time
 import logging
 import asyncio
-import yt_dlp
+import threading
+import functools
+import contextvars
+import multiprocessing
+import concurrent.futures
+import copy
 import tempfile
 import shutil
+import calendar
+import subprocess
 from pathlib import Path
-from utils import safe_float, safe_int, safe_compare_greater, sanitize_formats_list, format_file_size
+from urllib.parse import urlsplit, parse_qs
+from startup import lazy_import
+from utils import safe_float, safe_int, safe_compare_greater, sanitize_formats_list
+from format_index import FormatIndex, probe_sizes
+from metadata_cache import MetadataCache
+from workspace import WorkspaceManager, workspaces
+from bandwidth import bandwidth
+from progress_bus import ProgressBus
+from egress import egress
+from ydl_pool import ydl_pool, with_cache_dir, preload_extractors
+from segmented_downloader import SegmentedDownloader
+from fragment_downloader import HLSDownloader, UnsupportedPlaylist, HLS_CONCURRENCY, FRAGMENT_RETRIES
+
+# Loaded on first use, most updates never need them
+yt_dlp = lazy_import("yt_dlp")
+requests = lazy_import("requests")
 
 # Configure logging
 logging.basicConfig(
@@ -24,17 +47,427 @@ logger = logging.getLogger(__name__)
 MAX_FILE_SIZE = 2040108421  # ~2GB (Telegram limit)
 DOWNLOAD_LOCATION = "./DOWNLOADS"
 
+# Executor used for yt-dlp metadata extraction: "thread" or "process"
+EXTRACTOR_EXECUTOR = os.environ.get("EXTRACTOR_EXECUTOR", "thread")
+EXTRACTOR_WORKERS = int(os.environ.get("EXTRACTOR_WORKERS", 4))
+# Number of yt-dlp downloads that may run in background threads at once
+DOWNLOAD_THREADS = int(os.environ.get("DOWNLOAD_THREADS", 4))
+# Maximum age (in seconds) of a listing-step extraction reused for a download
+INFO_REUSE_MAX_AGE = int(os.environ.get("INFO_REUSE_MAX_AGE", 900))
+# Timeouts (in seconds) for a single extraction / download call
+EXTRACT_TIMEOUT = int(os.environ.get("EXTRACT_TIMEOUT", 60))
+DOWNLOAD_TIMEOUT = int(os.environ.get("DOWNLOAD_TIMEOUT", 3600))
+# Seconds a cancelled download is given to stop writing before its files
+# are removed anyway
+CANCEL_GRACE = 30
+# Playlist entries downloaded at the same time, and the most entries taken
+PLAYLIST_CONCURRENCY = int(os.environ.get("PLAYLIST_CONCURRENCY", 3))
+PLAYLIST_MAX_ENTRIES = int(os.environ.get("PLAYLIST_MAX_ENTRIES", 50))
+# Number of ffmpeg processes cutting parts of one video at once
+SPLIT_WORKERS = int(os.environ.get("SPLIT_WORKERS", os.cpu_count() or 2))
+
+# File extensions served as plain files, downloaded without yt-dlp
+DIRECT_LINK_EXTENSIONS = (
+    '.mp4', '.mkv', '.avi', '.mov', '.flv', '.webm', '.m4v', '.ts',
+    '.mp3', '.m4a', '.flac', '.wav', '.ogg',
+    '.zip', '.rar', '.7z', '.tar', '.gz', '.iso', '.apk', '.exe', '.pdf',
+)
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+# Bandwidth flow and progress channel of the download running in the
+# current task, read by the progress hooks so every downloader is
+# throttled and reported the same way
+_current_flow = contextvars.ContextVar('bandwidth_flow', default=None)
+_current_channel = contextvars.ContextVar('progress_channel', default=None)
+
+def _get_executor(kind):
+    """
+    Get (or lazily create) a shared executor for blocking yt-dlp calls
+    
+    Args:
+        kind (str): "extract" for metadata extraction, "download" for
+            downloads, "split" for ffmpeg video splitting
+        
+    Returns:
+        concurrent.futures.Executor: The shared executor
+    """
+    with _executors_lock:
+        if kind not in _executors:
+            if kind == "extract" and EXTRACTOR_EXECUTOR == "process":
+                # spawn avoids forking a process that holds running threads
+                _executors[kind] = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=EXTRACTOR_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=preload_extractors
+                )
+            elif kind == "extract":
+                _executors[kind] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=EXTRACTOR_WORKERS, thread_name_prefix="ytdlp-extract"
+                )
+            elif kind == "split":
+                _executors[kind] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=SPLIT_WORKERS, thread_name_prefix="ffmpeg-split"
+                )
+            else:
+                _executors[kind] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=DOWNLOAD_THREADS, thread_name_prefix="ytdlp-download"
+                )
+        return _executors[kind]
+
+def _extract_info(url, ydl_opts):
+    """
+    Run a blocking yt-dlp extraction (module level so it can run in a process pool)
+    
+    The YoutubeDL is borrowed from the warm pool of the running process.
+    
+    Returns:
+        dict: Sanitized (picklable) info dict
+    """
+    with ydl_pool.instance(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        return ydl.sanitize_info(info)
+
+def _download_info(url, ydl_opts, info=None):
+    """
+    Run a blocking yt-dlp download and return the info dict
+    
+    Args:
+        url (str): The URL to download
+        ydl_opts (dict): yt-dlp options
+        info (dict, optional): Previously extracted info dict; when given the
+            download resolves formats from it instead of re-extracting the URL
+    """
+    # Progress hooks are per download, so the instance cannot be pooled
+    with yt_dlp.YoutubeDL(with_cache_dir(ydl_opts)) as ydl:
+        if info is not None:
+            return ydl.process_ie_result(info, download=True)
+        return ydl.extract_info(url, download=True)
+
+class FileWindow(io.RawIOBase):
+    """
+    Read-only file object over the byte range [offset, offset + length) of a file
+    
+    Lets a part of a large file be uploaded straight from the original
+    without writing it out as a separate chunk file.
+    """
+    
+    def __init__(self, path, offset, length, name=None, fd=None):
+        """
+        Initialize the window
+        
+        Args:
+            path (str): File to read from
+            offset (int): First byte of the window
+            length (int): Number of bytes in the window
+            name (str, optional): File name reported to uploaders
+            fd (int, optional): Descriptor of the file, duplicated so the
+                window stays readable if the file is renamed meanwhile
+        """
+        super().__init__()
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.name = name or os.path.basename(path)
+        self._fd = os.dup(fd) if fd is not None else None
+        self._pos = 0
+    
+    def _fileno(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY)
+        return self._fd
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self._pos
+    
+    def seek(self, pos, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.length}[whence]
+        self._pos = max(0, base + pos)
+        return self._pos
+    
+    def readinto(self, buffer):
+        size = min(len(buffer), self.length - self._pos)
+        if size <= 0:
+            return 0
+        data = os.pread(self._fileno(), size, self.offset + self._pos)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+    
+    def readall(self):
+        # One pread for the rest of the window instead of many small reads
+        chunks = []
+        while self._pos < self.length:
+            data = os.pread(self._fileno(), self.length - self._pos, self.offset + self._pos)
+            if not data:
+                break
+            chunks.append(data)
+            self._pos += len(data)
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+    
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        super().close()
+
+def _copy_range(fd, dest_path, offset, length, block_size=64 * 1024 * 1024):
+    """
+    Copy length bytes starting at offset from fd into a new file
+    
+    The copy is done in the kernel with copy_file_range() or sendfile()
+    where available, so the data never passes through Python buffers.
+    """
+    with open(dest_path, 'wb') as out:
+        out_fd = out.fileno()
+        while length > 0:
+            count = min(block_size, length)
+            try:
+                if hasattr(os, 'copy_file_range'):
+                    copied = os.copy_file_range(fd, out_fd, count, offset)
+                else:
+                    copied = os.sendfile(out_fd, fd, offset, count)
+            except (AttributeError, OSError):
+                # Unsupported between these files, copy through user space
+                block = os.pread(fd, count, offset)
+                copied = os.write(out_fd, block)
+            if not copied:
+                raise IOError(f"Unexpected end of file at offset {offset}")
+            offset += copied
+            length -= copied
+    return dest_path
+
+def is_direct_link(url):
+    """Check whether a URL points straight at a file by its path extension"""
+    path = urlsplit(url).path.lower()
+    return path.endswith(DIRECT_LINK_EXTENSIONS)
+
+def is_hls_link(url):
+    """Check whether a URL points at an HLS playlist"""
+    return urlsplit(url).path.lower().endswith('.m3u8')
+
+def _remux_to_mp4(src_path, dest_path):
+    """
+    Stream-copy an MPEG-TS file into an MP4 container with ffmpeg
+    
+    Returns:
+        str: dest_path on success, src_path if ffmpeg is missing or fails
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return src_path
+    result = subprocess.run(
+        [ffmpeg, '-y', '-loglevel', 'error', '-i', src_path, '-map', '0',
+         '-c', 'copy', '-bsf:a', 'aac_adtstoasc', '-movflags', '+faststart', dest_path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        logger.warning(f"ffmpeg remux failed: {result.stderr.decode(errors='ignore')[-500:]}")
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        return src_path
+    os.remove(src_path)
+    return dest_path
+
+def video_split_available():
+    """Check whether ffmpeg and ffprobe are installed for split_video()"""
+    return bool(shutil.which('ffmpeg') and shutil.which('ffprobe'))
+
+def _keyframe_offsets(file_path):
+    """
+    List the keyframes of a video's main stream with ffprobe
+    
+    Only packet headers are read, nothing is decoded.
+    
+    Returns:
+        list: (pts_time, bytes_before) per keyframe, where bytes_before is
+        the size of all packets (of every stream) stored before it
+    """
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries',
+         'packet=codec_type,stream_index,pts_time,size,flags', '-of', 'csv=p=0', file_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise IOError(f"ffprobe failed: {result.stderr.decode(errors='ignore')[-500:]}")
+    
+    keyframes = {}
+    video_packets = {}
+    total = 0
+    for line in result.stdout.decode(errors='ignore').splitlines():
+        fields = line.split(',')
+        if len(fields) < 5:
+            continue
+        codec_type, stream_index, pts_time, size, flags = fields[:5]
+        if codec_type == 'video':
+            video_packets[stream_index] = video_packets.get(stream_index, 0) + 1
+            if 'K' in flags and pts_time != 'N/A':
+                keyframes.setdefault(stream_index, []).append((float(pts_time), total))
+        total += safe_int(size)
+    if not video_packets:
+        return []
+    # The main stream has the most packets (cover art has a single one)
+    main = max(video_packets, key=video_packets.get)
+    return sorted(keyframes.get(main, []))
+
+def _plan_video_cuts(keyframes, file_size, chunk_size):
+    """
+    Choose keyframes to cut at so that every part fits in chunk_size
+    
+    Returns:
+        list: Start times of the parts (the first is 0), or None if a single
+        keyframe interval is already too large
+    """
+    # Leave room for container headers, which grow with the part length
+    budget = int(chunk_size * 0.97) - 1024 * 1024
+    cuts = [0.0]
+    start_bytes = 0
+    previous = None
+    for pts_time, offset in keyframes + [(None, file_size)]:
+        if offset - start_bytes > budget:
+            if previous is None or previous[1] == start_bytes:
+                return None
+            cuts.append(previous[0])
+            start_bytes = previous[1]
+            if offset - start_bytes > budget:
+                return None
+        previous = (pts_time, offset)
+    return cuts
+
+def _cut_video(src_path, dest_path, start, duration=None):
+    """Stream-copy [start, start + duration) of a video into dest_path with ffmpeg"""
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-ss', f'{start:.6f}', '-i', src_path]
+    if duration is not None:
+        command += ['-t', f'{duration:.6f}']
+    command += ['-map', '0', '-dn', '-ignore_unknown', '-c', 'copy', '-avoid_negative_ts', 'make_zero']
+    if dest_path.lower().endswith(('.mp4', '.m4v', '.mov')):
+        command += ['-movflags', '+faststart']
+    result = subprocess.run(command + [dest_path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise IOError(f"ffmpeg split failed: {result.stderr.decode(errors='ignore')[-500:]}")
+    return dest_path
+
+def _info_expired(info, margin=60):
+    """
+    Check whether the media URLs in an extracted info dict are about to expire
+    
+    Looks at signed URL expiry parameters (YouTube's expire=, CloudFront's
+    Expires=, S3's X-Amz-Date/X-Amz-Expires) and at the extraction time.
+    
+    Args:
+        info (dict): Info dict returned by yt-dlp
+        margin (int): Seconds of validity required to still count as fresh
+        
+    Returns:
+        bool: True if the info dict should be re-extracted
+    """
+    now = time.time()
+    epoch = safe_float(info.get('epoch'))
+    if epoch and epoch + INFO_REUSE_MAX_AGE < now:
+        return True
+    
+    for fmt in info.get('formats') or [info]:
+        query = parse_qs(urlsplit(fmt.get('url') or '').query)
+        expires = safe_int((query.get('expire') or query.get('Expires') or [None])[0])
+        if not expires and query.get('X-Amz-Date') and query.get('X-Amz-Expires'):
+            try:
+                signed_at = calendar.timegm(time.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ'))
+                expires = signed_at + safe_int(query['X-Amz-Expires'][0])
+            except ValueError:
+                expires = 0
+        if expires and expires < now + margin:
+            return True
+    return False
+
+def _result_size(result):
+    """Bytes downloaded according to a download result, for route scoring"""
+    return sum(f.get('file_size', 0) for f in (result or {}).get('files', []))
+
+async def run_blocking(kind, func, *args, timeout=None, cancel_event=None):
+    """
+    Await a blocking call on the shared executor without blocking the event loop
+    
+    Args:
+        kind (str): Executor to use ("extract" or "download")
+        func (callable): Blocking function to call
+        *args: Arguments for func
+        timeout (float, optional): Seconds to wait before raising asyncio.TimeoutError
+        cancel_event (threading.Event, optional): Tells func to stop; when
+            given, a cancelled or timed out call is only given up once the
+            worker has stopped (or CANCEL_GRACE seconds passed), so the
+            caller can safely remove the files it was writing
+        
+    Returns:
+        The return value of func
+    """
+    loop = asyncio.get_event_loop()
+    future = loop.run_in_executor(_get_executor(kind), functools.partial(func, *args))
+    if cancel_event is None:
+        return await asyncio.wait_for(future, timeout=timeout)
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        cancel_event.set()
+        await asyncio.wait([future], timeout=CANCEL_GRACE)
+        raise
+
+class DownloadWatch:
+    """
+    Live view of a download in progress, fed by the progress hook.
+    
+    Lets a consumer start cutting and uploading parts of a large file
+    while the rest of it is still downloading.
+    """
+    
+    def __init__(self):
+        # True if the output is written in place, front to back, and is not
+        # rewritten by post-processing once the download finishes
+        self.streamable = False
+        # File currently being written and the file name it will end up with
+        self.path = None
+        self.filename = None
+        self.total = None
+        # Length of the completed prefix of the file
+        self.ready_bytes = 0
+        self.finished = False
+        self.failed = False
+    
+    def update(self, d):
+        """Record a yt-dlp style 'downloading' progress dict"""
+        self.path = d.get('tmpfilename') or d.get('filename')
+        filename = d.get('filename') or ''
+        self.filename = filename[:-len('.part')] if filename.endswith('.part') else filename
+        self.total = safe_int(d.get('total_bytes')) or self.total
+        self.ready_bytes = safe_int(d.get('contiguous_bytes', d.get('downloaded_bytes')))
+
 class URLProcessor:
     """
     Standalone URL processor that handles downloading from various sources
     and preparing files for upload to Telegram.
     """
     
+    # Extraction results shared by all processor instances
+    metadata_cache = MetadataCache()
+    # Progress of running downloads, by job
+    progress = ProgressBus()
+    
     def __init__(self, download_location=DOWNLOAD_LOCATION):
         """Initialize the URL processor"""
         self.download_location = download_location
         # Create download directory if it doesn't exist
         os.makedirs(download_location, exist_ok=True)
+        # Share the bot's leases when downloading to the same location
+        if os.path.abspath(download_location) == os.path.abspath(workspaces.root):
+            self.workspaces = workspaces
+        else:
+            self.workspaces = WorkspaceManager(download_location)
     
     async def process_url(self, url, custom_caption=None):
         """
@@ -57,19 +490,10 @@ class URLProcessor:
             logger.info(f"Extracted custom caption: {custom_caption}")
         
         # Create a unique download directory for this URL
-        download_dir = os.path.join(
-            self.download_location, 
-            f"{int(time.time())}"
-        )
-        os.makedirs(download_dir, exist_ok=True)
+        download_dir = self.workspaces.create()
         
         try:
-            # Check if it's a zoom URL
-            if "zoom.us" in url.lower():
-                return await self._process_zoom_url(url, download_dir, custom_caption)
-            
-            # Use yt-dlp for downloading
-            return await self._download_with_ytdlp(url, download_dir, custom_caption)
+            return await self.download(url, download_dir, custom_caption)
         
         except Exception as e:
             logger.error(f"Error processing URL: {e}")
@@ -77,6 +501,165 @@ class URLProcessor:
             shutil.rmtree(download_dir, ignore_errors=True)
             raise
     
+    async def download(self, url, download_dir, custom_caption=None, format_id=None, job_state=None, watch=None,
+                       user_id=None, job_id=None):
+        """
+        Download a URL with the most suitable downloader
+        
+        Direct file links go through the segmented downloader, everything
+        else (and direct links that turn out to be web pages) through yt-dlp.
+        
+        Args:
+            url (str): The URL to download
+            download_dir (str): Directory to save the downloaded file
+            custom_caption (str, optional): Custom caption for the file
+            format_id (str, optional): yt-dlp format selector to download
+            job_state (JobState, optional): Persistent state used to resume
+                an interrupted download of the same job
+            watch (DownloadWatch, optional): Receives live progress, see
+                stream_split()
+            user_id (int, optional): User the download counts against in
+                the bandwidth scheduler
+            job_id (str, optional): Progress is published on the channel of
+                this job, see URLProcessor.progress
+            
+        Returns:
+            dict: Information about the downloaded file(s)
+        """
+        flow = bandwidth.open_flow(user_id, 'download')
+        token = _current_flow.set(flow)
+        channel_token = _current_channel.set(self.progress.channel(job_id) if job_id else None)
+        try:
+            result = await self._download(url, download_dir, custom_caption, format_id, job_state, watch)
+        except BaseException:
+            if watch is not None:
+                watch.failed = True
+            raise
+        finally:
+            _current_flow.reset(token)
+            _current_channel.reset(channel_token)
+            flow.close()
+            if job_id:
+                self.progress.close(job_id)
+        if watch is not None:
+            watch.finished = True
+        return result
+    
+    async def _download(self, url, download_dir, custom_caption, format_id, job_state, watch):
+        """Pick the downloader and the egress route for a URL, see download()"""
+        if "zoom.us" in url.lower():
+            return await self._process_zoom_url(url, download_dir, custom_caption)
+        
+        if is_hls_link(url):
+            try:
+                result = await egress.run(
+                    url, lambda route: self._download_hls(url, download_dir, custom_caption, job_state, watch, route),
+                    measure=_result_size
+                )
+                if result is not None:
+                    return result
+            except (requests.RequestException, IOError) as e:
+                logger.warning(f"HLS download failed, falling back to yt-dlp: {e}")
+                if watch is not None:
+                    # Parts cut from the abandoned file no longer apply
+                    watch.failed = True
+        
+        if is_direct_link(url):
+            try:
+                result = await egress.run(
+                    url, lambda route: self._download_direct(url, download_dir, custom_caption, job_state, watch, route),
+                    measure=_result_size
+                )
+                if result is not None:
+                    return result
+            except (requests.RequestException, IOError) as e:
+                logger.warning(f"Direct download failed, falling back to yt-dlp: {e}")
+                if watch is not None:
+                    # Parts cut from the abandoned file no longer apply
+                    watch.failed = True
+        
+        # Prefer the route the formats were listed over, media URLs may be
+        # bound to its address
+        cached = self.metadata_cache.get(url) or {}
+        return await egress.run(
+            url, lambda route: self._download_with_ytdlp(url, download_dir, custom_caption, format_id,
+                                                         watch=watch, route=route),
+            measure=_result_size, prefer=cached.get('_egress')
+        )
+    
+    async def download_playlist(self, url, download_dir, custom_caption=None, format_id=None,
+                                concurrency=PLAYLIST_CONCURRENCY, user_id=None):
+        """
+        Download the entries of a playlist, several at a time
+        
+        Every entry is downloaded into its own subdirectory by download(),
+        so its files are tied to its ID no matter in which order entries
+        finish or fail. Results are yielded as soon as each entry is done.
+        
+        Args:
+            url (str): The playlist URL
+            download_dir (str): Directory to save the downloaded files
+            custom_caption (str, optional): Custom caption for the files
+            format_id (str, optional): yt-dlp format selector applied to
+                every entry, e.g. "best" or "bestaudio"
+            concurrency (int): Number of entries downloaded at once
+            user_id (int, optional): User the downloads count against
+            
+        Yields:
+            dict: {'index', 'count', 'id', 'url', 'title'} plus 'files' (as
+            in download()) for a finished entry or 'error' for a failed one
+        """
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'default_search': 'auto',
+            'extract_flat': 'in_playlist',
+            'playlistend': PLAYLIST_MAX_ENTRIES,
+        }
+        try:
+            playlist = await egress.run(url, lambda route: run_blocking(
+                "extract", _extract_info, url, dict(ydl_opts, **route.ytdl_options()), timeout=EXTRACT_TIMEOUT
+            ))
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Fetching the playlist timed out after {EXTRACT_TIMEOUT} seconds")
+        entries = [entry for entry in playlist.get('entries') or [] if entry]
+        logger.info(f"Downloading {len(entries)} playlist entries: {url}")
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        async def fetch(index, entry):
+            entry_id = str(entry.get('id') or index + 1)
+            entry_url = entry.get('url') or entry.get('webpage_url') or entry_id
+            result = {
+                'index': index,
+                'count': len(entries),
+                'id': entry_id,
+                'url': entry_url,
+                'title': entry.get('title') or entry_id,
+            }
+            entry_dir = os.path.join(download_dir, f"{index+1:03d}_{re.sub(r'[^A-Za-z0-9_-]', '_', entry_id)}")
+            async with semaphore:
+                os.makedirs(entry_dir, exist_ok=True)
+                try:
+                    downloaded = await self.download(entry_url, entry_dir, custom_caption, format_id, user_id=user_id)
+                    result['files'] = downloaded['files']
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Playlist entry {entry_id} failed: {e}")
+                    result['error'] = str(e)
+            return result
+        
+        tasks = [asyncio.ensure_future(fetch(i, entry)) for i, entry in enumerate(entries)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Wait until their workers stopped writing, the caller removes
+            # the directory next
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
     async def get_available_formats(self, url):
         """
         Get available formats for a URL without downloading
@@ -94,82 +677,82 @@ class URLProcessor:
             'quiet': True,
             'no_warnings': True,
             'default_search': 'auto',
-            'source_address': '0.0.0.0',
             'listformats': True,
+            # Download the video of a watch?v=...&list=... link like the
+            # download step does, and list playlists without resolving
+            # every entry
+            'noplaylist': True,
+            'extract_flat': 'in_playlist',
+            'playlistend': PLAYLIST_MAX_ENTRIES,
         }
         
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-            # Filter and organize formats
-            formats = []
-            if info.get('formats'):
-                # Group by resolution for video formats
-                video_formats = []
-                audio_formats = []
-                
-                for f in info.get('formats', []):
-                    format_id = f.get('format_id')
-                    ext = f.get('ext')
-                    resolution = f.get('resolution', 'N/A')
-                    filesize = f.get('filesize')
-                    # Use safe utility function for file size formatting
-                    filesize_str = format_file_size(filesize)
-                    format_note = f.get('format_note', '')
-                    vcodec = f.get('vcodec', 'none')
-                    acodec = f.get('acodec', 'none')
-                    
-                    # Skip formats without video or audio
-                    if vcodec == 'none' and acodec == 'none':
-                        continue
-                    
-                    # Create format description
-                    if vcodec != 'none':
-                        format_desc = f"{resolution} ({format_note}) [{ext}] {filesize_str}"
-                        video_formats.append({
-                            'format_id': format_id,
-                            'ext': ext,
-                            'resolution': resolution,
-                            'filesize': filesize_str,
-                            'description': format_desc,
-                            'is_video': True
-                        })
-                    elif acodec != 'none':
-                        format_desc = f"Audio {format_note} [{ext}] {filesize_str}"
-                        audio_formats.append({
-                            'format_id': format_id,
-                            'ext': ext,
-                            'resolution': 'Audio only',
-                            'filesize': filesize_str,
-                            'description': format_desc,
-                            'is_video': False
-                        })
+            info = self.metadata_cache.get(url)
+            if info is None:
+                async def extract(route):
+                    info = await run_blocking(
+                        "extract", _extract_info, url, dict(ydl_opts, **route.ytdl_options()),
+                        timeout=EXTRACT_TIMEOUT
+                    )
+                    # Remember the route, the media URLs may only work from it
+                    info['_egress'] = route.name
+                    # Exact sizes for formats the site gave none for, over
+                    # the same route
+                    session = route.session()
+                    try:
+                        await asyncio.get_event_loop().run_in_executor(
+                            None, probe_sizes, info.get('formats') or [], session
+                        )
+                    except Exception as e:
+                        logger.warning(f"Probing format sizes failed: {e}")
+                    finally:
+                        session.close()
+                    return info
+                info = await egress.run(url, extract)
+                self.metadata_cache.set(url, info)
+            else:
+                logger.info(f"Using cached formats for: {url}")
                 
-                # Sort video formats by resolution (highest first)
-                video_formats.sort(key=lambda x: x.get('resolution', ''), reverse=True)
-                formats = video_formats + audio_formats
+            # Typed index: numeric sizes and best-first orderings
+            index = FormatIndex(info.get('formats'), info.get('duration'))
             
             return {
                 'title': info.get('title', 'Unknown'),
                 'duration': info.get('duration'),
-                'formats': sanitize_formats_list(formats),
+                'is_playlist': info.get('_type') == 'playlist',
+                'playlist_count': len([e for e in info.get('entries') or [] if e]),
+                'formats': sanitize_formats_list(index.to_list()),
+                # Best format that can be uploaded without splitting
+                'best_fit': index.best_fitting(MAX_FILE_SIZE),
                 'thumbnail': info.get('thumbnail'),
                 'webpage_url': info.get('webpage_url'),
                 'uploader': info.get('uploader'),
             }
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out fetching formats after {EXTRACT_TIMEOUT}s: {url}")
+            raise TimeoutError(f"Fetching formats timed out after {EXTRACT_TIMEOUT} seconds")
         except Exception as e:
             logger.error(f"Error fetching formats: {e}")
             raise
     
-    async def _download_with_ytdlp(self, url, download_dir, custom_caption=None, format_id=None):
+    async def _download_with_ytdlp(self, url, download_dir, custom_caption=None, format_id=None, info=None, watch=None,
+                                   route=None):
         """
         Download a file using yt-dlp
         
+        The info dict extracted while listing formats is reused when it is
+        still fresh, so the URL is only extracted again if its signed media
+        URLs have expired.
+        
         Args:
             url (str): The URL to download
             download_dir (str): Directory to save the downloaded file
             custom_caption (str, optional): Custom caption for the file
+            format_id (str, optional): yt-dlp format selector to download
+            info (dict, optional): Info dict from get_available_formats,
+                looked up in the metadata cache when omitted
+            watch (DownloadWatch, optional): Receives live progress
+            route (Route, optional): Egress route to download over
             
         Returns:
             dict: Information about the downloaded file(s)
@@ -187,9 +770,11 @@ class URLProcessor:
             'quiet': False,
             'no_warnings': False,
             'default_search': 'auto',
-            'source_address': '0.0.0.0',
-            'progress_hooks': [lambda d: print(f"Downloaded: {d['filename']}")],
+            'concurrent_fragment_downloads': HLS_CONCURRENCY,
+            'fragment_retries': FRAGMENT_RETRIES,
         }
+        if route is not None:
+            ydl_opts.update(route.ytdl_options())
         
         # If format_id is specified, use it
         if format_id:
@@ -197,52 +782,70 @@ class URLProcessor:
         
         # Download the file
         downloaded_files = []
-        download_progress = {}
-        
-        def progress_hook(d):
-            status = d.get('status')
-            if status == 'downloading':
-                # Track download progress
-                filename = d.get('filename', 'Unknown')
-                downloaded = float(d.get('downloaded_bytes', 0))
-                total = float(d.get('total_bytes', 0) or d.get('total_bytes_estimate', 0))
-                speed = float(d.get('speed', 0))
-                eta = int(d.get('eta', 0))
-                
-                # Store progress info
-                download_progress[filename] = {
-                    'downloaded': downloaded,
-                    'total': total,
-                    'speed': speed,
-                    'eta': eta,
-                    'percent': (downloaded / total * 100) if safe_compare_greater(total, 0) else 0,
-                    'timestamp': time.time()
-                }
-                
-                # Print progress for logging
-                percent = f"{downloaded / total * 100:.1f}%" if safe_compare_greater(total, 0) else "Unknown"
-                speed_str = f"{speed / 1024 / 1024:.1f} MB/s" if safe_compare_greater(speed, 0) else "Unknown"
-                print(f"Download progress: {percent} at {speed_str}, ETA: {eta} seconds")
-                
-            elif status == 'finished':
-                downloaded_files.append(d['filename'])
-                print(f"Download complete: {d['filename']}")
+        # Set when the awaiting coroutine is cancelled or times out, so the
+        # worker thread stops at the next progress callback
+        cancelled = threading.Event()
         
+        progress_hook = self._make_progress_hook(downloaded_files, cancelled, watch)
         ydl_opts['progress_hooks'] = [progress_hook]
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+        if info is None:
+            info = self.metadata_cache.get(url)
+        if info is not None and _info_expired(info):
+            logger.info(f"Extracted info has expired, re-extracting: {url}")
+            self.metadata_cache.invalidate(url)
+            info = None
+        if info is not None and route is not None and info.get('_egress', route.name) != route.name:
+            # Extracted over another route, its media URLs may not work here
+            logger.info(f"Extracted over {info['_egress']}, re-extracting over {route.name}: {url}")
+            info = None
+        
+        # A single plain HTTP format is written front to back into one file,
+        # so its parts can be uploaded before the download completes, as
+        # long as no fixup rewrites the file afterwards
+        if watch is not None and info is not None and format_id:
+            selected = next((f for f in info.get('formats') or [] if f.get('format_id') == format_id), None)
+            if selected and selected.get('protocol') in ('http', 'https'):
+                watch.streamable = True
+                ydl_opts['fixup'] = 'never'
+        
+        try:
+            try:
+                info = await run_blocking(
+                    "download", _download_info, url, ydl_opts, copy.deepcopy(info),
+                    timeout=DOWNLOAD_TIMEOUT, cancel_event=cancelled
+                )
+            except yt_dlp.utils.DownloadError as e:
+                if info is None:
+                    raise
+                # The reused media URLs may have been revoked early, retry
+                # once with a fresh extraction
+                logger.warning(f"Download from reused info failed, re-extracting: {e}")
+                self.metadata_cache.invalidate(url)
+                downloaded_files.clear()
+                info = await run_blocking(
+                    "download", _download_info, url, ydl_opts,
+                    timeout=DOWNLOAD_TIMEOUT, cancel_event=cancelled
+                )
+        except asyncio.TimeoutError:
+            cancelled.set()
+            raise TimeoutError(f"Download timed out after {DOWNLOAD_TIMEOUT} seconds")
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
         
         logger.info(f"Downloaded files: {downloaded_files}")
         
         # Get downloaded file information
         if 'entries' in info:
-            # Playlist
+            # Playlist: yt-dlp records the final file of every entry it
+            # downloaded, so failed entries cannot shift the mapping
             files = []
-            for i, entry in enumerate(info['entries']):
-                if entry and i < len(downloaded_files):
-                    file_path = downloaded_files[i]
-                    files.append(self._get_file_info_from_path(file_path, entry, custom_caption))
+            for entry in info['entries']:
+                for download in (entry or {}).get('requested_downloads') or []:
+                    file_path = download.get('filepath')
+                    if file_path and os.path.exists(file_path):
+                        files.append(self._get_file_info_from_path(file_path, entry, custom_caption))
             return {"files": files, "is_playlist": True}
         else:
             # Single file
@@ -253,6 +856,190 @@ class URLProcessor:
             else:
                 raise FileNotFoundError("No files were downloaded")
     
+    def _make_progress_hook(self, downloaded_files, cancelled, watch=None):
+        """
+        Build a yt-dlp style progress hook shared by all downloaders
+        
+        Progress is published to the job's channel on the progress bus.
+        
+        Args:
+            downloaded_files (list): Receives the path of every finished file
+            cancelled (threading.Event): Aborts the download when set
+            watch (DownloadWatch, optional): Receives live progress
+            
+        Returns:
+            callable: The progress hook
+        """
+        flow = _current_flow.get()
+        channel = _current_channel.get()
+        # Bytes per file already charged to the bandwidth flow; segment and
+        # fragment threads report concurrently
+        charged = {}
+        charged_lock = threading.Lock()
+        
+        def progress_hook(d):
+            if cancelled.is_set():
+                raise yt_dlp.utils.DownloadCancelled("Download cancelled")
+            status = d.get('status')
+            if status == 'downloading':
+                if watch is not None:
+                    watch.update(d)
+                if channel is not None:
+                    channel.publish(d)
+                
+                # Throttle by blocking the downloading thread; the first
+                # report of a file only sets the baseline (e.g. a resume)
+                if flow is not None:
+                    filename = d.get('filename', 'Unknown')
+                    downloaded = safe_float(d.get('downloaded_bytes'))
+                    with charged_lock:
+                        previous = charged.get(filename, downloaded)
+                        charged[filename] = max(previous, downloaded)
+                    flow.consume(int(max(downloaded - previous, 0)))
+                
+            elif status == 'finished':
+                downloaded_files.append(d['filename'])
+                if channel is not None:
+                    channel.publish(d)
+                logger.info(f"Download complete: {d['filename']}")
+        
+        return progress_hook
+    
+    async def _download_direct(self, url, download_dir, custom_caption=None, job_state=None, watch=None, route=None):
+        """
+        Download a direct file link over parallel Range connections
+        
+        Args:
+            url (str): The direct file URL
+            download_dir (str): Directory to save the downloaded file
+            custom_caption (str, optional): Custom caption for the file
+            job_state (JobState, optional): Persistent state for resuming
+            watch (DownloadWatch, optional): Receives live progress
+            route (Route, optional): Egress route to download over
+            
+        Returns:
+            dict: Information about the downloaded file(s), or None if the
+            link does not serve a file (e.g. an HTML page) and should be
+            handled by yt-dlp instead
+        """
+        finished = self._finished_download(job_state, 'segmented')
+        if finished:
+            return self._result_for_path(finished, custom_caption)
+        
+        downloaded_files = []
+        cancelled = threading.Event()
+        downloader = SegmentedDownloader(
+            progress_hooks=[self._make_progress_hook(downloaded_files, cancelled, watch)],
+            cancel_event=cancelled,
+            session=route.session() if route is not None else None
+        )
+        
+        try:
+            probe = await run_blocking("download", downloader.probe, url, timeout=EXTRACT_TIMEOUT)
+            if probe['content_type'].startswith('text/html'):
+                return None
+            
+            logger.info(f"Downloading direct link: {url}")
+            if watch is not None:
+                # Written in place with no post-processing
+                watch.streamable = True
+            dest_path = os.path.join(download_dir, probe['filename'])
+            await run_blocking(
+                "download", downloader.download, url, dest_path, probe,
+                job_state.progress if job_state else None,
+                job_state.checkpoint if job_state else None,
+                timeout=DOWNLOAD_TIMEOUT, cancel_event=cancelled
+            )
+            if job_state:
+                job_state.checkpoint({'kind': 'segmented', 'finished': True, 'path': dest_path}, force=True)
+        except asyncio.TimeoutError:
+            cancelled.set()
+            raise TimeoutError(f"Download timed out after {DOWNLOAD_TIMEOUT} seconds")
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        
+        return self._result_for_path(dest_path, custom_caption)
+    
+    async def _download_hls(self, url, download_dir, custom_caption=None, job_state=None, watch=None, route=None):
+        """
+        Download an HLS playlist with the parallel fragment engine
+        
+        Args:
+            url (str): The m3u8 playlist URL
+            download_dir (str): Directory to save the downloaded file
+            custom_caption (str, optional): Custom caption for the file
+            job_state (JobState, optional): Persistent state for resuming
+            watch (DownloadWatch, optional): Receives live progress (the
+                output is remuxed afterwards, so it is never streamable)
+            route (Route, optional): Egress route to download over
+            
+        Returns:
+            dict: Information about the downloaded file(s), or None if the
+            playlist is not supported (live, SAMPLE-AES, ...) and should be
+            handled by yt-dlp instead
+        """
+        finished = self._finished_download(job_state, 'hls')
+        if finished:
+            return self._result_for_path(finished, custom_caption)
+        
+        downloaded_files = []
+        cancelled = threading.Event()
+        downloader = HLSDownloader(
+            progress_hooks=[self._make_progress_hook(downloaded_files, cancelled, watch)],
+            cancel_event=cancelled,
+            session=route.session() if route is not None else None
+        )
+        
+        title = os.path.splitext(os.path.basename(urlsplit(url).path))[0] or 'video'
+        title = re.sub(r'[^\w.-]', '_', title)
+        try:
+            try:
+                playlist = await run_blocking("download", downloader.load, url, timeout=EXTRACT_TIMEOUT)
+            except UnsupportedPlaylist as e:
+                logger.info(f"Leaving HLS playlist to yt-dlp: {e}")
+                return None
+            
+            logger.info(f"Downloading {len(playlist['fragments'])} HLS fragments: {url}")
+            ext = 'mp4' if playlist.get('init') else 'ts'
+            dest_path = os.path.join(download_dir, f"{title}.{ext}")
+            await run_blocking(
+                "download", downloader.download, url, dest_path, playlist,
+                job_state.progress if job_state else None,
+                job_state.checkpoint if job_state else None,
+                timeout=DOWNLOAD_TIMEOUT, cancel_event=cancelled
+            )
+            if ext == 'ts':
+                dest_path = await run_blocking(
+                    "download", _remux_to_mp4, dest_path, os.path.join(download_dir, f"{title}.mp4")
+                )
+            if job_state:
+                job_state.checkpoint({'kind': 'hls', 'finished': True, 'path': dest_path}, force=True)
+        except asyncio.TimeoutError:
+            cancelled.set()
+            raise TimeoutError(f"Download timed out after {DOWNLOAD_TIMEOUT} seconds")
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        
+        return self._result_for_path(dest_path, custom_caption)
+    
+    def _finished_download(self, job_state, kind):
+        """Return the file a resumed job already finished downloading, or None"""
+        if job_state is None:
+            return None
+        progress = job_state.progress
+        if progress.get('kind') == kind and progress.get('finished') and os.path.exists(progress.get('path', '')):
+            logger.info(f"Download already finished before restart: {progress['path']}")
+            return progress['path']
+        return None
+    
+    def _result_for_path(self, file_path, custom_caption=None):
+        """Build a download result for a single file downloaded without yt-dlp"""
+        title = os.path.splitext(os.path.basename(file_path))[0]
+        file_info = self._get_file_info_from_path(file_path, {'title': title}, custom_caption)
+        return {"files": [file_info], "is_playlist": False}
+    
     async def _process_zoom_url(self, url, download_dir, custom_caption=None):
         """
         Process a Zoom recording URL
@@ -348,9 +1135,135 @@ class URLProcessor:
         
         return self._get_file_info_from_path(filename, info, custom_caption)
     
+    async def stream_split(self, watch, chunk_size=MAX_FILE_SIZE, poll_interval=1.0):
+        """
+        Cut parts of a file as soon as their byte range has been downloaded
+        
+        Args:
+            watch (DownloadWatch): Watch passed to download() for a
+                streamable download
+            chunk_size (int): Maximum size of each part
+            poll_interval (float): Seconds between checks for new data
+            
+        Yields:
+            dict: {'index', 'count', 'window'} for each part, in order, where
+            window is a FileWindow the caller must close; count is None
+            while the total size is unknown
+        """
+        index = 0
+        fd = None
+        try:
+            while not watch.failed:
+                start = index * chunk_size
+                complete = watch.ready_bytes >= start + chunk_size
+                last = watch.finished and (watch.total or watch.ready_bytes) > start
+                if not (complete or last):
+                    if watch.finished:
+                        return
+                    await asyncio.sleep(poll_interval)
+                    continue
+                
+                if fd is None:
+                    # Keep one descriptor open: it stays valid when the
+                    # .part file is renamed on completion
+                    path = watch.path if os.path.exists(watch.path) else watch.filename
+                    fd = os.open(path, os.O_RDONLY)
+                
+                end = start + chunk_size if complete else (watch.total or watch.ready_bytes)
+                count = -(-watch.total // chunk_size) if watch.total else None
+                name = f"{os.path.basename(watch.filename)}.part{index+1:03d}"
+                window = FileWindow(watch.filename, start, end - start, name=name, fd=fd)
+                yield {'index': index, 'count': count, 'window': window}
+                index += 1
+        finally:
+            if fd is not None:
+                os.close(fd)
+    
+    def split_windows(self, file_path, chunk_size=MAX_FILE_SIZE):
+        """
+        Split a large file into read windows for Telegram upload
+        
+        No data is copied: each part is read from its offset in the
+        original file while it is uploaded.
+        
+        Args:
+            file_path (str): Path to the file to split
+            chunk_size (int): Maximum size of each part
+            
+        Returns:
+            list: FileWindow objects, one per part; close them after use
+        """
+        file_size = os.path.getsize(file_path)
+        base_name = os.path.basename(file_path)
+        if file_size <= chunk_size:
+            return [FileWindow(file_path, 0, file_size)]
+        
+        num_chunks = (file_size + chunk_size - 1) // chunk_size
+        logger.info(f"Splitting large file into {num_chunks} windows: {file_path}")
+        return [
+            FileWindow(file_path, i * chunk_size, min(chunk_size, file_size - i * chunk_size),
+                       name=f"{base_name}.part{i+1:03d}")
+            for i in range(num_chunks)
+        ]
+    
+    async def split_video(self, file_path, chunk_size=MAX_FILE_SIZE):
+        """
+        Split a large video into standalone playable parts
+        
+        Parts are cut on keyframes with ffmpeg stream copy (no re-encoding),
+        several at a time, and keep the container of the original.
+        
+        Args:
+            file_path (str): Path to the video to split
+            chunk_size (int): Maximum size of each part
+            
+        Returns:
+            list: Paths of the parts, or None if the file cannot be split
+            this way (no ffmpeg, not a video, keyframes too far apart) and
+            should be split by bytes instead
+        """
+        if not video_split_available():
+            return None
+        
+        file_size = os.path.getsize(file_path)
+        try:
+            keyframes = await run_blocking("split", _keyframe_offsets, file_path)
+        except IOError as e:
+            logger.warning(f"Cannot split {file_path} on keyframes: {e}")
+            return None
+        cuts = _plan_video_cuts(keyframes, file_size, chunk_size)
+        if not cuts or len(cuts) < 2:
+            return None
+        
+        stem, ext = os.path.splitext(os.path.basename(file_path))
+        split_dir = tempfile.mkdtemp(prefix="split_", dir=os.path.dirname(file_path))
+        logger.info(f"Splitting video into {len(cuts)} parts: {file_path}")
+        
+        jobs = []
+        for i, start in enumerate(cuts):
+            part_path = os.path.join(split_dir, f"{stem}.part{i+1:03d}{ext}")
+            duration = cuts[i + 1] - start if i + 1 < len(cuts) else None
+            jobs.append(run_blocking("split", _cut_video, file_path, part_path, start, duration))
+        # Let every ffmpeg finish before cleaning up after a failure
+        part_paths = await asyncio.gather(*jobs, return_exceptions=True)
+        try:
+            for path in part_paths:
+                if isinstance(path, BaseException):
+                    raise path
+                if os.path.getsize(path) > chunk_size:
+                    raise IOError("a part came out larger than the size limit")
+        except IOError as e:
+            logger.warning(f"Video split failed, splitting by bytes: {e}")
+            shutil.rmtree(split_dir, ignore_errors=True)
+            return None
+        return part_paths
+    
     async def split_large_file(self, file_path, chunk_size=MAX_FILE_SIZE):
         """
-        Split a large file into smaller chunks for Telegram upload
+        Split a large file into smaller chunk files for Telegram upload
+        
+        Prefer split_windows(), which needs neither the disk space nor the
+        copy; this is for callers that need the parts as real files.
         
         Args:
             file_path (str): Path to the file to split
@@ -367,20 +1280,23 @@ class URLProcessor:
         
         # Create a directory for the split files
         base_name = os.path.basename(file_path)
-        split_dir = os.path.join(os.path.dirname(file_path), f"split_{int(time.time())}")
-        os.makedirs(split_dir, exist_ok=True)
+        split_dir = tempfile.mkdtemp(prefix="split_", dir=os.path.dirname(file_path))
         
         # Calculate number of chunks
         num_chunks = (file_size + chunk_size - 1) // chunk_size
         
-        # Split the file
+        # Split the file with kernel-side copies
         chunk_paths = []
-        with open(file_path, 'rb') as f:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
             for i in range(num_chunks):
                 chunk_path = os.path.join(split_dir, f"{base_name}.part{i+1:03d}")
-                with open(chunk_path, 'wb') as chunk:
-                    chunk.write(f.read(chunk_size))
+                offset = i * chunk_size
+                await run_blocking("download", _copy_range, fd, chunk_path,
+                                   offset, min(chunk_size, file_size - offset))
                 chunk_paths.append(chunk_path)
+        finally:
+            os.close(fd)
         
         logger.info(f"Split file into {len(chunk_paths)} chunks")
         return chunk_paths
@@ -401,8 +1317,10 @@ async def main():
             print(f"Caption: {file_info['caption']}")
             
             if file_info['needs_splitting']:
-                chunks = await processor.split_large_file(file_info['file_path'])
-                print(f"Split into {len(chunks)} chunks")
+                windows = processor.split_windows(file_info['file_path'])
+                print(f"Split into {len(windows)} parts")
+                for window in windows:
+                    window.close()
     
     except Exception as e:
         print(f"Error: {e}")
@@ -4,10 +4,17 @@
 Utility functions for type-safe operations and data handling
 """
 
+import os
+import hashlib
 import logging
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 logger = logging.getLogger(__name__)
 
+# Largest file whose content is hashed for upload de-duplication; hashing
+# a multi-GB file would delay its upload for longer than it could save
+CONTENT_HASH_MAX_SIZE = int(os.environ.get("CONTENT_HASH_MAX_SIZE", 256 * 1024 * 1024))
+
 def safe_int(value, default=0):
     """
     Safely convert a value to integer
@@ -161,6 +168,30 @@ def sanitize_formats_list(formats_list):
     
     return [sanitize_format_data(fmt) for fmt in formats_list]
 
+def estimate_format_size(fmt, duration=None):
+    """
+    Estimate the download size of a yt-dlp format
+    
+    Args:
+        fmt: Format dictionary from yt-dlp
+        duration: Media duration in seconds, if not part of the format
+        
+    Returns:
+        int: filesize, filesize_approx or bitrate x duration in bytes, 0 if
+        unknown
+    """
+    size = safe_int(fmt.get('filesize')) or safe_int(fmt.get('filesize_approx'))
+    if size > 0:
+        return size
+    
+    # tbr is the total bitrate in kbit/s, some sites only give the video
+    # and audio bitrates
+    tbr = safe_float(fmt.get('tbr')) or safe_float(fmt.get('vbr')) + safe_float(fmt.get('abr'))
+    duration = safe_float(fmt.get('duration') or duration)
+    if tbr > 0 and duration > 0:
+        return int(tbr * 1000 / 8 * duration)
+    return 0
+
 def format_file_size(size_bytes, default="Unknown size"):
     """
     Format file size in bytes to human readable format
@@ -186,3 +217,76 @@ def format_file_size(size_bytes, default="Unknown size"):
         return f"{size_mb:.1f} MB"
     else:
         return f"{size_mb / 1024:.1f} GB"
+
+# Query parameters that only carry tracking/referral data
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'yclid', 'msclkid', 'igshid', 'si', 'feature',
+    'ref', 'ref_src', 'ref_url', 'mc_cid', 'mc_eid', '_ga', 'spm', 'share_id',
+}
+
+YOUTUBE_HOSTS = {'youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com'}
+
+def canonicalize_url(url):
+    """
+    Normalize a URL so that equivalent links map to the same cache key
+    
+    Lowercases the scheme and host, drops the fragment, default ports and
+    tracking parameters, sorts the remaining query and rewrites youtu.be,
+    shorts and embed links to the youtube.com/watch?v= form.
+    
+    Args:
+        url: URL to normalize
+        
+    Returns:
+        str: Canonical URL (the input unchanged if it cannot be parsed)
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except (ValueError, AttributeError):
+        return url
+    
+    scheme = (parts.scheme or 'http').lower()
+    host = (parts.hostname or '').lower()
+    port = parts.port if parts.port not in (None, 80, 443) else None
+    path = parts.path or '/'
+    query = [
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith('utm_')
+    ]
+    
+    # YouTube: reduce every video link form to watch?v=<id>
+    video_id = None
+    if host == 'youtu.be':
+        video_id = path.strip('/').split('/')[0]
+    elif host in YOUTUBE_HOSTS:
+        segments = path.strip('/').split('/')
+        if segments[0] == 'watch':
+            video_id = dict(query).get('v')
+        elif segments[0] in ('shorts', 'embed', 'live', 'v') and len(segments) > 1:
+            video_id = segments[1]
+    if video_id:
+        return f"https://www.youtube.com/watch?v={video_id}"
+    
+    netloc = f"{host}:{port}" if port else host
+    return urlunsplit((scheme, netloc, path, urlencode(sorted(query)), ''))
+
+def file_content_hash(file_path, block_size=1024 * 1024, max_size=CONTENT_HASH_MAX_SIZE):
+    """
+    Compute a content hash of a file for upload de-duplication
+    
+    Args:
+        file_path: Path to the file
+        block_size: Read size in bytes
+        max_size: Larger files are not hashed
+        
+    Returns:
+        str: Hex digest prefixed with the file size, or None if the file
+        is larger than max_size
+    """
+    if os.path.getsize(file_path) > max_size:
+        return None
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return f"{os.path.getsize(file_path)}-{digest.hexdigest()}"
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-job download directories with leases, and a janitor that reclaims them.
+
+Every job gets its own directory under the download location, leased to
+the process running the job until the job releases it. Directories whose
+lease ran out (the process crashed or exited) are removed by a background
+sweeper, together with stale .part files and empty split_* directories.
+Interrupted jobs that can still be resumed are kept for a while.
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+
+from job_state import STATE_FILENAME, _pid_alive
+
+logger = logging.getLogger(__name__)
+
+# Prefix of job directories; nothing else under the download location
+# (e.g. per-user thumbnails) is ever touched by the janitor
+WORKSPACE_PREFIX = "job_"
+LEASE_FILENAME = ".lease"
+# Seconds a lease stays valid without being renewed
+WORKSPACE_LEASE_TTL = int(os.environ.get("WORKSPACE_LEASE_TTL", 30 * 60))
+# Seconds an interrupted, resumable job directory is kept
+RESUME_MAX_AGE = int(os.environ.get("RESUME_MAX_AGE", 24 * 3600))
+# Seconds after which an untouched .part file in a directory in use is a
+# leftover of an earlier attempt
+STALE_PART_AGE = int(os.environ.get("STALE_PART_AGE", 6 * 3600))
+# Seconds between two janitor sweeps, which also renew this process' leases
+JANITOR_INTERVAL = int(os.environ.get("JANITOR_INTERVAL", 600))
+# Bytes idle job directories may occupy in total before the oldest are
+# removed, even if resumable (0 disables the budget)
+WORKSPACE_DISK_BUDGET = int(os.environ.get("WORKSPACE_DISK_BUDGET", 0))
+
+
+class WorkspaceManager:
+    """Hands out job directories and sweeps the ones nobody holds anymore"""
+
+    def __init__(self, root, lease_ttl=WORKSPACE_LEASE_TTL, disk_budget=WORKSPACE_DISK_BUDGET):
+        """
+        Initialize the manager
+
+        Args:
+            root (str): Download location holding the job directories
+            lease_ttl (int): Seconds a lease is valid without renewal
+            disk_budget (int): Byte budget for idle job directories
+        """
+        self.root = root
+        self.lease_ttl = lease_ttl
+        self.disk_budget = disk_budget
+        self._lock = threading.Lock()
+        self._janitor = None
+        # Directories leased by this process
+        self._held = set()
+
+    def create(self, job_id=None):
+        """
+        Create a new, unique job directory and lease it
+
+        Args:
+            job_id (str, optional): Included in the directory name for
+                easier debugging
+
+        Returns:
+            str: Path of the directory
+        """
+        os.makedirs(self.root, exist_ok=True)
+        prefix = f"{WORKSPACE_PREFIX}{int(time.time())}_{job_id + '_' if job_id else ''}"
+        path = tempfile.mkdtemp(prefix=prefix, dir=self.root)
+        self.adopt(path)
+        return path
+
+    def adopt(self, path):
+        """Lease an existing job directory, e.g. one of a resumed job"""
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._held.add(os.path.abspath(path))
+        self.renew(path)
+
+    def renew(self, path):
+        """Extend the lease on a job directory"""
+        lease = {'pid': os.getpid(), 'expires': time.time() + self.lease_ttl}
+        tmp_path = os.path.join(path, LEASE_FILENAME + '.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(lease, f)
+            os.replace(tmp_path, os.path.join(path, LEASE_FILENAME))
+        except OSError as e:
+            logger.warning(f"Could not renew lease on {path}: {e}")
+
+    def release(self, path):
+        """Remove a job directory and everything left in it"""
+        if not path:
+            return
+        with self._lock:
+            self._held.discard(os.path.abspath(path))
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def start_janitor(self, interval=JANITOR_INTERVAL):
+        """Sweep in a background thread every interval seconds (idempotent)"""
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._janitor = threading.Thread(
+                target=self._janitor_loop, args=(interval,),
+                name="workspace-janitor", daemon=True
+            )
+            self._janitor.start()
+
+    def _janitor_loop(self, interval):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Workspace sweep failed: {e}")
+            time.sleep(interval)
+
+    def sweep(self):
+        """
+        Reclaim disk space from job directories nobody holds anymore
+
+        Returns:
+            int: Number of bytes freed
+        """
+        with self._lock:
+            held = set(self._held)
+        for path in held:
+            self.renew(path)
+
+        if not os.path.isdir(self.root):
+            return 0
+        now = time.time()
+        freed = 0
+        idle = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.startswith(WORKSPACE_PREFIX) or not os.path.isdir(path):
+                continue
+            _remove_empty_split_dirs(path)
+            # Checked live, as jobs may create directories during the scan
+            if self._holds(path) or self._leased(path, now):
+                # In use, only leftovers of earlier attempts can go
+                freed += _remove_stale_parts(path, now)
+                continue
+
+            modified = _last_modified(path)
+            resumable = os.path.exists(os.path.join(path, STATE_FILENAME))
+            if not resumable or now - modified > RESUME_MAX_AGE:
+                size = _tree_size(path)
+                if self._reclaim(path):
+                    freed += size
+                    logger.info(f"Removed abandoned workspace {path}")
+                continue
+            idle.append((modified, path))
+
+        # Over budget: drop the oldest idle directories, resumable or not
+        if self.disk_budget:
+            usage = [(modified, path, _tree_size(path)) for modified, path in idle]
+            total = sum(size for _, _, size in usage)
+            for modified, path, size in sorted(usage):
+                if total <= self.disk_budget:
+                    break
+                if not self._reclaim(path):
+                    continue
+                total -= size
+                freed += size
+                logger.info(f"Removed idle workspace {path} to stay within the disk budget")
+        return freed
+
+    def _holds(self, path):
+        with self._lock:
+            return os.path.abspath(path) in self._held
+
+    def _reclaim(self, path):
+        """Remove a directory unless a job of this process picked it up meanwhile"""
+        with self._lock:
+            if os.path.abspath(path) in self._held:
+                return False
+            shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    def _leased(self, path, now):
+        """Check whether a live process holds an unexpired lease on path"""
+        try:
+            with open(os.path.join(path, LEASE_FILENAME), 'r', encoding='utf-8') as f:
+                lease = json.load(f)
+        except (OSError, ValueError):
+            # Just created and not leased yet, or the lease file is torn
+            return now - _last_modified(path) < self.lease_ttl
+        pid = lease.get('pid', 0)
+        # Our own pid on a lease we do not hold is a previous run's (e.g.
+        # pid 1 in a restarted container)
+        return lease.get('expires', 0) > now and pid != os.getpid() and _pid_alive(pid)
+
+
+def _last_modified(path):
+    """Newest modification time of path and the files below it"""
+    newest = os.path.getmtime(path)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                newest = max(newest, os.path.getmtime(os.path.join(root, name)))
+            except OSError:
+                pass
+    return newest
+
+
+def _tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove_empty_split_dirs(path):
+    for name in os.listdir(path):
+        split_dir = os.path.join(path, name)
+        if name.startswith('split_') and os.path.isdir(split_dir) and not os.listdir(split_dir):
+            try:
+                os.rmdir(split_dir)
+            except OSError:
+                pass
+
+
+def _remove_stale_parts(path, now):
+    """Remove .part files not written to for STALE_PART_AGE seconds"""
+    freed = 0
+    for name in os.listdir(path):
+        part_path = os.path.join(path, name)
+        if not name.endswith('.part'):
+            continue
+        try:
+            if now - os.path.getmtime(part_path) > STALE_PART_AGE:
+                freed += os.path.getsize(part_path)
+                os.remove(part_path)
+                logger.info(f"Removed stale partial download {part_path}")
+        except OSError:
+            pass
+    return freed
+
+
+# Shared manager for the bot's download location
+workspaces = WorkspaceManager("./DOWNLOADS")
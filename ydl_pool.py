@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pool of warm YoutubeDL instances.
+
+Constructing a YoutubeDL costs tens of milliseconds, and its extractor
+instances keep per-process caches (e.g. YouTube's player and signature
+functions) that are lost when it is thrown away. Extractions therefore
+borrow an instance from a pool keyed by their option profile and hand it
+back afterwards. Extractors are imported once at startup, and every
+instance shares a persistent cache directory, so cached data survives
+restarts too.
+
+Run this module to benchmark the setup cost of a request with and without
+the pool.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+
+from startup import lazy_import
+
+# Loaded on first use
+yt_dlp = lazy_import("yt_dlp")
+
+logger = logging.getLogger(__name__)
+
+# Persistent yt-dlp cache (player code, signature functions, ...)
+YTDL_CACHE_DIR = os.environ.get("YTDL_CACHE_DIR", "./.cache/yt-dlp")
+# Idle instances kept per option profile
+YDL_POOL_SIZE = int(os.environ.get("YDL_POOL_SIZE", 4))
+# Load the extractors at startup; turn off where processes are short-lived
+# and mostly never download anything
+YTDL_PRELOAD = os.environ.get("YTDL_PRELOAD", "1") != "0"
+
+
+def with_cache_dir(ydl_opts):
+    """Return ydl_opts using the shared cache directory unless it sets its own"""
+    return dict({'cachedir': YTDL_CACHE_DIR}, **ydl_opts)
+
+
+def _profile_key(ydl_opts):
+    # Options holding callables (e.g. progress hooks) never match another
+    # profile, as their repr includes the object's identity
+    return json.dumps(ydl_opts, sort_keys=True, default=repr)
+
+
+class YDLPool:
+    """Idle YoutubeDL instances by option profile"""
+
+    def __init__(self, size=YDL_POOL_SIZE):
+        """
+        Initialize the pool
+
+        Args:
+            size (int): Idle instances kept per profile, 0 disables pooling
+        """
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle = {}
+        self.created = 0
+        self.reused = 0
+
+    @contextlib.contextmanager
+    def instance(self, ydl_opts):
+        """
+        Borrow a YoutubeDL for the given options
+
+        The instance goes back to the pool when the block completes, and is
+        closed instead if the block raised, so no half-broken state is
+        handed on.
+
+        Args:
+            ydl_opts (dict): yt-dlp options; the shared cache directory is
+                added unless cachedir is set
+
+        Yields:
+            yt_dlp.YoutubeDL: An instance for the exclusive use of the caller
+        """
+        ydl_opts = with_cache_dir(ydl_opts)
+        key = _profile_key(ydl_opts)
+        with self._lock:
+            idle = self._idle.get(key)
+            ydl = idle.pop() if idle else None
+            if ydl is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(ydl_opts)
+        try:
+            yield ydl
+        except BaseException:
+            _close(ydl)
+            raise
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.size:
+                idle.append(ydl)
+                ydl = None
+        if ydl is not None:
+            _close(ydl)
+
+    def clear(self):
+        """Close every idle instance"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for instances in idle.values():
+            for ydl in instances:
+                _close(ydl)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'profiles': len(self._idle),
+                'idle': sum(len(instances) for instances in self._idle.values()),
+                'created': self.created,
+                'reused': self.reused,
+            }
+
+
+def _close(ydl):
+    try:
+        ydl.close()
+    except Exception as e:
+        logger.debug(f"Error closing YoutubeDL: {e}")
+
+
+def preload_extractors():
+    """
+    Import all extractor classes now instead of on the first request
+
+    Returns:
+        float: Seconds it took
+    """
+    started = time.perf_counter()
+    if hasattr(yt_dlp.extractor, 'import_extractors'):
+        yt_dlp.extractor.import_extractors()
+    else:
+        list(yt_dlp.extractor.gen_extractor_classes())
+    os.makedirs(YTDL_CACHE_DIR, exist_ok=True)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Loaded yt-dlp extractors in {elapsed:.2f}s")
+    return elapsed
+
+
+def start_preload(enabled=None):
+    """
+    Preload the extractors in the background, so startup is not delayed
+
+    Args:
+        enabled (bool, optional): Overrides YTDL_PRELOAD, e.g. for an
+            entry point with a different default
+    """
+    if not (YTDL_PRELOAD if enabled is None else enabled):
+        return
+    threading.Thread(target=preload_extractors, name="ytdlp-preload", daemon=True).start()
+
+
+# Shared pool for extractions in this process
+ydl_pool = YDLPool()
+
+
+def benchmark(requests=50, ydl_opts=None):
+    """
+    Measure the per-request setup cost without and with the pool
+
+    Setup is creating the YoutubeDL and getting the extractor a YouTube
+    URL would use, i.e. everything before the first network request.
+
+    Returns:
+        dict: {'preload', 'fresh', 'pooled'}, seconds per request after the
+        one-off preload
+    """
+    ydl_opts = ydl_opts or {'quiet': True, 'no_warnings': True, 'default_search': 'auto'}
+    results = {'preload': preload_extractors()}
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        ydl = yt_dlp.YoutubeDL(with_cache_dir(ydl_opts))
+        ydl.get_info_extractor('Youtube')
+        _close(ydl)
+    results['fresh'] = (time.perf_counter() - started) / requests
+
+    pool = YDLPool(size=1)
+    started = time.perf_counter()
+    for _ in range(requests):
+        with pool.instance(ydl_opts) as ydl:
+            ydl.get_info_extractor('Youtube')
+    results['pooled'] = (time.perf_counter() - started) / requests
+    pool.clear()
+    return results
+
+
+if __name__ == "__main__":
+    results = benchmark()
+    print(f"Extractor preload (once): {results['preload'] * 1000:.1f} ms")
+    print(f"Setup per request, new YoutubeDL: {results['fresh'] * 1000:.2f} ms")
+    print(f"Setup per request, pooled: {results['pooled'] * 1000:.2f} ms")